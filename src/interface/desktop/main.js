@@ -5,6 +5,7 @@ const khojPackage = require('./package.json');
 todesktop.init();
 
 const fs = require('fs');
+const crypto = require('crypto');
 const {dialog} = require('electron');
 
 const cron = require('cron').CronJob;
@@ -207,7 +208,8 @@ function pushDataToKhoj (regenerate = false) {
             let mimeType = filenameToMimeType(file) + (encoding === "utf8" ? "; charset=UTF-8" : "");
             let fileContent = Buffer.from(fs.readFileSync(file, { encoding: encoding }), encoding);
             let fileObj = new Blob([fileContent], { type: mimeType });
-            filesDataToPush.push({blob: fileObj, path: file});
+            let fileHash = crypto.createHash('md5').update(fileContent).digest('hex');
+            filesDataToPush.push({blob: fileObj, path: file, hash: fileHash, size: fileContent.length});
             state[file] = {
                 success: true,
             }
@@ -231,29 +233,54 @@ function pushDataToKhoj (regenerate = false) {
     // Send collected files to Khoj server for indexing
     const hostURL = store.get('hostURL') || KHOJ_URL;
     const headers = { 'Authorization': `Bearer ${store.get("khojToken")}` };
-    let requests = [];
-
-    // Request indexing files on server. With upto 1000 files in each request
-    for (let i = 0; i < filesDataToPush.length; i += 1000) {
-        const syncUrl = `${hostURL}/api/content?client=desktop`;
-        const filesDataGroup = filesDataToPush.slice(i, i + 1000);
-        const formData = new FormData();
-        filesDataGroup.forEach(fileData => { formData.append('files', fileData.blob, fileData.path) });
-        requests.push(
-            regenerate
-            ? axios.put(syncUrl, formData, { headers })
-            : axios.patch(syncUrl, formData, { headers })
+
+    // Ask Khoj server which collected files it needs, to avoid uploading files it has already indexed
+    const manifest = filesDataToPush
+        .filter(fileData => fileData.hash)
+        .map(fileData => ({ path: fileData.path, hash: fileData.hash, size: fileData.size }));
+    const manifestDiff = regenerate || manifest.length === 0
+        ? Promise.resolve(null)
+        : axios.post(`${hostURL}/api/content/manifest?client=desktop`, { files: manifest }, { headers })
+            .then(response => response.data)
+            .catch(error => {
+                // Fallback to uploading all collected files if server does not support manifest based sync
+                console.warn(`Failed to diff file manifest with Khoj server. Uploading all collected files: ${error.message}`);
+                return null;
+            });
+
+    manifestDiff
+    .then(diff => {
+        const filesToUpload = diff ? new Set(diff.upload) : null;
+        const unchangedFiles = new Set(
+            filesDataToPush
+                .filter(fileData => filesToUpload && fileData.hash && !filesToUpload.has(fileData.path))
+                .map(fileData => fileData.path)
         );
-    }
+        const filesDataToUpload = filesDataToPush.filter(fileData => !unchangedFiles.has(fileData.path));
+        let requests = [];
+
+        // Request indexing files on server. With upto 1000 files in each request
+        for (let i = 0; i < filesDataToUpload.length; i += 1000) {
+            const syncUrl = `${hostURL}/api/content?client=desktop`;
+            const filesDataGroup = filesDataToUpload.slice(i, i + 1000);
+            const formData = new FormData();
+            filesDataGroup.forEach(fileData => { formData.append('files', fileData.blob, fileData.path) });
+            requests.push(
+                regenerate
+                ? axios.put(syncUrl, formData, { headers })
+                : axios.patch(syncUrl, formData, { headers })
+            );
+        }
 
-    // Wait for requests batch to finish
-    Promise
-    .all(requests)
-    .then(responses => {
-        const lastSync = filesToPush
-            .filter(file => responses.find(response => response.data.includes(file)))
-            .map(file => ({ path: file, datetime: new Date().toISOString() }));
-        store.set('lastSync', lastSync);
+        // Wait for requests batch to finish
+        return Promise
+        .all(requests)
+        .then(responses => {
+            const lastSync = filesToPush
+                .filter(file => unchangedFiles.has(file) || responses.find(response => response.data.includes(file)))
+                .map(file => ({ path: file, datetime: new Date().toISOString() }));
+            store.set('lastSync', lastSync);
+        });
     })
     .catch(error => {
         console.error(error);
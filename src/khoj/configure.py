@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import threading
 from datetime import datetime
 from enum import Enum
 from functools import wraps
@@ -34,6 +35,7 @@ from khoj.database.adapters import (
     ClientApplicationAdapters,
     ConversationAdapters,
     ProcessLockAdapters,
+    WebCacheAdapters,
     aget_or_create_user_by_phone_number,
     aget_user_by_phone_number,
     ais_user_subscribed,
@@ -42,6 +44,7 @@ from khoj.database.adapters import (
     get_or_create_search_models,
 )
 from khoj.database.models import ClientApplication, KhojUser, ProcessLock, Subscription
+from khoj.processor.conversation.tokenizers import tokenizers
 from khoj.processor.embeddings import CrossEncoderModel, EmbeddingsModel
 from khoj.routers.api_content import configure_content, configure_search
 from khoj.routers.twilio import is_twilio_enabled
@@ -271,6 +274,14 @@ def configure_server(
         state.search_models = configure_search(state.search_models, state.config.search_type)
         setup_default_agent(user)
 
+        if init:
+            # Load tokenizers of configured chat models in the background, ahead of their first use
+            chat_models = [
+                (chat_model.name, chat_model.tokenizer)
+                for chat_model in ConversationAdapters.get_conversation_processor_options()
+            ]
+            threading.Thread(target=tokenizers.preload, args=(chat_models,), daemon=True).start()
+
         message = (
             "📡 Telemetry disabled"
             if telemetry_disabled(state.config.app, state.telemetry_disabled)
@@ -294,7 +305,7 @@ def initialize_content(user: KhojUser, regenerate: bool, search_type: Optional[S
     if state.search_models:
         try:
             logger.info("📬 Updating content index...")
-            all_files = collect_files(user=user)
+            all_files = collect_files(user=user, skip_unchanged=not regenerate)
             status = configure_content(
                 user,
                 all_files,
@@ -365,7 +376,7 @@ def configure_middleware(app, ssl_enabled: bool = False):
 
 def update_content_index():
     for user in get_all_users():
-        all_files = collect_files(user=user)
+        all_files = collect_files(user=user, skip_unchanged=True)
         success = configure_content(user, all_files)
     if not success:
         raise RuntimeError("Failed to update content index")
@@ -421,6 +432,13 @@ def delete_old_user_requests():
     logger.debug(f"🗑️ Deleted {num_deleted[0]} day-old user requests")
 
 
+@schedule.repeat(schedule.every(59).minutes)
+@clean_connections
+def delete_expired_web_cache():
+    num_deleted = WebCacheAdapters.delete_expired()
+    logger.debug(f"🗑️ Deleted {num_deleted[0]} expired web search results and pages from cache")
+
+
 @schedule.repeat(schedule.every(17).minutes)
 @clean_connections
 def wakeup_scheduler():
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import logging
 import math
@@ -5,7 +6,6 @@ import os
 import random
 import re
 import secrets
-import sys
 from datetime import date, datetime, timedelta, timezone
 from enum import Enum
 from functools import wraps
@@ -17,6 +17,7 @@ from typing import (
     List,
     Optional,
     ParamSpec,
+    Tuple,
     TypeVar,
 )
 
@@ -24,7 +25,21 @@ import cron_descriptor
 from apscheduler.job import Job
 from asgiref.sync import sync_to_async
 from django.contrib.sessions.backends.db import SessionStore
-from django.db.models import Prefetch, Q
+from django.db import connection, transaction
+from django.db.models import (
+    BigIntegerField,
+    Count,
+    Exists,
+    F,
+    Func,
+    Max,
+    OuterRef,
+    Prefetch,
+    Q,
+    QuerySet,
+    Sum,
+)
+from django.db.models.functions import Coalesce
 from django.db.models.manager import BaseManager
 from django.db.utils import IntegrityError
 from django_apscheduler import util
@@ -39,6 +54,7 @@ from khoj.database.models import (
     ChatModel,
     ClientApplication,
     Conversation,
+    ConversationMessage,
     Entry,
     FileObject,
     GithubConfig,
@@ -56,10 +72,12 @@ from khoj.database.models import (
     Subscription,
     TextToImageModelConfig,
     UserConversationConfig,
+    UserIndexedDataStats,
     UserRequests,
     UserTextToImageModelConfig,
     UserVoiceModelConfig,
     VoiceModelOption,
+    WebCache,
     WebScraper,
 )
 from khoj.processor.conversation import prompts
@@ -541,9 +559,20 @@ async def set_user_github_config(user: KhojUser, pat_token: str, repos: list):
     else:
         config.pat_token = pat_token
         await config.asave()
-        await config.githubrepoconfig.all().adelete()
+
+    # Retain previously configured repos to keep their indexed state
+    configured_repos = {(repo["owner"], repo["name"], repo["branch"]) for repo in repos}
+    retained_repos = set()
+    async for repo_config in config.githubrepoconfig.all():
+        repo_key = (repo_config.owner, repo_config.name, repo_config.branch)
+        if repo_key in configured_repos:
+            retained_repos.add(repo_key)
+        else:
+            await repo_config.adelete()
 
     for repo in repos:
+        if (repo["owner"], repo["name"], repo["branch"]) in retained_repos:
+            continue
         await GithubRepoConfig.objects.acreate(
             name=repo["name"], owner=repo["owner"], branch=repo["branch"], github_config=config
         )
@@ -901,7 +930,62 @@ class AgentAdapters:
 class PublicConversationAdapters:
     @staticmethod
     def get_public_conversation_by_slug(slug: str):
-        return PublicConversation.objects.filter(slug=slug).first()
+        return PublicConversation.objects.filter(slug=slug).defer("conversation_log").first()
+
+    @staticmethod
+    def get_public_conversation_messages(
+        public_conversation: PublicConversation,
+        before_turn_id: str = None,
+        after_turn_id: str = None,
+        turn_id: str = None,
+        limit: int = None,
+        skip_latest: int = 0,
+        include_heavy_fields: bool = True,
+    ) -> Tuple[List[dict], bool]:
+        """
+        Get a page of messages of the public conversation, like ConversationAdapters.get_conversation_messages.
+        The conversation log is sliced in the database, so the whole log is never loaded.
+        """
+        oldest_first = after_turn_id is not None and before_turn_id is None
+        query = f"""
+            WITH chat AS (
+                SELECT message, position
+                FROM {PublicConversation._meta.db_table} AS public_conversation,
+                    jsonb_array_elements(public_conversation.conversation_log -> 'chat')
+                    WITH ORDINALITY AS messages(message, position)
+                WHERE public_conversation.id = %(id)s
+            )
+            SELECT message - %(heavy_fields)s::text[] FROM chat
+            WHERE (%(turn_id)s::text IS NULL OR message ->> 'turnId' = %(turn_id)s)
+            AND (
+                %(before)s::text IS NULL
+                OR position < (SELECT min(position) FROM chat WHERE message ->> 'turnId' = %(before)s)
+            )
+            AND (
+                %(after)s::text IS NULL
+                OR position > (SELECT max(position) FROM chat WHERE message ->> 'turnId' = %(after)s)
+            )
+            ORDER BY position {"ASC" if oldest_first else "DESC"}
+            OFFSET %(offset)s LIMIT %(limit)s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                query,
+                {
+                    "id": public_conversation.id,
+                    "heavy_fields": [] if include_heavy_fields else ConversationMessage.HEAVY_FIELDS,
+                    "turn_id": turn_id,
+                    "before": before_turn_id,
+                    "after": after_turn_id,
+                    "offset": 0 if oldest_first else skip_latest,
+                    "limit": limit + 1 if limit is not None else None,
+                },
+            )
+            messages = [json.loads(row[0]) if isinstance(row[0], str) else row[0] for row in cursor.fetchall()]
+
+        has_more = limit is not None and len(messages) > limit
+        messages = messages[:limit] if limit is not None else messages
+        return (messages if oldest_first else messages[::-1]), has_more
 
     @staticmethod
     def get_public_conversation_url(public_conversation: PublicConversation):
@@ -962,6 +1046,52 @@ class ConversationAdapters:
             return conversation
         return None
 
+    @staticmethod
+    def get_conversation_messages(
+        conversation: Conversation,
+        before_turn_id: str = None,
+        after_turn_id: str = None,
+        turn_id: str = None,
+        limit: int = None,
+        skip_latest: int = 0,
+        include_heavy_fields: bool = True,
+    ) -> Tuple[List[dict], bool]:
+        """
+        Get a page of messages of the conversation in chronological order, without loading the whole conversation.
+        Gets the latest messages before before_turn_id, or the earliest messages after after_turn_id, up to limit.
+        Also returns whether the conversation has more messages beyond this page in the paging direction.
+        """
+        messages = conversation.chat_messages.all()
+        if not include_heavy_fields:
+            messages = messages.defer("heavy_fields")
+        if turn_id:
+            messages = messages.filter(turn_id=turn_id)
+        if before_turn_id:
+            first_turn_message = conversation.chat_messages.filter(turn_id=before_turn_id).only("created_at").first()
+            if not first_turn_message:
+                return [], False
+            messages = messages.filter(
+                Q(created_at__lt=first_turn_message.created_at)
+                | Q(created_at=first_turn_message.created_at, id__lt=first_turn_message.id)
+            )
+        if after_turn_id:
+            last_turn_message = conversation.chat_messages.filter(turn_id=after_turn_id).only("created_at").last()
+            if not last_turn_message:
+                return [], False
+            messages = messages.filter(
+                Q(created_at__gt=last_turn_message.created_at)
+                | Q(created_at=last_turn_message.created_at, id__gt=last_turn_message.id)
+            )
+
+        oldest_first = after_turn_id is not None and before_turn_id is None
+        if not oldest_first:
+            messages = messages.reverse()[skip_latest:]
+        page = list(messages[: limit + 1] if limit is not None else messages)
+        has_more = limit is not None and len(page) > limit
+        page = page[:limit] if limit is not None else page
+        page = page if oldest_first else page[::-1]
+        return [message.to_chat(include_heavy_fields) for message in page], has_more
+
     @staticmethod
     def get_conversation_by_id(conversation_id: str):
         return Conversation.objects.filter(id=conversation_id).first()
@@ -1290,11 +1420,12 @@ class ConversationAdapters:
     @require_valid_user
     def save_conversation(
         user: KhojUser,
-        conversation_log: dict,
+        new_messages: List[dict],
         client_application: ClientApplication = None,
         conversation_id: str = None,
         user_message: str = None,
-    ):
+    ) -> Conversation:
+        "Append the new messages of a conversation turn to the conversation, without rewriting its previous messages"
         slug = user_message.strip()[:200] if user_message else None
         if conversation_id:
             conversation = Conversation.objects.filter(user=user, client=client_application, id=conversation_id).first()
@@ -1303,15 +1434,45 @@ class ConversationAdapters:
                 Conversation.objects.filter(user=user, client=client_application).order_by("-updated_at").first()
             )
 
-        if conversation:
-            conversation.conversation_log = conversation_log
-            conversation.slug = slug
-            conversation.updated_at = datetime.now(tz=timezone.utc)
-            conversation.save()
-        else:
-            Conversation.objects.create(
-                user=user, conversation_log=conversation_log, client=client_application, slug=slug
+        with transaction.atomic():
+            if conversation:
+                conversation.slug = slug
+                conversation.updated_at = datetime.now(tz=timezone.utc)
+                conversation.save(update_fields=["slug", "updated_at"])
+            else:
+                conversation = Conversation.objects.create(user=user, client=client_application, slug=slug)
+            chat_messages = [ConversationMessage.from_chat(conversation, chat) for chat in new_messages]
+            ConversationMessage.objects.bulk_create(chat_messages)
+        return conversation
+
+    @staticmethod
+    def save_turn_embedding(
+        conversation_id: str, turn_id: str, embeddings: List[float], search_model: SearchModelConfig
+    ):
+        "Store embedding of the conversation turn on its user message to recall the turn later"
+        ConversationMessage.objects.filter(conversation_id=conversation_id, turn_id=turn_id, by="you").update(
+            embeddings=embeddings, search_model=search_model
+        )
+
+    @staticmethod
+    async def aget_relevant_turn_ids(
+        conversation: Conversation,
+        embeddings: Tensor,
+        search_model: SearchModelConfig,
+        exclude_turn_ids: List[str] = [],
+        max_results: int = 5,
+    ) -> List[str]:
+        "Get ids of the conversation turns most similar to the query embeddings, most similar first"
+        relevant_messages = (
+            ConversationMessage.objects.filter(
+                conversation=conversation, search_model=search_model, embeddings__isnull=False
             )
+            .exclude(turn_id__in=exclude_turn_ids)
+            .annotate(distance=CosineDistance("embeddings", embeddings))
+            .order_by("distance")
+            .values_list("turn_id", flat=True)[:max_results]
+        )
+        return [turn_id async for turn_id in relevant_messages]
 
     @staticmethod
     def get_conversation_processor_options():
@@ -1472,12 +1633,19 @@ class ConversationAdapters:
     @require_valid_user
     def delete_message_by_turn_id(user: KhojUser, conversation_id: str, turn_id: str):
         conversation = ConversationAdapters.get_conversation_by_user(user, conversation_id=conversation_id)
-        if not conversation or not conversation.conversation_log or not conversation.conversation_log.get("chat"):
+        if not conversation or not conversation.chat_messages.exists():
             return False
-        conversation_log = conversation.conversation_log
-        updated_log = [msg for msg in conversation_log["chat"] if msg.get("turnId") != turn_id]
-        conversation.conversation_log["chat"] = updated_log
-        conversation.save()
+        with transaction.atomic():
+            if conversation.summarized_until_turn_id:
+                # Forget conversation summary if it summarized the deleted turn
+                turn_ids = list(conversation.chat_messages.values_list("turn_id", flat=True))
+                summarized_chats_count = Conversation.count_summarized_chats(
+                    turn_ids, conversation.summarized_until_turn_id
+                )
+                if summarized_chats_count == 0 or turn_id in turn_ids[:summarized_chats_count]:
+                    conversation.forget_summary()
+                    conversation.save(update_fields=["summary", "references_digest", "summarized_until_turn_id"])
+            conversation.chat_messages.filter(turn_id=turn_id).delete()
         return True
 
 
@@ -1512,6 +1680,47 @@ class FileObjectAdapters:
     def delete_all_file_objects(user: KhojUser):
         return FileObject.objects.filter(user=user).delete()
 
+    @staticmethod
+    @require_valid_user
+    def get_indexed_file_fingerprints(
+        user: KhojUser,
+        file_type: Optional[str] = None,
+        file_names: Optional[List[str]] = None,
+        file_source: Optional[str] = None,
+    ) -> dict[str, dict]:
+        """Get content hash, size and modification time of files with entries indexed for user"""
+        indexed_entries = EntryAdapters.get_filtered_entries(user, file_type, file_source).filter(
+            file_path=OuterRef("file_name")
+        )
+        file_objects = FileObject.objects.filter(user=user, content_hash__isnull=False)
+        if file_names is not None:
+            file_objects = file_objects.filter(file_name__in=file_names)
+        file_objects = file_objects.filter(Exists(indexed_entries)).values(
+            "file_name", "content_hash", "file_size", "file_mtime_ns"
+        )
+        return {file_object["file_name"]: file_object for file_object in file_objects}
+
+    @staticmethod
+    @require_valid_user
+    def update_content_hashes(user: KhojUser, file_to_content_hash_map: dict[str, str], batch_size=1000):
+        file_objects = list(FileObject.objects.filter(user=user, file_name__in=list(file_to_content_hash_map)))
+        for file_object in file_objects:
+            if file_object.content_hash != file_to_content_hash_map[file_object.file_name]:
+                # Reset file stats as they were not verified against the new content
+                file_object.file_size, file_object.file_mtime_ns = None, None
+            file_object.content_hash = file_to_content_hash_map[file_object.file_name]
+        FileObject.objects.bulk_update(
+            file_objects, ["content_hash", "file_size", "file_mtime_ns"], batch_size=batch_size
+        )
+
+    @staticmethod
+    @require_valid_user
+    def update_file_stats(user: KhojUser, file_to_stats_map: dict[str, tuple[int, int]], batch_size=1000):
+        file_objects = list(FileObject.objects.filter(user=user, file_name__in=list(file_to_stats_map)))
+        for file_object in file_objects:
+            file_object.file_size, file_object.file_mtime_ns = file_to_stats_map[file_object.file_name]
+        FileObject.objects.bulk_update(file_objects, ["file_size", "file_mtime_ns"], batch_size=batch_size)
+
     @staticmethod
     async def aupdate_raw_text(file_object: FileObject, new_raw_text: str):
         file_object.raw_text = new_raw_text
@@ -1555,11 +1764,84 @@ class FileObjectAdapters:
         return await FileObject.objects.filter(user=user).adelete()
 
 
+class OctetLength(Func):
+    function = "OCTET_LENGTH"
+    output_field = BigIntegerField()
+
+
 class EntryAdapters:
     word_filter = WordFilter()
     file_filter = FileFilter()
     date_filter = DateFilter()
 
+    @staticmethod
+    def get_size_in_bytes(entries: Iterable[Entry]) -> int:
+        "Get size of compiled text of entries in bytes. Counterpart of the OctetLength aggregate run on the database"
+        return sum(len(entry.compiled.encode("utf-8")) for entry in entries)
+
+    @staticmethod
+    def aggregate_indexed_data_stats(entries: QuerySet) -> dict[str, int]:
+        return entries.aggregate(
+            entry_count=Count("id"),
+            size_in_bytes=Coalesce(Sum(OctetLength("compiled")), 0, output_field=BigIntegerField()),
+        )
+
+    @staticmethod
+    @require_valid_user
+    def reconcile_indexed_data_stats(user: KhojUser) -> UserIndexedDataStats:
+        "Recompute indexed data counters of user from their indexed entries"
+        stats = EntryAdapters.aggregate_indexed_data_stats(Entry.objects.filter(user=user))
+        indexed_data_stats, _ = UserIndexedDataStats.objects.update_or_create(user=user, defaults=stats)
+        return indexed_data_stats
+
+    @staticmethod
+    @require_valid_user
+    def update_indexed_data_stats(user: KhojUser, entry_count: int, size_in_bytes: int):
+        """
+        Increment indexed data counters of user by the given (or decrement by negative) values.
+        Call after entries are added or deleted, in the same transaction.
+        """
+        if entry_count == 0 and size_in_bytes == 0:
+            return
+        updated = UserIndexedDataStats.objects.filter(user=user).update(
+            entry_count=F("entry_count") + entry_count,
+            size_in_bytes=F("size_in_bytes") + size_in_bytes,
+        )
+        if not updated:
+            # Initialize counters from indexed entries. These already include the added or deleted entries
+            EntryAdapters.reconcile_indexed_data_stats(user)
+
+    @staticmethod
+    @require_valid_user
+    def get_indexed_data_stats(user: KhojUser) -> UserIndexedDataStats:
+        indexed_data_stats = UserIndexedDataStats.objects.filter(user=user).first()
+        if indexed_data_stats is None:
+            indexed_data_stats = EntryAdapters.reconcile_indexed_data_stats(user)
+        return indexed_data_stats
+
+    @staticmethod
+    @require_valid_user
+    def add_entries(user: KhojUser, entries: List[Entry]) -> List[Entry]:
+        "Bulk create entries of user and update their indexed data counters"
+        with transaction.atomic():
+            added_entries = Entry.objects.bulk_create(entries)
+            EntryAdapters.update_indexed_data_stats(
+                user, len(added_entries), EntryAdapters.get_size_in_bytes(added_entries)
+            )
+        return added_entries
+
+    @staticmethod
+    @require_valid_user
+    def delete_entries(user: KhojUser, entries: QuerySet) -> int:
+        "Delete entries of user and update their indexed data counters"
+        with transaction.atomic():
+            deleted_stats = EntryAdapters.aggregate_indexed_data_stats(entries)
+            deleted_count, _ = entries.delete()
+            EntryAdapters.update_indexed_data_stats(
+                user, -deleted_stats["entry_count"], -deleted_stats["size_in_bytes"]
+            )
+        return deleted_count
+
     @staticmethod
     @require_valid_user
     def does_entry_exist(user: KhojUser, hashed_value: str) -> bool:
@@ -1568,8 +1850,7 @@ class EntryAdapters:
     @staticmethod
     @require_valid_user
     def delete_entry_by_file(user: KhojUser, file_path: str):
-        deleted_count, _ = Entry.objects.filter(user=user, file_path=file_path).delete()
-        return deleted_count
+        return EntryAdapters.delete_entries(user, Entry.objects.filter(user=user, file_path=file_path))
 
     @staticmethod
     @require_valid_user
@@ -1586,28 +1867,43 @@ class EntryAdapters:
 
     @staticmethod
     @require_valid_user
-    def delete_all_entries(user: KhojUser, file_type: str = None, file_source: str = None, batch_size=1000):
-        deleted_count = 0
+    def get_max_entry_id(user: KhojUser, file_type: str = None, file_source: str = None) -> int:
+        "Get id of the last indexed entry of user. Entries indexed after this have larger ids"
         queryset = EntryAdapters.get_filtered_entries(user, file_type, file_source)
-        while queryset.exists():
-            batch_ids = list(queryset.values_list("id", flat=True)[:batch_size])
-            batch = Entry.objects.filter(id__in=batch_ids, user=user)
-            count, _ = batch.delete()
-            deleted_count += count
-        return deleted_count
+        return queryset.aggregate(max_id=Max("id"))["max_id"] or 0
 
     @staticmethod
-    @arequire_valid_user
-    async def adelete_all_entries(user: KhojUser, file_type: str = None, file_source: str = None, batch_size=1000):
-        deleted_count = 0
+    @require_valid_user
+    def delete_all_entries(
+        user: KhojUser, file_type: str = None, file_source: str = None, max_entry_id: int = None
+    ) -> int:
+        """
+        Delete all entries of user with the file type and source in a single set-based DELETE.
+        Only delete entries with ids up to max_entry_id when set, e.g to swap out entries indexed before regenerating.
+        """
         queryset = EntryAdapters.get_filtered_entries(user, file_type, file_source)
-        while await queryset.aexists():
-            batch_ids = await sync_to_async(list)(queryset.values_list("id", flat=True)[:batch_size])
-            batch = Entry.objects.filter(id__in=batch_ids, user=user)
-            count, _ = await batch.adelete()
-            deleted_count += count
+        if max_entry_id is not None:
+            queryset = queryset.filter(id__lte=max_entry_id)
+        with transaction.atomic():
+            deleted_stats = EntryAdapters.aggregate_indexed_data_stats(queryset)
+            # Skip the ORM cascade collector, which loads every entry to delete.
+            # The database cascades entry deletes to their entry dates
+            entry_ids_query, params = queryset.values("id").query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {Entry._meta.db_table} WHERE id IN ({entry_ids_query})", params)
+                deleted_count = cursor.rowcount
+            EntryAdapters.update_indexed_data_stats(
+                user, -deleted_stats["entry_count"], -deleted_stats["size_in_bytes"]
+            )
         return deleted_count
 
+    @staticmethod
+    @arequire_valid_user
+    async def adelete_all_entries(
+        user: KhojUser, file_type: str = None, file_source: str = None, max_entry_id: int = None
+    ) -> int:
+        return await sync_to_async(EntryAdapters.delete_all_entries)(user, file_type, file_source, max_entry_id)
+
     @staticmethod
     @require_valid_user
     def get_existing_entry_hashes_by_file(user: KhojUser, file_path: str):
@@ -1616,7 +1912,7 @@ class EntryAdapters:
     @staticmethod
     @require_valid_user
     def delete_entry_by_hash(user: KhojUser, hashed_values: List[str]):
-        Entry.objects.filter(user=user, hashed_value__in=hashed_values).delete()
+        EntryAdapters.delete_entries(user, Entry.objects.filter(user=user, hashed_value__in=hashed_values))
 
     @staticmethod
     def get_entries_by_date_filter(entry: BaseManager[Entry], start_date: date, end_date: date):
@@ -1648,7 +1944,8 @@ class EntryAdapters:
     @staticmethod
     @arequire_valid_user
     async def adelete_entry_by_file(user: KhojUser, file_path: str):
-        return await Entry.objects.filter(user=user, file_path=file_path).adelete()
+        entries = Entry.objects.filter(user=user, file_path=file_path)
+        return await sync_to_async(EntryAdapters.delete_entries)(user, entries)
 
     @staticmethod
     @arequire_valid_user
@@ -1656,8 +1953,8 @@ class EntryAdapters:
         deleted_count = 0
         for i in range(0, len(filenames), batch_size):
             batch = filenames[i : i + batch_size]
-            count, _ = await Entry.objects.filter(user=user, file_path__in=batch).adelete()
-            deleted_count += count
+            entries = Entry.objects.filter(user=user, file_path__in=batch)
+            deleted_count += await sync_to_async(EntryAdapters.delete_entries)(user, entries)
 
         return deleted_count
 
@@ -1681,9 +1978,7 @@ class EntryAdapters:
     @staticmethod
     @require_valid_user
     def get_size_of_indexed_data_in_mb(user: KhojUser):
-        entries = Entry.objects.filter(user=user).iterator()
-        total_size = sum(sys.getsizeof(entry.compiled) for entry in entries)
-        return total_size / 1024 / 1024
+        return EntryAdapters.get_indexed_data_stats(user).size_in_bytes / 1024 / 1024
 
     @staticmethod
     def apply_filters(user: KhojUser, query: str, file_type_filter: str = None, agent: Agent = None):
@@ -1787,6 +2082,36 @@ class EntryAdapters:
         return Entry.objects.filter(user=user).values_list("file_source", flat=True).distinct().all()
 
 
+class WebCacheAdapters:
+    @staticmethod
+    def get_key(cache_type: WebCache.CacheType, key_parts: List[str]) -> str:
+        return hashlib.sha256(json.dumps([cache_type, *key_parts]).encode()).hexdigest()
+
+    @staticmethod
+    async def aget_cached(cache_type: WebCache.CacheType, key_parts: List[str]) -> Optional[Any]:
+        "Get cached web search results or page content, if not expired"
+        cached = await WebCache.objects.filter(
+            key=WebCacheAdapters.get_key(cache_type, key_parts), expires_at__gt=datetime.now(tz=timezone.utc)
+        ).afirst()
+        return cached.value if cached else None
+
+    @staticmethod
+    async def acache(cache_type: WebCache.CacheType, key_parts: List[str], value: Any, ttl: timedelta):
+        "Cache web search results or page content for the time to live"
+        try:
+            await WebCache.objects.aupdate_or_create(
+                key=WebCacheAdapters.get_key(cache_type, key_parts),
+                defaults={"type": cache_type, "value": value, "expires_at": datetime.now(tz=timezone.utc) + ttl},
+            )
+        except IntegrityError:
+            # Another request cached the same key concurrently
+            pass
+
+    @staticmethod
+    def delete_expired():
+        return WebCache.objects.filter(expires_at__lte=datetime.now(tz=timezone.utc)).delete()
+
+
 class AutomationAdapters:
     @staticmethod
     def get_automations(user: KhojUser) -> Iterable[Job]:
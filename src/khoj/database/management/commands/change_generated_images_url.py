@@ -39,7 +39,8 @@ class Command(BaseCommand):
         source = options["destination"] if options["reverse"] else options["source"]
         for conversation in Conversation.objects.all():
             conversation_updated = False
-            for chat in tqdm(conversation.conversation_log.get("chat", []), desc="Processing Conversations"):
+            conversation_log = conversation.conversation_log
+            for chat in tqdm(conversation_log.get("chat", []), desc="Processing Conversations"):
                 if (
                     chat.get("by", "") == "khoj"
                     and not is_none_or_empty(chat.get("message"))
@@ -54,6 +55,7 @@ class Command(BaseCommand):
 
             if conversation_updated:
                 print(f"Save the updated conversation {conversation.id} to the database.")
+                conversation.conversation_log = conversation_log
                 conversation.save()
 
         if updated_count > 0:
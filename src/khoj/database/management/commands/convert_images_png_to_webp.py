@@ -23,7 +23,8 @@ class Command(BaseCommand):
         updated_count = 0
         for conversation in Conversation.objects.all():
             conversation_updated = False
-            for chat in conversation.conversation_log.get("chat", []):
+            conversation_log = conversation.conversation_log
+            for chat in conversation_log.get("chat", []):
                 if (
                     chat.get("by", "") == "khoj"
                     and chat.get("intent", {}).get("type", "") == ImageIntentType.TEXT_TO_IMAGE.value
@@ -91,6 +92,7 @@ class Command(BaseCommand):
 
             if conversation_updated:
                 print("Save the updated conversation")
+                conversation.conversation_log = conversation_log
                 conversation.save()
 
         if updated_count > 0 and options["reverse"]:
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from khoj.database.adapters import EntryAdapters
+from khoj.database.models import Entry, KhojUser, UserIndexedDataStats
+
+
+class Command(BaseCommand):
+    help = "Recomputes the indexed data counters of users from their indexed entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--apply",
+            action="store_true",
+            help="Actually update the counters. Without this flag, only shows the counters that have drifted.",
+        )
+        parser.add_argument(
+            "--user",
+            type=str,
+            help="Only reconcile counters of the user with this email or username.",
+        )
+
+    def handle(self, *args, **options):
+        users = KhojUser.objects.filter(
+            Exists(Entry.objects.filter(user=OuterRef("pk")))
+            | Exists(UserIndexedDataStats.objects.filter(user=OuterRef("pk")))
+        )
+        if options["user"]:
+            users = users.filter(email=options["user"]) | users.filter(username=options["user"])
+
+        mode = "APPLY" if options["apply"] else "DRY RUN"
+        num_drifted = 0
+        for user in users.iterator():
+            expected = EntryAdapters.aggregate_indexed_data_stats(Entry.objects.filter(user=user))
+            current = UserIndexedDataStats.objects.filter(user=user).values("entry_count", "size_in_bytes").first()
+            if current == expected:
+                continue
+
+            num_drifted += 1
+            self.stdout.write(f"[{mode}] {user}: counters {current} drifted from indexed entries {expected}")
+            if options["apply"]:
+                EntryAdapters.reconcile_indexed_data_stats(user)
+
+        action = "Reconciled" if options["apply"] else "Would reconcile"
+        self.stdout.write(self.style.SUCCESS(f"{action} indexed data counters of {num_drifted} users"))
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.10 on 2025-02-08 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0085_alter_agent_output_modes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileobject",
+            name="content_hash",
+            field=models.CharField(blank=True, default=None, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="fileobject",
+            name="file_size",
+            field=models.BigIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="fileobject",
+            name="file_mtime_ns",
+            field=models.BigIntegerField(blank=True, default=None, null=True),
+        ),
+    ]
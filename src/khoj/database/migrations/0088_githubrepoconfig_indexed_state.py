@@ -0,0 +1,27 @@
+# Generated by Django 5.0.10 on 2025-02-12 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0087_userindexeddatastats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="githubrepoconfig",
+            name="last_indexed_commit_sha",
+            field=models.CharField(blank=True, default=None, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="githubrepoconfig",
+            name="last_indexed_commit_etag",
+            field=models.CharField(blank=True, default=None, max_length=200, null=True),
+        ),
+        migrations.AddField(
+            model_name="githubrepoconfig",
+            name="indexed_blob_shas",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.10 on 2025-02-13 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0088_githubrepoconfig_indexed_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notionconfig",
+            name="indexed_page_edit_times",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.10 on 2025-02-14 09:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def replace_entry_dates_foreign_key(on_delete: str) -> str:
+    "Replace the foreign key from entry dates to entries with one using the given ON DELETE action"
+    return f"""
+DO $$
+DECLARE
+    entry_fk_name text;
+BEGIN
+    FOR entry_fk_name IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'database_entrydates'::regclass
+          AND confrelid = 'database_entry'::regclass
+          AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE database_entrydates DROP CONSTRAINT %I', entry_fk_name);
+    END LOOP;
+END $$;
+ALTER TABLE database_entrydates
+    ADD CONSTRAINT database_entrydates_entry_id_fk_database_entry_id
+    FOREIGN KEY (entry_id) REFERENCES database_entry (id) {on_delete}
+    DEFERRABLE INITIALLY DEFERRED;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0089_notionconfig_indexed_page_edit_times"),
+    ]
+
+    operations = [
+        # Cascade entry deletes to entry dates in the database, so entries can be purged with a single DELETE.
+        # Django models can't declare database level cascades. So the model state keeps the ORM cascade of the field
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql=replace_entry_dates_foreign_key("ON DELETE CASCADE"),
+                    reverse_sql=replace_entry_dates_foreign_key(""),
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="entrydates",
+                    name="entry",
+                    field=models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="embeddings_dates",
+                        to="database.entry",
+                    ),
+                ),
+            ],
+        ),
+    ]
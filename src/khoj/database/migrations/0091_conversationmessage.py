@@ -0,0 +1,77 @@
+# Generated by Django 5.0.10 on 2025-02-15 08:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+HEAVY_FIELDS = ["context", "onlineContext", "codeContext", "images"]
+
+
+def move_conversation_log_to_messages(apps, schema_editor):
+    Conversation = apps.get_model("database", "Conversation")
+    ConversationMessage = apps.get_model("database", "ConversationMessage")
+    for conversation in Conversation.objects.only("id", "conversation_log").iterator(chunk_size=100):
+        ConversationMessage.objects.bulk_create(
+            [
+                ConversationMessage(
+                    conversation=conversation,
+                    turn_id=chat.get("turnId"),
+                    by=chat.get("by", ""),
+                    message={key: value for key, value in chat.items() if key not in HEAVY_FIELDS},
+                    heavy_fields={key: value for key, value in chat.items() if key in HEAVY_FIELDS},
+                )
+                for chat in (conversation.conversation_log or {}).get("chat", [])
+            ],
+            batch_size=500,
+        )
+
+
+def move_messages_to_conversation_log(apps, schema_editor):
+    Conversation = apps.get_model("database", "Conversation")
+    ConversationMessage = apps.get_model("database", "ConversationMessage")
+    for conversation in Conversation.objects.iterator(chunk_size=100):
+        chat_messages = ConversationMessage.objects.filter(conversation=conversation).order_by("created_at", "id")
+        conversation.conversation_log = {
+            "chat": [{**chat_message.message, **chat_message.heavy_fields} for chat_message in chat_messages]
+        }
+        conversation.save(update_fields=["conversation_log"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0090_entrydates_entry_db_cascade"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConversationMessage",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("turn_id", models.CharField(blank=True, default=None, max_length=200, null=True)),
+                ("by", models.CharField(max_length=20)),
+                ("message", models.JSONField(default=dict)),
+                ("heavy_fields", models.JSONField(default=dict)),
+                (
+                    "conversation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chat_messages",
+                        to="database.conversation",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["created_at", "id"],
+                "indexes": [
+                    models.Index(fields=["conversation", "created_at", "id"], name="database_co_convers_ca8669_idx"),
+                    models.Index(fields=["conversation", "turn_id"], name="database_co_convers_a88859_idx"),
+                ],
+            },
+        ),
+        migrations.RunPython(move_conversation_log_to_messages, reverse_code=move_messages_to_conversation_log),
+        migrations.RemoveField(
+            model_name="conversation",
+            name="conversation_log",
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.10 on 2025-02-16 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0091_conversationmessage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="summary",
+            field=models.TextField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="references_digest",
+            field=models.TextField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="summarized_until_turn_id",
+            field=models.CharField(blank=True, default=None, max_length=200, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.10 on 2025-02-18 09:45
+
+import django.db.models.deletion
+import pgvector.django
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0092_conversation_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversationmessage",
+            name="embeddings",
+            field=pgvector.django.VectorField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversationmessage",
+            name="search_model",
+            field=models.ForeignKey(
+                blank=True,
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="database.searchmodelconfig",
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.10 on 2025-02-19 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0093_conversationmessage_embeddings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebCache",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("key", models.CharField(max_length=64, unique=True)),
+                ("type", models.CharField(choices=[("search", "Search"), ("page", "Page")], max_length=20)),
+                ("value", models.JSONField(default=dict)),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
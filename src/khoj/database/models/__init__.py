@@ -8,7 +8,7 @@ from typing import Dict, List, Optional, Union
 from django.contrib.auth.models import AbstractUser
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from pgvector.django import VectorField
@@ -351,6 +351,8 @@ def verify_agent(sender, instance, **kwargs):
 class NotionConfig(DbBaseModel):
     token = models.CharField(max_length=200)
     user = models.ForeignKey(KhojUser, on_delete=models.CASCADE)
+    # Track last edited time of indexed pages, keyed by page url, to skip re-indexing unchanged pages
+    indexed_page_edit_times = models.JSONField(default=dict, blank=True)
 
 
 class GithubConfig(DbBaseModel):
@@ -363,6 +365,10 @@ class GithubRepoConfig(DbBaseModel):
     owner = models.CharField(max_length=200)
     branch = models.CharField(max_length=200)
     github_config = models.ForeignKey(GithubConfig, on_delete=models.CASCADE, related_name="githubrepoconfig")
+    # Track indexed state of repo to only index files changed since the last indexed commit
+    last_indexed_commit_sha = models.CharField(max_length=100, default=None, null=True, blank=True)
+    last_indexed_commit_etag = models.CharField(max_length=200, default=None, null=True, blank=True)
+    indexed_blob_shas = models.JSONField(default=dict, blank=True)
 
 
 class WebScraper(DbBaseModel):
@@ -441,6 +447,18 @@ class WebScraper(DbBaseModel):
         return self.name
 
 
+class WebCache(DbBaseModel):
+    class CacheType(models.TextChoices):
+        SEARCH = "search"
+        PAGE = "page"
+
+    # Hash of the cache type and key. Search results are keyed by engine, query and country. Pages by url and scraper
+    key = models.CharField(max_length=64, unique=True)
+    type = models.CharField(max_length=20, choices=CacheType.choices)
+    value = models.JSONField(default=dict)
+    expires_at = models.DateTimeField(db_index=True)
+
+
 class ServerChatSettings(DbBaseModel):
     chat_default = models.ForeignKey(
         ChatModel, on_delete=models.CASCADE, default=None, null=True, blank=True, related_name="chat_default"
@@ -593,7 +611,6 @@ class UserTextToImageModelConfig(DbBaseModel):
 
 class Conversation(DbBaseModel):
     user = models.ForeignKey(KhojUser, on_delete=models.CASCADE)
-    conversation_log = models.JSONField(default=dict)
     client = models.ForeignKey(ClientApplication, on_delete=models.CASCADE, default=None, null=True, blank=True)
 
     # Slug is an app-generated conversation identifier. Need not be unique. Used as display title essentially.
@@ -605,8 +622,61 @@ class Conversation(DbBaseModel):
     file_filters = models.JSONField(default=list)
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True, db_index=True)
 
+    # Rolling summary and references digest of the oldest chat messages of the conversation.
+    # Used in chat prompts instead of the full chat history of the summarized chat messages.
+    # The summary covers all chat messages up to and including those of the turn it is summarized until
+    summary = models.TextField(default=None, null=True, blank=True)
+    references_digest = models.TextField(default=None, null=True, blank=True)
+    summarized_until_turn_id = models.CharField(max_length=200, default=None, null=True, blank=True)
+
+    # Cache of the conversation log loaded from, or to replace, the messages of the conversation
+    _conversation_log: Optional[dict] = None
+    _replace_conversation_log = False
+
+    @property
+    def conversation_log(self) -> dict:
+        """
+        Compatibility accessor for readers of the whole conversation log.
+        Messages are stored as ConversationMessage rows. Loads all of them on first access.
+        """
+        if self._conversation_log is None:
+            chat_messages = [] if self._state.adding else self.chat_messages.defer("embeddings")
+            self._conversation_log = {"chat": [chat_message.to_chat() for chat_message in chat_messages]}
+        return self._conversation_log
+
+    async def aget_conversation_log(self) -> dict:
+        "Load all messages of the conversation into its conversation log on first access from async code"
+        if self._conversation_log is None:
+            chat_messages = [] if self._state.adding else [m async for m in self.chat_messages.defer("embeddings")]
+            self._conversation_log = {"chat": [chat_message.to_chat() for chat_message in chat_messages]}
+        return self._conversation_log
+
+    @conversation_log.setter
+    def conversation_log(self, conversation_log: dict):
+        "Replace all messages of the conversation with the messages in the conversation log on save"
+        self._conversation_log = conversation_log
+        self._replace_conversation_log = True
+
+    @staticmethod
+    def count_summarized_chats(turn_ids: List[Optional[str]], summarized_until_turn_id: Optional[str]) -> int:
+        "Count chats summarized, given the turn ids of the chats in order. 0 if the turn summarized until isn't found"
+        if not summarized_until_turn_id:
+            return 0
+        for chat_index in range(len(turn_ids) - 1, -1, -1):
+            if turn_ids[chat_index] == summarized_until_turn_id:
+                return chat_index + 1
+        return 0
+
+    def forget_summary(self):
+        "Clear summary of the conversation, so it is rebuilt from its remaining chats on next compaction"
+        self.summary = None
+        self.references_digest = None
+        self.summarized_until_turn_id = None
+
     def clean(self):
         # Validate conversation_log structure
+        if not self._replace_conversation_log:
+            return
         try:
             messages = self.conversation_log.get("chat", [])
             for msg in messages:
@@ -616,7 +686,28 @@ class Conversation(DbBaseModel):
 
     def save(self, *args, **kwargs):
         self.clean()
-        super().save(*args, **kwargs)
+        adding = self._state.adding
+        with transaction.atomic():
+            if self._replace_conversation_log and not adding and self.summarized_until_turn_id:
+                # Forget summary if any of the summarized chats are removed or changed order
+                turn_ids = list(self.chat_messages.values_list("turn_id", flat=True))
+                summarized_chats_count = self.count_summarized_chats(turn_ids, self.summarized_until_turn_id)
+                new_turn_ids = [chat.get("turnId") for chat in self.conversation_log.get("chat", [])]
+                if (
+                    summarized_chats_count == 0
+                    or new_turn_ids[:summarized_chats_count] != turn_ids[:summarized_chats_count]
+                ):
+                    self.forget_summary()
+            super().save(*args, **kwargs)
+            if self._replace_conversation_log:
+                if not adding:
+                    self.chat_messages.all().delete()
+                ConversationMessage.objects.bulk_create(
+                    [ConversationMessage.from_chat(self, chat) for chat in self.conversation_log.get("chat", [])]
+                )
+                self._replace_conversation_log = False
+            elif adding:
+                self._conversation_log = {"chat": []}
 
     @property
     def messages(self) -> List[ChatMessage]:
@@ -637,6 +728,42 @@ class Conversation(DbBaseModel):
         return validated_messages
 
 
+class ConversationMessage(DbBaseModel):
+    # Large message fields are stored apart from the rest of the message. So message listings can skip loading them
+    HEAVY_FIELDS = ["context", "onlineContext", "codeContext", "images"]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="chat_messages")
+    turn_id = models.CharField(max_length=200, default=None, null=True, blank=True)
+    by = models.CharField(max_length=20)
+    message = models.JSONField(default=dict)
+    heavy_fields = models.JSONField(default=dict)
+    # Embedding of the conversation turn, stored on its user message. Used to recall relevant earlier turns
+    embeddings = VectorField(dimensions=None, default=None, null=True, blank=True)
+    search_model = models.ForeignKey(SearchModelConfig, on_delete=models.SET_NULL, default=None, null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at", "id"]
+        indexes = [
+            models.Index(fields=["conversation", "created_at", "id"]),
+            models.Index(fields=["conversation", "turn_id"]),
+        ]
+
+    @classmethod
+    def from_chat(cls, conversation: Conversation, chat: dict) -> "ConversationMessage":
+        "Create conversation message from a chat message in the conversation log format"
+        return cls(
+            conversation=conversation,
+            turn_id=chat.get("turnId"),
+            by=chat.get("by", ""),
+            message={key: value for key, value in chat.items() if key not in cls.HEAVY_FIELDS},
+            heavy_fields={key: value for key, value in chat.items() if key in cls.HEAVY_FIELDS},
+        )
+
+    def to_chat(self, include_heavy_fields: bool = True) -> dict:
+        "Convert conversation message to a chat message in the conversation log format"
+        return {**self.message, **self.heavy_fields} if include_heavy_fields else dict(self.message)
+
+
 class PublicConversation(DbBaseModel):
     source_owner = models.ForeignKey(KhojUser, on_delete=models.CASCADE)
     conversation_log = models.JSONField(default=dict)
@@ -678,6 +805,11 @@ class FileObject(DbBaseModel):
     raw_text = models.TextField()
     user = models.ForeignKey(KhojUser, on_delete=models.CASCADE, default=None, null=True, blank=True)
     agent = models.ForeignKey(Agent, on_delete=models.CASCADE, default=None, null=True, blank=True)
+    # Fingerprint of the file content last indexed. Used to skip re-indexing unchanged files
+    content_hash = models.CharField(max_length=100, default=None, null=True, blank=True)
+    # Size and modification time of the file content last indexed, when known. Used to skip reading unchanged files
+    file_size = models.BigIntegerField(default=None, null=True, blank=True)
+    file_mtime_ns = models.BigIntegerField(default=None, null=True, blank=True)
 
 
 class Entry(DbBaseModel):
@@ -718,6 +850,13 @@ class Entry(DbBaseModel):
             raise ValidationError("An Entry cannot be associated with both a user and an agent.")
 
 
+class UserIndexedDataStats(DbBaseModel):
+    # Running totals of the entries indexed for a user. Kept in sync by the entry insert and delete paths
+    user = models.OneToOneField(KhojUser, on_delete=models.CASCADE, related_name="indexed_data_stats")
+    entry_count = models.BigIntegerField(default=0)
+    size_in_bytes = models.BigIntegerField(default=0)
+
+
 class EntryDates(DbBaseModel):
     date = models.DateField()
     entry = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name="embeddings_dates")
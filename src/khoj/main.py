@@ -16,6 +16,7 @@ import warnings
 from importlib.metadata import version
 
 from khoj.utils.helpers import in_debug_mode, is_env_var_true
+from khoj.utils.http import close_http_sessions
 
 # Ignore non-actionable warnings
 warnings.filterwarnings("ignore", message=r"snapshot_download.py has been made private", category=FutureWarning)
@@ -86,6 +87,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Close pooled HTTP sessions used by tools on shutdown
+app.add_event_handler("shutdown", close_http_sessions)
+
 # Set Locale
 locale.setlocale(locale.LC_ALL, "")
 
@@ -114,6 +118,9 @@ def shutdown_scheduler():
     except Exception as e:
         logger.debug(f"Did not shutdown scheduler: {e}")
 
+    if state.content_watcher:
+        state.content_watcher.stop()
+
 
 def run(should_start_server=True):
     # Turn Tokenizers Parallelism Off. App does not support it.
@@ -195,6 +202,12 @@ def run(should_start_server=True):
 
     initialize_server(args.config)
 
+    # Watch local content sources on the schedule leader to incrementally index file changes
+    if is_env_var_true("KHOJ_WATCH_CONTENT") and state.schedule_leader_process_lock:
+        from khoj.utils.fs_watcher import start_content_watcher
+
+        state.content_watcher = start_content_watcher()
+
     # If the server is started through gunicorn (external to the script), don't start the server
     if should_start_server:
         start_server(app, host=args.host, port=args.port, socket=args.socket)
@@ -24,6 +24,11 @@ class DocxToEntries(TextToEntries):
         files_to_process = set(files) - deletion_file_names
         files = {file: files[file] for file in files_to_process}
 
+        # Skip files unchanged since they were last indexed
+        files, file_to_content_hash_map = self.filter_unchanged_files(
+            user, files, DbEntry.EntryType.DOCX, regenerate=regenerate, logger=logger
+        )
+
         # Extract Entries from specified Docx files
         with timer("Extract entries from specified DOCX files", logger):
             file_to_text_map, current_entries = DocxToEntries.extract_docx_entries(files)
@@ -44,6 +49,7 @@ class DocxToEntries(TextToEntries):
                 deletion_file_names,
                 regenerate=regenerate,
                 file_to_text_map=file_to_text_map,
+                file_to_content_hash_map=file_to_content_hash_map,
             )
 
         return num_new_embeddings, num_deleted_embeddings
@@ -1,24 +1,32 @@
 import logging
 import time
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
 
 import requests
 from magika import Magika
 
+from khoj.database.adapters import EntryAdapters
 from khoj.database.models import Entry as DbEntry
-from khoj.database.models import GithubConfig, KhojUser
+from khoj.database.models import GithubConfig
+from khoj.database.models import GithubRepoConfig as DbGithubRepoConfig
+from khoj.database.models import KhojUser
 from khoj.processor.content.markdown.markdown_to_entries import MarkdownToEntries
 from khoj.processor.content.org_mode.org_to_entries import OrgToEntries
 from khoj.processor.content.plaintext.plaintext_to_entries import PlaintextToEntries
 from khoj.processor.content.text_to_entries import TextToEntries
-from khoj.utils.helpers import is_none_or_empty, timer
-from khoj.utils.rawconfig import GithubContentConfig, GithubRepoConfig
+from khoj.utils.helpers import batcher, is_none_or_empty, timer
+from khoj.utils.rawconfig import Entry, GithubContentConfig, GithubRepoConfig
 
 logger = logging.getLogger(__name__)
 magika = Magika()
 
 
 class GithubToEntries(TextToEntries):
+    api_url = "https://api.github.com"
+    max_concurrent_downloads = 8
+    files_per_batch = 100
+
     def __init__(self, config: GithubConfig):
         super().__init__(config)
         raw_repos = config.githubrepoconfig.all()
@@ -35,6 +43,7 @@ class GithubToEntries(TextToEntries):
             pat_token=config.pat_token,
             repos=repos,
         )
+        self.repo_configs: List[DbGithubRepoConfig] = list(raw_repos)
         self.session = requests.Session()
         if not is_none_or_empty(self.config.pat_token):
             self.session.headers.update({"Authorization": f"token {self.config.pat_token}"})
@@ -54,29 +63,101 @@ class GithubToEntries(TextToEntries):
             logger.warning(
                 f"Github PAT token is not set. Private repositories cannot be indexed and lower rate limits apply."
             )
-        current_entries = []
-        for repo in self.config.repos:
-            current_entries += self.process_repo(repo)
 
-        return self.update_entries_with_ids(current_entries, user=user)
+        num_new_embeddings, num_deleted_embeddings = 0, 0
+        if regenerate:
+            with timer("Cleared existing github entries for regeneration in", logger):
+                num_deleted_embeddings += EntryAdapters.delete_all_entries(user, file_type=DbEntry.EntryType.GITHUB)
+
+        for repo in self.repo_configs:
+            repo_new_embeddings, repo_deleted_embeddings = self.process_repo(repo, user, regenerate)
+            num_new_embeddings += repo_new_embeddings
+            num_deleted_embeddings += repo_deleted_embeddings
+
+        return num_new_embeddings, num_deleted_embeddings
 
-    def process_repo(self, repo: GithubRepoConfig):
-        repo_url = f"https://api.github.com/repos/{repo.owner}/{repo.name}"
+    def process_repo(self, repo: DbGithubRepoConfig, user: KhojUser, regenerate: bool = False) -> Tuple[int, int]:
+        repo_url = f"{self.api_url}/repos/{repo.owner}/{repo.name}"
         repo_shorthand = f"{repo.owner}/{repo.name}"
         logger.info(f"Processing github repo {repo_shorthand}")
-        with timer("Download files from github repo", logger):
-            try:
-                markdown_files, org_files, plaintext_files = self.get_files(repo_url, repo)
-            except ConnectionAbortedError as e:
-                logger.error(f"Github rate limit reached. Skip indexing github repo {repo_shorthand}")
-                raise e
-            except Exception as e:
-                logger.error(f"Unable to download github repo {repo_shorthand}", exc_info=True)
-                raise e
-
+        try:
+            commit_sha = self.get_head_commit_sha(repo_url, repo, regenerate)
+            if commit_sha is None:
+                logger.info(f"Github repo {repo_shorthand} unchanged since last indexed. Skip indexing it")
+                return 0, 0
+            tree, is_tree_truncated = self.get_tree(repo_url, commit_sha)
+        except ConnectionAbortedError as e:
+            logger.error(f"Github rate limit reached. Skip indexing github repo {repo_shorthand}")
+            raise e
+        except Exception as e:
+            logger.error(f"Unable to get files in github repo {repo_shorthand}", exc_info=True)
+            raise e
+
+        # Only index files whose blob changed since the last indexed commit
+        indexed_blob_shas: Dict[str, str] = {} if regenerate else dict(repo.indexed_blob_shas or {})
+        changed_files = [item for path, item in tree.items() if indexed_blob_shas.get(path) != item["sha"]]
+        # Files missing from a truncated tree may still exist in the repo. So only delete files missing from a full tree
+        deleted_paths = set() if is_tree_truncated else set(indexed_blob_shas) - set(tree)
         logger.info(
-            f"Found {len(markdown_files)} md, {len(org_files)} org and {len(plaintext_files)} text files in github repo {repo_shorthand}"
+            f"Found {len(changed_files)} changed and {len(deleted_paths)} deleted files in github repo {repo_shorthand}"
         )
+
+        num_new_embeddings, num_deleted_embeddings = 0, 0
+        has_failed_files = False
+        deletion_filenames = {self.get_file_url(repo, path) for path in deleted_paths}
+        blob_shas = {path: sha for path, sha in indexed_blob_shas.items() if path not in deleted_paths}
+        for file_batch in batcher(changed_files, self.files_per_batch):
+            file_batch = list(file_batch)
+            with timer(f"Download {len(file_batch)} files from github repo {repo_shorthand}", logger):
+                markdown_files, org_files, plaintext_files = self.download_files(repo, file_batch)
+
+            current_entries = self.extract_entries(markdown_files, org_files, plaintext_files, repo_shorthand)
+
+            # Delete entries of previously indexed files that have no content to index anymore
+            files_with_entries = {entry.file for entry in current_entries}
+            deletion_filenames |= {
+                self.get_file_url(repo, item["path"])
+                for item in file_batch
+                if item["path"] in indexed_blob_shas and self.get_file_url(repo, item["path"]) not in files_with_entries
+            }
+
+            batch_new_embeddings, batch_deleted_embeddings = self.update_entries_with_ids(
+                current_entries, user=user, deletion_filenames=deletion_filenames
+            )
+            num_new_embeddings += batch_new_embeddings
+            num_deleted_embeddings += batch_deleted_embeddings
+            deletion_filenames = set()
+
+            # Checkpoint indexed files, so an interrupted sync resumes from here.
+            # Files with entries that failed to index are left out, so they get indexed again on the next sync
+            indexed_files = [
+                item for item in file_batch if self.get_file_url(repo, item["path"]) not in self.failed_files
+            ]
+            has_failed_files |= len(indexed_files) < len(file_batch)
+            blob_shas.update({item["path"]: item["sha"] for item in indexed_files})
+            repo.indexed_blob_shas = blob_shas
+            repo.save(update_fields=["indexed_blob_shas", "updated_at"])
+
+        if deletion_filenames:
+            _, batch_deleted_embeddings = self.update_entries_with_ids(
+                [], user=user, deletion_filenames=deletion_filenames
+            )
+            num_deleted_embeddings += batch_deleted_embeddings
+
+        repo.indexed_blob_shas = blob_shas
+        if has_failed_files:
+            # Keep the last indexed commit, so the next sync doesn't skip the repo before the failed files are indexed
+            logger.warning(f"Failed to index some files in github repo {repo_shorthand}. Retry them on next sync")
+            repo.save(update_fields=["indexed_blob_shas", "updated_at"])
+            return num_new_embeddings, num_deleted_embeddings
+
+        repo.last_indexed_commit_sha = commit_sha
+        repo.save(
+            update_fields=["indexed_blob_shas", "last_indexed_commit_sha", "last_indexed_commit_etag", "updated_at"]
+        )
+        return num_new_embeddings, num_deleted_embeddings
+
+    def extract_entries(self, markdown_files, org_files, plaintext_files, repo_shorthand: str) -> List[Entry]:
         current_entries = []
 
         with timer(f"Extract markdown entries from github repo {repo_shorthand}", logger):
@@ -99,7 +180,7 @@ class GithubToEntries(TextToEntries):
 
         return current_entries
 
-    def update_entries_with_ids(self, current_entries, user: KhojUser = None):
+    def update_entries_with_ids(self, current_entries, user: KhojUser = None, deletion_filenames: Set[str] = None):
         # Identify, mark and merge any new entries with previous entries
         with timer("Identify new or updated entries", logger):
             num_new_embeddings, num_deleted_embeddings = self.update_embeddings(
@@ -109,70 +190,104 @@ class GithubToEntries(TextToEntries):
                 DbEntry.EntrySource.GITHUB,
                 key="compiled",
                 logger=logger,
+                deletion_filenames=deletion_filenames,
             )
 
         return num_new_embeddings, num_deleted_embeddings
 
-    def get_files(self, repo_url: str, repo: GithubRepoConfig):
-        # Get the contents of the repository
-        repo_content_url = f"{repo_url}/git/trees/{repo.branch}"
-        headers = {}
-        if not is_none_or_empty(self.config.pat_token):
-            headers = {"Authorization": f"token {self.config.pat_token}"}
-        params = {"recursive": "true"}
-        response = requests.get(repo_content_url, headers=headers, params=params)
-        contents = response.json()
+    def get_head_commit_sha(self, repo_url: str, repo: DbGithubRepoConfig, regenerate: bool = False) -> Optional[str]:
+        """
+        Get the commit SHA at the head of the repo branch.
+        Returns None if the branch head has not moved since the repo was last indexed.
+        """
+        headers = {"Accept": "application/vnd.github.sha"}
+        # Conditional requests for unchanged resources do not count against the Github rate limit
+        if not regenerate and repo.last_indexed_commit_sha and repo.last_indexed_commit_etag:
+            headers["If-None-Match"] = repo.last_indexed_commit_etag
+        response = self.session.get(f"{repo_url}/commits/{repo.branch}", headers=headers)
+
+        if response.status_code == 304:
+            return None
+        # Raise exception if hit rate limit
+        if response.status_code != 200 and response.headers.get("X-RateLimit-Remaining") == "0":
+            raise ConnectionAbortedError("Github rate limit reached")
+        response.raise_for_status()
+
+        commit_sha = response.text.strip()
+        repo.last_indexed_commit_etag = response.headers.get("ETag")
+        if not regenerate and commit_sha == repo.last_indexed_commit_sha:
+            repo.save(update_fields=["last_indexed_commit_etag", "updated_at"])
+            return None
+        return commit_sha
+
+    def get_tree(self, repo_url: str, commit_sha: str) -> Tuple[Dict[str, Dict[str, str]], bool]:
+        "Get the blobs in the repo tree at the commit, keyed by their path, and whether the tree was truncated"
+        response = self.session.get(f"{repo_url}/git/trees/{commit_sha}", params={"recursive": "true"})
 
         # Raise exception if hit rate limit
         if response.status_code != 200 and response.headers.get("X-RateLimit-Remaining") == "0":
             raise ConnectionAbortedError("Github rate limit reached")
+        response.raise_for_status()
+
+        contents = response.json()
+        is_truncated = bool(contents.get("truncated"))
+        if is_truncated:
+            logger.warning(
+                f"Github repo tree at {repo_url} is too large. Only indexing the files in the returned tree, "
+                "without deleting previously indexed files missing from it"
+            )
+        tree = {item["path"]: item for item in contents.get("tree", []) if item["type"] == "blob"}
+        return tree, is_truncated
+
+    @staticmethod
+    def get_file_url(repo: DbGithubRepoConfig, path: str) -> str:
+        "Create URL for file on Github"
+        return f"https://github.com/{repo.owner}/{repo.name}/blob/{repo.branch}/{path}"
 
-        # Extract markdown files from the repository
+    def download_files(self, repo: DbGithubRepoConfig, items: List[Dict[str, str]]):
+        "Concurrently download the file blobs and group them by file type"
         markdown_files: List[Dict[str, str]] = []
         org_files: List[Dict[str, str]] = []
         plaintext_files: List[Dict[str, str]] = []
-        if "tree" not in contents:
-            return markdown_files, org_files, plaintext_files
-
-        for item in contents["tree"]:
-            # Find all markdown files in the repository
-            if item["type"] == "blob" and item["path"].endswith(".md"):
-                # Create URL for each markdown file on Github
-                url_path = f'https://github.com/{repo.owner}/{repo.name}/blob/{repo.branch}/{item["path"]}'
-
-                # Add markdown file contents and URL to list
-                markdown_files += [{"content": self.get_file_contents(item["url"]), "path": url_path}]
-
-            # Find all org files in the repository
-            elif item["type"] == "blob" and item["path"].endswith(".org"):
-                # Create URL for each org file on Github
-                url_path = f'https://github.com/{repo.owner}/{repo.name}/blob/{repo.branch}/{item["path"]}'
-
-                # Add org file contents and URL to list
-                org_files += [{"content": self.get_file_contents(item["url"]), "path": url_path}]
-
-            # Find, index remaining non-binary files in the repository
-            elif item["type"] == "blob":
-                url_path = f'https://github.com/{repo.owner}/{repo.name}/blob/{repo.branch}/{item["path"]}'
-                content_bytes = self.get_file_contents(item["url"], decode=False)
-                content_type, content_str = None, None
-                try:
-                    content_type = magika.identify_bytes(content_bytes).output.group
-                except:
-                    logger.error(f"Unable to identify content type of file at {url_path}. Skip indexing it")
-                    continue
 
-                # Add non-binary file contents and URL to list
-                if content_type in ["text", "code"]:
-                    try:
-                        content_str = content_bytes.decode("utf-8")
-                    except:
-                        logger.error(f"Unable to decode content of file at {url_path}. Skip indexing it")
-                        continue
-                    plaintext_files += [{"content": content_str, "path": url_path}]
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_downloads) as executor:
+            downloaded_files = executor.map(lambda item: self.download_file(repo, item), items)
+            for item, content in zip(items, downloaded_files):
+                if content is None:
+                    continue
+                file = {"content": content, "path": self.get_file_url(repo, item["path"])}
+                if item["path"].endswith(".md"):
+                    markdown_files.append(file)
+                elif item["path"].endswith(".org"):
+                    org_files.append(file)
+                else:
+                    plaintext_files.append(file)
 
         return markdown_files, org_files, plaintext_files
 
+    def download_file(self, repo: DbGithubRepoConfig, item: Dict[str, str]) -> Optional[str]:
+        "Download content of file blob. Returns None for non-text files"
+        # Get markdown, org file contents
+        if item["path"].endswith(".md") or item["path"].endswith(".org"):
+            return self.get_file_contents(item["url"])
+
+        # Get remaining non-binary file contents
+        url_path = self.get_file_url(repo, item["path"])
+        content_bytes = self.get_file_contents(item["url"], decode=False)
+        try:
+            content_type = magika.identify_bytes(content_bytes).output.group
+        except:
+            logger.error(f"Unable to identify content type of file at {url_path}. Skip indexing it")
+            return None
+
+        if content_type not in ["text", "code"]:
+            return None
+        try:
+            return content_bytes.decode("utf-8")
+        except:
+            logger.error(f"Unable to decode content of file at {url_path}. Skip indexing it")
+            return None
+
     def get_file_contents(self, file_url, decode=True):
         # Get text from each markdown file
         headers = {"Accept": "application/vnd.github.v3.raw"}
@@ -24,6 +24,11 @@ class ImageToEntries(TextToEntries):
         files_to_process = set(files) - deletion_file_names
         files = {file: files[file] for file in files_to_process}
 
+        # Skip files unchanged since they were last indexed
+        files, file_to_content_hash_map = self.filter_unchanged_files(
+            user, files, DbEntry.EntryType.IMAGE, regenerate=regenerate, logger=logger
+        )
+
         # Extract Entries from specified image files
         with timer("Extract entries from specified Image files", logger):
             file_to_text_map, current_entries = ImageToEntries.extract_image_entries(files)
@@ -44,6 +49,7 @@ class ImageToEntries(TextToEntries):
                 deletion_file_names,
                 regenerate=regenerate,
                 file_to_text_map=file_to_text_map,
+                file_to_content_hash_map=file_to_content_hash_map,
             )
 
         return num_new_embeddings, num_deleted_embeddings
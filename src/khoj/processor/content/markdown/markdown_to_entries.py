@@ -25,6 +25,11 @@ class MarkdownToEntries(TextToEntries):
         files_to_process = set(files) - deletion_file_names
         files = {file: files[file] for file in files_to_process}
 
+        # Skip files unchanged since they were last indexed
+        files, file_to_content_hash_map = self.filter_unchanged_files(
+            user, files, DbEntry.EntryType.MARKDOWN, regenerate=regenerate, logger=logger
+        )
+
         max_tokens = 256
         # Extract Entries from specified Markdown files
         with timer("Extract entries from specified Markdown files", logger):
@@ -46,6 +51,7 @@ class MarkdownToEntries(TextToEntries):
                 deletion_file_names,
                 regenerate=regenerate,
                 file_to_text_map=file_to_text_map,
+                file_to_content_hash_map=file_to_content_hash_map,
             )
 
         return num_new_embeddings, num_deleted_embeddings
@@ -77,54 +83,56 @@ class MarkdownToEntries(TextToEntries):
         entries: List[str],
         entry_to_file_map: List[Tuple[str, str]],
         max_tokens=256,
-        ancestry: Dict[int, str] = {},
     ) -> Tuple[List[str], List[Tuple[str, str]]]:
-        # Prepend the markdown section's heading ancestry
-        ancestry_string = "\n".join([f"{'#' * key} {ancestry[key]}" for key in sorted(ancestry.keys())])
-        markdown_content_with_ancestry = f"{ancestry_string}{markdown_content}"
-
-        # If content is small or content has no children headings, save it as a single entry
-        if len(TextToEntries.tokenizer(markdown_content_with_ancestry)) <= max_tokens or not re.search(
-            rf"^#{{{len(ancestry)+1},}}\s", markdown_content, flags=re.MULTILINE
+        """
+        Split markdown content into entries by heading, with each entry prefixed by its heading ancestry.
+
+        Sections that fit within max_tokens are kept as a single entry. Larger sections are split at the
+        highest heading level present in them. The heading tree is built in a single scan of the file.
+        """
+        lines = markdown_content.split("\n")
+        heading_tree = MarkdownHeading.parse_heading_tree(lines)
+
+        # Precompute cumulative token counts and non blank line counts to size any section in constant time
+        tokens_before = [0] * (len(lines) + 1)
+        non_blank_lines_before = [0] * (len(lines) + 1)
+        for index, line in enumerate(lines):
+            tokens_before[index + 1] = tokens_before[index] + len(TextToEntries.tokenizer(line))
+            non_blank_lines_before[index + 1] = non_blank_lines_before[index] + (line.strip() != "")
+
+        def add_section(
+            ancestry: Dict[int, str], after_heading: bool, start: int, end: int, headings: List[MarkdownHeading]
         ):
-            entry_to_file_map += [(markdown_content_with_ancestry, markdown_file)]
-            entries.extend([markdown_content_with_ancestry])
-            return entries, entry_to_file_map
-
-        # Split by next heading level present in the entry
-        next_heading_level = len(ancestry)
-        sections: List[str] = []
-        while len(sections) < 2:
-            next_heading_level += 1
-            sections = re.split(rf"(\n|^)(?=[#]{{{next_heading_level}}} .+\n?)", markdown_content, flags=re.MULTILINE)
-
-        for section in sections:
-            # Skip empty sections
-            if section.strip() == "":
-                continue
-
-            # Extract the section body and (when present) the heading
-            current_ancestry = ancestry.copy()
-            first_line = [line for line in section.split("\n") if line.strip() != ""][0]
-            if re.search(rf"^#{{{next_heading_level}}} ", first_line):
-                # Extract the section body without the heading
-                current_section_body = "\n".join(section.split(first_line)[1:])
-                # Parse the section heading into current section ancestry
-                current_section_title = first_line[next_heading_level:].strip()
-                current_ancestry[next_heading_level] = current_section_title
-            else:
-                current_section_body = section
-
-            # Recurse down children of the current entry
-            MarkdownToEntries.process_single_markdown_file(
-                current_section_body,
-                markdown_file,
-                entries,
-                entry_to_file_map,
-                max_tokens,
-                current_ancestry,
-            )
-
+            # Section body following a heading line starts with the newline ending the heading line
+            section_lines = lines[start:end]
+            section_body = "\n".join([""] + section_lines if after_heading else section_lines)
+            ancestry_lines = [f"{'#' * level} {ancestry[level]}" for level in sorted(ancestry.keys())]
+
+            # If section is small or has no child headings, save it as a single entry with its heading ancestry
+            ancestry_tokens = sum(len(TextToEntries.tokenizer(line)) for line in ancestry_lines)
+            section_tokens = ancestry_tokens + tokens_before[end] - tokens_before[start]
+            if section_tokens <= max_tokens or not headings:
+                entry = "\n".join(ancestry_lines) + section_body
+                entry_to_file_map.append((entry, markdown_file))
+                entries.append(entry)
+                return
+
+            # Split section by the highest heading level present in it
+            split_level = min(heading.level for heading in headings)
+            split_headings = [heading for heading in headings if heading.level == split_level]
+
+            # Add the section content before its first split heading, if any
+            preamble_end = split_headings[0].line_index
+            if non_blank_lines_before[preamble_end] - non_blank_lines_before[start] > 0:
+                preamble_headings = [heading for heading in headings if heading.line_index < preamble_end]
+                add_section(ancestry, after_heading, start, preamble_end, preamble_headings)
+
+            # Add the sub-sections under each split heading with the split heading added to their ancestry
+            for heading in split_headings:
+                child_ancestry = {**ancestry, heading.level: heading.title}
+                add_section(child_ancestry, True, heading.line_index + 1, heading.end_index, heading.children)
+
+        add_section({}, False, 0, len(lines), heading_tree)
         return entries, entry_to_file_map
 
     @staticmethod
@@ -158,3 +166,47 @@ class MarkdownToEntries(TextToEntries):
         logger.debug(f"Converted {len(parsed_entries)} markdown entries to dictionaries")
 
         return entries
+
+
+class MarkdownHeading:
+    "Markdown heading with the line range of its section and its child headings"
+
+    def __init__(self, level: int, title: str, line_index: int):
+        self.level = level
+        self.title = title
+        self.line_index = line_index
+        self.end_index = line_index + 1
+        self.children: List[MarkdownHeading] = []
+
+    @staticmethod
+    def get_heading_level(line: str) -> int:
+        "Get level of markdown heading on line. Returns 0 if line is not a heading"
+        level = len(line) - len(line.lstrip("#"))
+        # A heading is a run of #'s followed by a space and a non-empty title
+        if level > 0 and line[level : level + 1] == " " and len(line) > level + 1:
+            return level
+        return 0
+
+    @staticmethod
+    def parse_heading_tree(lines: List[str]) -> List["MarkdownHeading"]:
+        "Build tree of markdown headings in a single scan of the lines. Returns the top level headings"
+        root = MarkdownHeading(level=0, title="", line_index=-1)
+        ancestors = [root]
+        for index, line in enumerate(lines):
+            level = MarkdownHeading.get_heading_level(line)
+            if level == 0:
+                continue
+
+            # Close sections of previous headings at the same or a deeper level
+            while ancestors[-1].level >= level:
+                ancestors.pop().end_index = index
+
+            heading = MarkdownHeading(level=level, title=line[level:].strip(), line_index=index)
+            ancestors[-1].children.append(heading)
+            ancestors.append(heading)
+
+        # Close sections of headings still open at the end of the file
+        for heading in ancestors[1:]:
+            heading.end_index = len(lines)
+
+        return root.children
@@ -1,8 +1,9 @@
+import asyncio
 import logging
 from enum import Enum
-from typing import Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
-import requests
+import aiohttp
 
 from khoj.database.models import Entry as DbEntry
 from khoj.database.models import KhojUser, NotionConfig
@@ -46,14 +47,21 @@ class NotionBlockType(Enum):
 
 
 class NotionToEntries(TextToEntries):
+    api_url = "https://api.notion.com/v1"
+    # Notion allows an average of 3 requests per second per integration
+    requests_per_second = 3
+    max_concurrent_requests = 5
+    max_retries = 3
+
     def __init__(self, config: NotionConfig):
         super().__init__(config)
+        self.notion_config = config
         self.config = NotionContentConfig(
             token=config.token,
         )
-        self.session = requests.Session()
+        self.headers = {}
         if config.token:
-            self.session.headers.update({"Authorization": f"Bearer {config.token}", "Notion-Version": "2022-02-22"})
+            self.headers = {"Authorization": f"Bearer {config.token}", "Notion-Version": "2022-02-22"}
         self.unsupported_block_types = [
             NotionBlockType.BOOKMARK.value,
             NotionBlockType.DIVIDER.value,
@@ -80,51 +88,83 @@ class NotionToEntries(TextToEntries):
         self.body_params = {"page_size": 100}
 
     def process(self, files: dict[str, str], user: KhojUser, regenerate: bool = False) -> Tuple[int, int]:
-        current_entries = []
+        # Last edited time of pages when they were indexed, keyed by page url
+        indexed_pages: Dict[str, str] = {} if regenerate else dict(self.notion_config.indexed_page_edit_times or {})
 
-        # Get all pages
-        with timer("Getting all pages via search endpoint", logger=logger):
-            responses = []
-
-            while True:
-                result = self.session.post(
-                    "https://api.notion.com/v1/search",
-                    json=self.body_params,
-                ).json()
-                responses.append(result)
-                if result.get("has_more", False) == False:
-                    break
-                else:
-                    self.body_params.update({"start_cursor": result["next_cursor"]})
-
-        for response in responses:
-            with timer("Processing response", logger=logger):
-                pages_or_databases = response.get("results", [])
-
-                # Get all pages content
-                for p_or_d in pages_or_databases:
-                    with timer(f"Processing {p_or_d['object']} {p_or_d['id']}", logger=logger):
-                        if p_or_d["object"] == "database":
-                            # TODO: Handle databases
-                            continue
-                        elif p_or_d["object"] == "page":
-                            page_entries = self.process_page(p_or_d)
-                            current_entries.extend(page_entries)
+        with timer("Crawled notion workspace in", logger=logger):
+            current_pages, page_entries = asyncio.run(self.acrawl(indexed_pages))
+        num_skipped_pages = len(current_pages) - len(page_entries)
+        logger.info(f"Found {len(page_entries)} new or updated notion pages to index. Skip {num_skipped_pages} pages")
 
+        current_entries = [entry for entries in page_entries.values() for entry in entries]
         current_entries = TextToEntries.split_entries_by_max_tokens(current_entries, max_tokens=256)
 
-        return self.update_entries_with_ids(current_entries, user=user)
+        # Delete entries of deleted pages and of updated pages with no content to index anymore
+        deletion_filenames = set(indexed_pages) - set(current_pages)
+        deletion_filenames |= {url for url, entries in page_entries.items() if not entries and url in indexed_pages}
 
-    def process_page(self, page):
-        page_id = page["id"]
-        title, content = self.get_page_content(page_id)
+        num_new_embeddings, num_deleted_embeddings = self.update_entries_with_ids(
+            current_entries, user=user, deletion_filenames=deletion_filenames, regenerate=regenerate
+        )
 
-        if title == None or content == None:
-            return []
+        # Remember last edited time of indexed pages to skip them on next sync if unchanged
+        indexed_page_edit_times = {url: edited for url, edited in indexed_pages.items() if url in current_pages}
+        indexed_page_edit_times.update({url: current_pages[url] for url in page_entries})
+        self.notion_config.indexed_page_edit_times = indexed_page_edit_times
+        self.notion_config.save(update_fields=["indexed_page_edit_times", "updated_at"])
 
+        return num_new_embeddings, num_deleted_embeddings
+
+    async def acrawl(self, indexed_pages: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, List[Entry]]]:
+        """
+        Crawl notion workspace for pages edited since they were last indexed.
+
+        Returns last edited time of all pages in the workspace and the entries of the new or edited pages.
+        Pages that fail to download are excluded from the entries, so they are retried on the next sync.
+        """
+        self.request_semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self.rate_limit_lock = asyncio.Lock()
+        self.next_request_time = 0.0
+
+        async with aiohttp.ClientSession(headers=self.headers) as session:
+            # Get all pages
+            with timer("Getting all pages via search endpoint", logger=logger):
+                pages = []
+                body_params = self.body_params.copy()
+                while True:
+                    result = await self.arequest(session, "POST", "search", json=body_params)
+                    # TODO: Handle databases
+                    pages += [p_or_d for p_or_d in result.get("results", []) if p_or_d["object"] == "page"]
+                    if result.get("has_more", False) == False:
+                        break
+                    body_params["start_cursor"] = result["next_cursor"]
+
+            current_pages = {page["url"]: page["last_edited_time"] for page in pages}
+            pages_to_index = [page for page in pages if indexed_pages.get(page["url"]) != page["last_edited_time"]]
+
+            # Get content of new or edited pages concurrently
+            page_entries = await asyncio.gather(*[self.aprocess_page(session, page) for page in pages_to_index])
+
+        return current_pages, {
+            page["url"]: entries for page, entries in zip(pages_to_index, page_entries) if entries is not None
+        }
+
+    async def aprocess_page(self, session: aiohttp.ClientSession, page) -> Optional[List[Entry]]:
+        with timer(f"Processing page {page['id']}", logger=logger):
+            try:
+                blocks = await self.aget_block_children(session, page["id"])
+            except Exception as e:
+                logger.error(f"Error getting page {page['id']}: {e}", exc_info=True)
+                return None
+            title = self.get_page_title(page)
+            if title == None:
+                return []
+            return self.process_page(page, title, blocks)
+
+    def process_page(self, page, title, blocks) -> List[Entry]:
         current_entries = []
         curr_heading = ""
-        for block in content.get("results", []):
+        for block in blocks:
             block_type = block.get("type")
 
             if block_type == None:
@@ -156,11 +196,9 @@ class NotionToEntries(TextToEntries):
             for text in block_data["rich_text"]:
                 raw_content += self.process_text(text)
 
-            if block.get("has_children", True):
+            if block.get("children"):
                 raw_content += "\n"
-                raw_content = self.process_nested_children(
-                    self.get_block_children(block["id"]), raw_content, block_type
-                )
+                raw_content = self.process_nested_children(block["children"], raw_content, block_type)
 
             if raw_content != "":
                 current_entries.append(
@@ -177,8 +215,7 @@ class NotionToEntries(TextToEntries):
         return f"\n<b>{heading}</b>\n"
 
     def process_nested_children(self, children, raw_content, block_type=None):
-        results = children.get("results", [])
-        for child in results:
+        for child in children:
             child_type = child.get("type")
             if child_type == None:
                 continue
@@ -186,8 +223,8 @@ class NotionToEntries(TextToEntries):
             if child_data.get("rich_text") and len(child_data["rich_text"]) > 0:
                 for text in child_data["rich_text"]:
                     raw_content += self.process_text(text, block_type)
-            if child_data.get("has_children", True):
-                return self.process_nested_children(self.get_block_children(child["id"]), raw_content, block_type)
+            if child.get("children"):
+                raw_content = self.process_nested_children(child["children"], raw_content, block_type)
 
         return raw_content
 
@@ -202,26 +239,50 @@ class NotionToEntries(TextToEntries):
             return f"\n{raw_text}\n"
         return raw_text
 
-    def get_block_children(self, block_id):
-        try:
-            return self.session.get(f"https://api.notion.com/v1/blocks/{block_id}/children").json()
-        except Exception as e:
-            logger.error(f"Error getting children for block {block_id}: {e}")
-            return {}
-
-    def get_page(self, page_id):
-        return self.session.get(f"https://api.notion.com/v1/pages/{page_id}").json()
-
-    def get_page_children(self, page_id):
-        return self.session.get(f"https://api.notion.com/v1/blocks/{page_id}/children").json()
-
-    def get_page_content(self, page_id):
-        try:
-            page = self.get_page(page_id)
-            content = self.get_page_children(page_id)
-        except Exception as e:
-            logger.error(f"Error getting page {page_id}: {e}", exc_info=True)
-            return None, None
+    async def aget_block_children(self, session: aiohttp.ClientSession, block_id) -> List[dict]:
+        "Get child blocks of block. Nested children of child blocks are fetched concurrently into their children field"
+        children = []
+        params: Dict[str, str] = {"page_size": "100"}
+        while True:
+            result = await self.arequest(session, "GET", f"blocks/{block_id}/children", params=params)
+            children += result.get("results", [])
+            if result.get("has_more", False) == False:
+                break
+            params["start_cursor"] = result["next_cursor"]
+
+        nested_children = await asyncio.gather(
+            *[self.aget_block_children(session, child["id"]) for child in children if child.get("has_children")]
+        )
+        for child, grandchildren in zip([child for child in children if child.get("has_children")], nested_children):
+            child["children"] = grandchildren
+        return children
+
+    async def arequest(self, session: aiohttp.ClientSession, method: str, path: str, **kwargs) -> dict:
+        "Make request to the Notion API within its rate limit. Retry rate limited requests after the requested delay"
+        for attempt in range(self.max_retries + 1):
+            async with self.request_semaphore:
+                await self.await_rate_limit()
+                async with session.request(method, f"{self.api_url}/{path}", **kwargs) as response:
+                    if response.status == 429 and attempt < self.max_retries:
+                        retry_after = float(response.headers.get("Retry-After", 1))
+                        logger.info(f"Notion rate limit reached. Retrying request after {retry_after} seconds")
+                    else:
+                        response.raise_for_status()
+                        return await response.json()
+            await asyncio.sleep(retry_after)
+        return {}
+
+    async def await_rate_limit(self):
+        "Space out requests to stay within the Notion API rate limit"
+        async with self.rate_limit_lock:
+            loop = asyncio.get_running_loop()
+            wait_time = self.next_request_time - loop.time()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            self.next_request_time = max(self.next_request_time, loop.time()) + 1 / self.requests_per_second
+
+    def get_page_title(self, page) -> Optional[str]:
+        page_id = page["id"]
         properties = page.get("properties", {})
 
         title_field = "title"
@@ -235,16 +296,21 @@ class NotionToEntries(TextToEntries):
             title_field = "Event"
         elif title_field not in properties:
             logger.debug(f"Title field not found for page {page_id}. Setting title as None...")
-            title = None
-            return title, content
+            return None
         try:
             title = page["properties"][title_field]["title"][0]["text"]["content"]
         except Exception as e:
             logger.warning(f"Error getting title for page {page_id}: {e}. Setting title as None...")
             title = None
-        return title, content
-
-    def update_entries_with_ids(self, current_entries, user: KhojUser = None):
+        return title
+
+    def update_entries_with_ids(
+        self,
+        current_entries,
+        user: KhojUser = None,
+        deletion_filenames: Set[str] = None,
+        regenerate: bool = False,
+    ):
         # Identify, mark and merge any new entries with previous entries
         with timer("Identify new or updated entries", logger):
             num_new_embeddings, num_deleted_embeddings = self.update_embeddings(
@@ -254,6 +320,8 @@ class NotionToEntries(TextToEntries):
                 DbEntry.EntrySource.NOTION,
                 key="compiled",
                 logger=logger,
+                deletion_filenames=deletion_filenames,
+                regenerate=regenerate,
             )
 
         return num_new_embeddings, num_deleted_embeddings
@@ -25,6 +25,11 @@ class OrgToEntries(TextToEntries):
         files_to_process = set(files) - deletion_file_names
         files = {file: files[file] for file in files_to_process}
 
+        # Skip files unchanged since they were last indexed
+        files, file_to_content_hash_map = self.filter_unchanged_files(
+            user, files, DbEntry.EntryType.ORG, regenerate=regenerate, logger=logger
+        )
+
         # Extract Entries from specified Org files
         max_tokens = 256
         with timer("Extract entries from specified Org files", logger):
@@ -45,6 +50,7 @@ class OrgToEntries(TextToEntries):
                 deletion_file_names,
                 regenerate=regenerate,
                 file_to_text_map=file_to_text_map,
+                file_to_content_hash_map=file_to_content_hash_map,
             )
 
         return num_new_embeddings, num_deleted_embeddings
@@ -37,9 +37,22 @@ import datetime
 import re
 from os.path import relpath
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
 
 indent_regex = re.compile(r"^ *")
+heading_regex = re.compile(r"^(\*+)\s(.*?)\s*$")
+tag_regex = re.compile(r"(.*?)\s*:([a-zA-Z0-9].*?):$")
+seq_todo_regex = re.compile(r"([A-Z]+)\(")
+title_regex = re.compile(r"^#\+TITLE:\s*(.*)$")
+clock_regex = re.compile(
+    r"CLOCK:\s*\[([0-9]{4}-[0-9]{2}-[0-9]{2} [a-zA-Z]{3} [0-9]{2}:[0-9]{2})\]--\[([0-9]{4}-[0-9]{2}-[0-9]{2} [a-zA-Z]{3} [0-9]{2}:[0-9]{2})\]"
+)
+property_regex = re.compile(r"^\s*:([a-zA-Z0-9]+):\s*(.*?)\s*$")
+closed_regex = re.compile(r"CLOSED:\s*\[([0-9]{4})-([0-9]{2})-([0-9]{2})")
+scheduled_regex = re.compile(r"SCHEDULED:\s*<([0-9]+)\-([0-9]+)\-([0-9]+)")
+deadline_regex = re.compile(r"DEADLINE:\s*<(\d+)\-(\d+)\-(\d+)")
+todo_regex = re.compile(r"([A-Z]+)\s(.*?)$")
+priority_regex = re.compile(r"^\[\#(A|B|C)\] (.*?)$")
 
 
 def normalize_filename(filename):
@@ -54,129 +67,158 @@ def normalize_filename(filename):
 
 
 def makelist_with_filepath(filename):
-    f = open(filename, "r")
-    return makelist(f, filename)
+    with open(filename, "r") as f:
+        return makelist(f, filename)
 
 
 def makelist(file, filename) -> List["Orgnode"]:
     """
     Read an org-mode file and return a list of Orgnode objects
     created from this file.
+
+    File level settings, like #+TITLE and #+SEQ_TODO, apply to all
+    nodes in the file, wherever they are set in the file.
     """
-    ctr = 0
+    parser = OrgnodeParser(filename)
+    nodelist = list(parser.parse(file))
 
-    if type(file) == str:
-        f = file.split("\n")
-    else:
-        f = file
-
-    todos = {
-        "TODO": "",
-        "WAITING": "",
-        "ACTIVE": "",
-        "DONE": "",
-        "CANCELLED": "",
-        "FAILED": "",
-    }  # populated from #+SEQ_TODO line
-    level = ""
-    heading = ""
-    ancestor_headings: List[str] = []
-    bodytext = ""
-    introtext = ""
-    tags: List[str] = list()  # set of all tags in headline
-    closed_date: datetime.date = None
-    sched_date: datetime.date = None
-    deadline_date: datetime.date = None
-    logbook: List[Tuple[datetime.datetime, datetime.datetime]] = list()
-    nodelist: List[Orgnode] = list()
-    property_map: Dict[str, str] = dict()
-    in_properties_drawer = False
-    in_logbook_drawer = False
-    file_title = f"{filename}"
-
-    for line in f:
-        ctr += 1
-        heading_search = re.search(r"^(\*+)\s(.*?)\s*$", line)
-        if heading_search:  # we are processing a heading line
-            if heading:  # if we have are on second heading, append first heading to headings list
-                thisNode = Orgnode(level, heading, bodytext, tags, ancestor_headings)
-                if closed_date:
-                    thisNode.closed = closed_date
-                    closed_date = None
-                if sched_date:
-                    thisNode.scheduled = sched_date
-                    sched_date = None
-                if deadline_date:
-                    thisNode.deadline = deadline_date
-                    deadline_date = None
-                if logbook:
-                    thisNode.logbook = logbook
-                    logbook = list()
-                thisNode.properties = property_map
-                nodelist.append(thisNode)
-            property_map = {"LINE": f"file:{normalize_filename(filename)}::{ctr}"}
-            previous_level = level
-            previous_heading: str = heading
-            level = heading_search.group(1)
-            heading = heading_search.group(2)
-            bodytext = ""
-            tags = list()  # set of all tags in headline
-            tag_search = re.search(r"(.*?)\s*:([a-zA-Z0-9].*?):$", heading)
-            if tag_search:
-                heading = tag_search.group(1)
-                parsedtags = tag_search.group(2)
-                if parsedtags:
-                    for parsedtag in parsedtags.split(":"):
-                        if parsedtag != "":
-                            tags.append(parsedtag)
-
-            # Add previous heading to ancestors if current heading is deeper than previous level
-            if len(level) > len(previous_level) and previous_heading:
-                ancestor_headings.append(previous_heading)
-            # Remove last ancestor(s) if current heading is shallower than previous level
-            elif len(level) < len(previous_level):
-                for _ in range(len(level), len(previous_level)):
-                    if not ancestor_headings or len(ancestor_headings) == 0:
-                        break
-                    ancestor_headings.pop()
-
-        else:  # we are processing a non-heading line
+    # write out intro node before headings
+    # this is done at the end to allow collating all title lines
+    if parser.introtext:
+        nodelist = [Orgnode(parser.level, parser.file_title, parser.introtext, parser.tags)] + nodelist
+
+    for n in nodelist:
+        parser.postprocess(n)
+
+    return nodelist
+
+
+class OrgnodeParser(object):
+    """
+    Single pass, line by line parser of an org-mode file into Orgnode objects.
+
+    Tracks the file level settings, like the file title and TODO keywords,
+    used to post-process the parsed nodes.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.normalized_filename = normalize_filename(filename)
+        self.todos = {
+            "TODO": "",
+            "WAITING": "",
+            "ACTIVE": "",
+            "DONE": "",
+            "CANCELLED": "",
+            "FAILED": "",
+        }  # populated from #+SEQ_TODO line
+        self.file_title = f"{filename}"
+        self.introtext = ""
+        self.level = ""
+        self.tags: List[str] = list()
+
+    def parse(self, file) -> Iterator["Orgnode"]:
+        """
+        Yield heading Orgnode objects from the org-mode file content or
+        iterable of lines, without post-processing them.
+
+        Text before the first heading is collected in the introtext attribute.
+        """
+        lines = file.split("\n") if isinstance(file, str) else file
+
+        ctr = 0
+        level = ""
+        heading = ""
+        ancestor_headings: List[str] = []
+        bodytext = ""
+        tags: List[str] = list()  # set of all tags in headline
+        closed_date: datetime.date = None
+        sched_date: datetime.date = None
+        deadline_date: datetime.date = None
+        logbook: List[Tuple[datetime.datetime, datetime.datetime]] = list()
+        property_map: Dict[str, str] = dict()
+        in_properties_drawer = False
+        in_logbook_drawer = False
+
+        for line in lines:
+            ctr += 1
+            # Cheap prefix and substring checks guard each regex, as most lines match none of them
+            heading_search = heading_regex.search(line) if line[:1] == "*" else None
+            if heading_search:  # we are processing a heading line
+                if heading:  # if we have are on second heading, yield the previous heading
+                    yield self._make_node(
+                        level,
+                        heading,
+                        bodytext,
+                        tags,
+                        ancestor_headings,
+                        property_map,
+                        closed_date,
+                        sched_date,
+                        deadline_date,
+                        logbook,
+                    )
+                    closed_date, sched_date, deadline_date, logbook = None, None, None, list()
+                property_map = {"LINE": f"file:{self.normalized_filename}::{ctr}"}
+                previous_level = level
+                previous_heading: str = heading
+                level = heading_search.group(1)
+                heading = heading_search.group(2)
+                bodytext = ""
+                tags = list()  # set of all tags in headline
+                tag_search = tag_regex.search(heading)
+                if tag_search:
+                    heading = tag_search.group(1)
+                    parsedtags = tag_search.group(2)
+                    if parsedtags:
+                        for parsedtag in parsedtags.split(":"):
+                            if parsedtag != "":
+                                tags.append(parsedtag)
+
+                # Add previous heading to ancestors if current heading is deeper than previous level
+                if len(level) > len(previous_level) and previous_heading:
+                    ancestor_headings.append(previous_heading)
+                # Remove last ancestor(s) if current heading is shallower than previous level
+                elif len(level) < len(previous_level):
+                    for _ in range(len(level), len(previous_level)):
+                        if not ancestor_headings or len(ancestor_headings) == 0:
+                            break
+                        ancestor_headings.pop()
+                continue
+
+            # we are processing a non-heading line
             if line[:10] == "#+SEQ_TODO":
-                kwlist = re.findall(r"([A-Z]+)\(", line)
-                for kw in kwlist:
-                    todos[kw] = ""
+                for kw in seq_todo_regex.findall(line):
+                    self.todos[kw] = ""
 
             # Set file title to TITLE property, if it exists
-            title_search = re.search(r"^#\+TITLE:\s*(.*)$", line)
+            title_search = title_regex.search(line) if line[:8] == "#+TITLE:" else None
             if title_search and title_search.group(1).strip() != "":
                 title_text = title_search.group(1).strip()
-                if file_title == f"{filename}":
-                    file_title = title_text
+                if self.file_title == f"{self.filename}":
+                    self.file_title = title_text
                 else:
-                    file_title += f" {title_text}"
+                    self.file_title += f" {title_text}"
                 continue
 
             # Ignore Properties Drawer Start, End Lines
-            if re.search(":PROPERTIES:", line):
+            if ":PROPERTIES:" in line:
                 in_properties_drawer = True
                 continue
-            if in_properties_drawer and re.search(":END:", line):
+            if in_properties_drawer and ":END:" in line:
                 in_properties_drawer = False
                 continue
 
             # Ignore Logbook Drawer Start, End Lines
-            if re.search(":LOGBOOK:", line):
+            if ":LOGBOOK:" in line:
                 in_logbook_drawer = True
                 continue
-            if in_logbook_drawer and re.search(":END:", line):
+            if in_logbook_drawer and ":END:" in line:
                 in_logbook_drawer = False
                 continue
 
             # Extract Clocking Lines
-            clocked_re = re.search(
-                r"CLOCK:\s*\[([0-9]{4}-[0-9]{2}-[0-9]{2} [a-zA-Z]{3} [0-9]{2}:[0-9]{2})\]--\[([0-9]{4}-[0-9]{2}-[0-9]{2} [a-zA-Z]{3} [0-9]{2}:[0-9]{2})\]",
-                line,
-            )
+            clocked_re = clock_regex.search(line) if "CLOCK:" in line else None
             if clocked_re:
                 # convert clock in, clock out strings to datetime objects
                 clocked_in = datetime.datetime.strptime(clocked_re.group(1), "%Y-%m-%d %a %H:%M")
@@ -185,7 +227,7 @@ def makelist(file, filename) -> List["Orgnode"]:
                 logbook += [(clocked_in, clocked_out)]
                 line = ""
 
-            property_search = re.search(r"^\s*:([a-zA-Z0-9]+):\s*(.*?)\s*$", line)
+            property_search = property_regex.search(line) if line.lstrip()[:1] == ":" else None
             if property_search:
                 # Set ID property to an id based org-mode link to the entry
                 if property_search.group(1) == "ID":
@@ -194,13 +236,13 @@ def makelist(file, filename) -> List["Orgnode"]:
                     property_map[property_search.group(1)] = property_search.group(2)
                 continue
 
-            cd_re = re.search(r"CLOSED:\s*\[([0-9]{4})-([0-9]{2})-([0-9]{2})", line)
+            cd_re = closed_regex.search(line) if "CLOSED:" in line else None
             if cd_re:
                 closed_date = datetime.date(int(cd_re.group(1)), int(cd_re.group(2)), int(cd_re.group(3)))
-            sd_re = re.search(r"SCHEDULED:\s*<([0-9]+)\-([0-9]+)\-([0-9]+)", line)
+            sd_re = scheduled_regex.search(line) if "SCHEDULED:" in line else None
             if sd_re:
                 sched_date = datetime.date(int(sd_re.group(1)), int(sd_re.group(2)), int(sd_re.group(3)))
-            dd_re = re.search(r"DEADLINE:\s*<(\d+)\-(\d+)\-(\d+)", line)
+            dd_re = deadline_regex.search(line) if "DEADLINE:" in line else None
             if dd_re:
                 deadline_date = datetime.date(int(dd_re.group(1)), int(dd_re.group(2)), int(dd_re.group(3)))
 
@@ -217,58 +259,77 @@ def makelist(file, filename) -> List["Orgnode"]:
                 if heading:
                     # add the line to the bodytext
                     bodytext += line.rstrip() + "\n\n" if line.strip() else ""
-                    # bodytext += line + "\n" if line.strip() else "\n"
                 # else we are in the pre heading portion of the file
                 elif line.strip():
                     # so add the line to the introtext
-                    introtext += line
+                    self.introtext += line
+
+        # Track level, tags of last heading. The intro node of makelist gets them
+        self.level = level
+        self.tags = tags
+
+        # write out last heading node
+        if heading:
+            yield self._make_node(
+                level,
+                heading,
+                bodytext,
+                tags,
+                ancestor_headings,
+                property_map,
+                closed_date,
+                sched_date,
+                deadline_date,
+                logbook,
+            )
 
-    # write out intro node before headings
-    # this is done at the end to allow collating all title lines
-    if introtext:
-        thisNode = Orgnode(level, file_title, introtext, tags)
-        nodelist = [thisNode] + nodelist
-    # write out last heading node
-    if heading:
-        thisNode = Orgnode(level, heading, bodytext, tags, ancestor_headings)
-        thisNode.properties = property_map
+    @staticmethod
+    def _make_node(
+        level, heading, bodytext, tags, ancestor_headings, property_map, closed_date, sched_date, deadline_date, logbook
+    ) -> "Orgnode":
+        node = Orgnode(level, heading, bodytext, tags, ancestor_headings)
+        if closed_date:
+            node.closed = closed_date
         if sched_date:
-            thisNode.scheduled = sched_date
+            node.scheduled = sched_date
         if deadline_date:
-            thisNode.deadline = deadline_date
-        if closed_date:
-            thisNode.closed = closed_date
+            node.deadline = deadline_date
         if logbook:
-            thisNode.logbook = logbook
-        nodelist.append(thisNode)
+            node.logbook = logbook
+        node.properties = property_map
+        return node
 
-    # using the list of TODO keywords found in the file
-    # process the headings searching for TODO keywords
-    for n in nodelist:
-        todo_search = re.search(r"([A-Z]+)\s(.*?)$", n.heading)
+    def postprocess(self, n: "Orgnode") -> "Orgnode":
+        """
+        Extract TODO keyword, priority from heading of node and set its file
+        title ancestor and source link using the file settings parsed so far.
+        """
+        # using the list of TODO keywords found in the file
+        # process the headings searching for TODO keywords
+        todo_search = todo_regex.search(n.heading)
         if todo_search:
-            if todo_search.group(1) in todos:
+            if todo_search.group(1) in self.todos:
                 n.heading = todo_search.group(2)
                 n.todo = todo_search.group(1)
 
         # extract, set priority from heading, update heading if necessary
-        priority_search = re.search(r"^\[\#(A|B|C)\] (.*?)$", n.heading)
+        priority_search = priority_regex.search(n.heading)
         if priority_search:
             n.priority = priority_search.group(1)
             n.heading = priority_search.group(2)
 
         # Prefix filepath/title to ancestors
-        n.ancestors = [file_title] + n.ancestors
+        n.ancestors = [self.file_title] + n.ancestors
 
         # Set SOURCE property to a file+heading based org-mode link to the entry
         if n.level == 0:
-            n.properties["LINE"] = f"file:{normalize_filename(filename)}::0"
-            n.properties["SOURCE"] = f"[[file:{normalize_filename(filename)}]]"
+            n.properties["LINE"] = f"file:{self.normalized_filename}::0"
+            n.properties["SOURCE"] = f"[[file:{self.normalized_filename}]]"
         else:
             escaped_heading = n.heading.replace("[", "\\[").replace("]", "\\]")
-            n.properties["SOURCE"] = f"[[file:{normalize_filename(filename)}::*{escaped_heading}]]"
+            n.properties["SOURCE"] = f"[[file:{self.normalized_filename}::*{escaped_heading}]]"
 
-    return nodelist
+        return n
 
 
 ######################
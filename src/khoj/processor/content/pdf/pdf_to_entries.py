@@ -27,6 +27,11 @@ class PdfToEntries(TextToEntries):
         files_to_process = set(files) - deletion_file_names
         files = {file: files[file] for file in files_to_process}
 
+        # Skip files unchanged since they were last indexed
+        files, file_to_content_hash_map = self.filter_unchanged_files(
+            user, files, DbEntry.EntryType.PDF, regenerate=regenerate, logger=logger
+        )
+
         # Extract Entries from specified Pdf files
         with timer("Extract entries from specified PDF files", logger):
             file_to_text_map, current_entries = PdfToEntries.extract_pdf_entries(files)
@@ -47,6 +52,7 @@ class PdfToEntries(TextToEntries):
                 deletion_file_names,
                 regenerate=regenerate,
                 file_to_text_map=file_to_text_map,
+                file_to_content_hash_map=file_to_content_hash_map,
             )
 
         return num_new_embeddings, num_deleted_embeddings
@@ -25,6 +25,11 @@ class PlaintextToEntries(TextToEntries):
         files_to_process = set(files) - deletion_file_names
         files = {file: files[file] for file in files_to_process}
 
+        # Skip files unchanged since they were last indexed
+        files, file_to_content_hash_map = self.filter_unchanged_files(
+            user, files, DbEntry.EntryType.PLAINTEXT, regenerate=regenerate, logger=logger
+        )
+
         # Extract Entries from specified plaintext files
         with timer("Extract entries from specified Plaintext files", logger):
             file_to_text_map, current_entries = PlaintextToEntries.extract_plaintext_entries(files)
@@ -45,6 +50,7 @@ class PlaintextToEntries(TextToEntries):
                 deletion_filenames=deletion_file_names,
                 regenerate=regenerate,
                 file_to_text_map=file_to_text_map,
+                file_to_content_hash_map=file_to_content_hash_map,
             )
 
         return num_new_embeddings, num_deleted_embeddings
@@ -3,9 +3,11 @@ import logging
 import re
 import uuid
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
 from itertools import repeat
-from typing import Any, Callable, List, Set, Tuple
+from typing import Any, Callable, Dict, List, Set, Tuple, Union
 
+from django.db import transaction
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from tqdm import tqdm
 
@@ -18,7 +20,7 @@ from khoj.database.models import Entry as DbEntry
 from khoj.database.models import EntryDates, KhojUser
 from khoj.search_filter.date_filter import DateFilter
 from khoj.utils import state
-from khoj.utils.helpers import batcher, is_none_or_empty, timer
+from khoj.utils.helpers import batcher, is_env_var_true, is_none_or_empty, timer
 from khoj.utils.rawconfig import Entry
 
 logger = logging.getLogger(__name__)
@@ -29,6 +31,8 @@ class TextToEntries(ABC):
         self.embeddings_model = state.embeddings_model
         self.config = config
         self.date_filter = DateFilter()
+        # Files with entries that failed to be added to the database by the last update of embeddings
+        self.failed_files: Set[str] = set()
 
     @abstractmethod
     def process(self, files: dict[str, str], user: KhojUser, regenerate: bool = False) -> Tuple[int, int]:
@@ -38,6 +42,41 @@ class TextToEntries(ABC):
     def hash_func(key: str) -> Callable:
         return lambda entry: hashlib.md5(bytes(getattr(entry, key), encoding="utf-8")).hexdigest()
 
+    @staticmethod
+    def hash_content(content: Union[str, bytes]) -> str:
+        "Fingerprint raw file content to detect changes to file since it was last indexed."
+        content_bytes = content if isinstance(content, bytes) else bytes(content, encoding="utf-8")
+        return hashlib.md5(content_bytes).hexdigest()
+
+    @staticmethod
+    def filter_unchanged_files(
+        user: KhojUser,
+        files: Dict[str, Union[str, bytes]],
+        file_type: str,
+        regenerate: bool = False,
+        logger: logging.Logger = None,
+    ) -> Tuple[Dict[str, Union[str, bytes]], Dict[str, str]]:
+        """
+        Drop files with same content as when they were last indexed to avoid re-parsing them.
+        Returns the files to process and the content hash of each file to process.
+        """
+        file_to_content_hash_map = {file: TextToEntries.hash_content(content) for file, content in files.items()}
+        if regenerate or is_none_or_empty(files):
+            return files, file_to_content_hash_map
+
+        with timer("Identified unchanged files to skip in", logger):
+            indexed_files = FileObjectAdapters.get_indexed_file_fingerprints(user, file_type, list(files))
+            unchanged_files = {
+                file
+                for file, content_hash in file_to_content_hash_map.items()
+                if file in indexed_files and indexed_files[file]["content_hash"] == content_hash
+            }
+
+        if unchanged_files:
+            logger.debug(f"Skipping {len(unchanged_files)} unchanged {file_type} files")
+        files_to_process = {file: files[file] for file in files if file not in unchanged_files}
+        return files_to_process, {file: file_to_content_hash_map[file] for file in files_to_process}
+
     @staticmethod
     def remove_long_words(text: str, max_word_length: int = 500) -> str:
         "Remove words longer than max_word_length from text."
@@ -123,6 +162,7 @@ class TextToEntries(ABC):
         deletion_filenames: Set[str] = None,
         regenerate: bool = False,
         file_to_text_map: dict[str, str] = None,
+        file_to_content_hash_map: dict[str, str] = None,
     ):
         with timer("Constructed current entry hashes in", logger):
             hashes_by_file = dict[str, set[str]]()
@@ -132,20 +172,29 @@ class TextToEntries(ABC):
                 hashes_by_file.setdefault(entry.file, set()).add(TextToEntries.hash_func(key)(entry))
 
         num_deleted_entries = 0
-        if regenerate:
+        previous_max_entry_id = None
+        if regenerate and is_env_var_true("KHOJ_SWAP_IN_REGENERATE"):
+            # Keep serving search from the existing entries until the regenerated entries are indexed.
+            # Otherwise regenerate deletes the existing entries before re-indexing them
+            previous_max_entry_id = EntryAdapters.get_max_entry_id(user, file_type=file_type)
+        elif regenerate:
             with timer("Cleared existing dataset for regeneration in", logger):
                 logger.debug(f"Deleting all entries for file type {file_type}")
                 num_deleted_entries = EntryAdapters.delete_all_entries(user, file_type=file_type)
 
         hashes_to_process = set()
         with timer("Identified entries to add to database in", logger):
-            for file in tqdm(hashes_by_file, desc="Identify new entries"):
-                hashes_for_file = hashes_by_file[file]
-                existing_entries = DbEntry.objects.filter(
-                    user=user, hashed_value__in=hashes_for_file, file_type=file_type
-                )
-                existing_entry_hashes = set([entry.hashed_value for entry in existing_entries])
-                hashes_to_process |= hashes_for_file - existing_entry_hashes
+            if regenerate:
+                # Index all current entries afresh on regeneration
+                hashes_to_process = set(hash_to_current_entries)
+            else:
+                for file in tqdm(hashes_by_file, desc="Identify new entries"):
+                    hashes_for_file = hashes_by_file[file]
+                    existing_entries = DbEntry.objects.filter(
+                        user=user, hashed_value__in=hashes_for_file, file_type=file_type
+                    )
+                    existing_entry_hashes = set([entry.hashed_value for entry in existing_entries])
+                    hashes_to_process |= hashes_for_file - existing_entry_hashes
 
         embeddings = []
         model = get_default_search_model()
@@ -168,69 +217,94 @@ class TextToEntries(ABC):
                         file_object = FileObjectAdapters.create_file_object(user, modified_file, raw_text)
                     file_to_file_object_map[modified_file] = file_object
 
-        added_entries: list[DbEntry] = []
-        with timer("Added entries to database in", logger):
-            num_items = len(hashes_to_process)
-            assert num_items == len(embeddings)
-            batch_size = min(200, num_items)
-            entry_batches = zip(hashes_to_process, embeddings)
-
-            for entry_batch in tqdm(batcher(entry_batches, batch_size), desc="Add entries to database"):
-                batch_embeddings_to_create: List[DbEntry] = []
-                for entry_hash, new_entry in entry_batch:
-                    entry = hash_to_current_entries[entry_hash]
-                    file_object = file_to_file_object_map.get(entry.file, None)
-                    batch_embeddings_to_create.append(
-                        DbEntry(
-                            user=user,
-                            embeddings=new_entry,
-                            raw=entry.raw,
-                            compiled=entry.compiled,
-                            heading=entry.heading[:1000],  # Truncate to max chars of field allowed
-                            file_path=entry.file,
-                            file_source=file_source,
-                            file_type=file_type,
-                            hashed_value=entry_hash,
-                            corpus_id=entry.corpus_id,
-                            search_model=model,
-                            file_object=file_object,
+        # Swap in the regenerated entries for the existing entries in one transaction,
+        # so searches see either the existing or the regenerated entries, never both
+        swap_transaction = transaction.atomic() if previous_max_entry_id is not None else nullcontext()
+        with swap_transaction:
+            added_entries: list[DbEntry] = []
+            failed_files: set[str] = set()
+            with timer("Added entries to database in", logger):
+                num_items = len(hashes_to_process)
+                assert num_items == len(embeddings)
+                batch_size = min(200, num_items)
+                entry_batches = zip(hashes_to_process, embeddings)
+
+                for entry_batch in tqdm(batcher(entry_batches, batch_size), desc="Add entries to database"):
+                    batch_embeddings_to_create: List[DbEntry] = []
+                    for entry_hash, new_entry in entry_batch:
+                        entry = hash_to_current_entries[entry_hash]
+                        file_object = file_to_file_object_map.get(entry.file, None)
+                        batch_embeddings_to_create.append(
+                            DbEntry(
+                                user=user,
+                                embeddings=new_entry,
+                                raw=entry.raw,
+                                compiled=entry.compiled,
+                                heading=entry.heading[:1000],  # Truncate to max chars of field allowed
+                                file_path=entry.file,
+                                file_source=file_source,
+                                file_type=file_type,
+                                hashed_value=entry_hash,
+                                corpus_id=entry.corpus_id,
+                                search_model=model,
+                                file_object=file_object,
+                            )
                         )
+                    try:
+                        added_entries += EntryAdapters.add_entries(user, batch_embeddings_to_create)
+                    except Exception as e:
+                        batch_indexing_error = "\n\n".join(
+                            f"file: {entry.file_path}\nheading: {entry.heading}\ncompiled: {entry.compiled[:100]}\nraw: {entry.raw[:100]}"
+                            for entry in batch_embeddings_to_create
+                        )
+                        logger.error(
+                            f"Error adding entries to database:\n{batch_indexing_error}\n---\n{e}", exc_info=True
+                        )
+                        failed_files |= {entry.file_path for entry in batch_embeddings_to_create}
+                logger.debug(f"Added {len(added_entries)} {file_type} entries to database")
+                self.failed_files = failed_files
+
+            new_dates = []
+            with timer("Indexed dates from added entries in", logger):
+                for added_entry in added_entries:
+                    dates_in_entries = zip(self.date_filter.extract_dates(added_entry.compiled), repeat(added_entry))
+                    dates_to_create = [
+                        EntryDates(date=date, entry=added_entry)
+                        for date, added_entry in dates_in_entries
+                        if not is_none_or_empty(date)
+                    ]
+                    new_dates += EntryDates.objects.bulk_create(dates_to_create)
+                logger.debug(f"Indexed {len(new_dates)} dates from added {file_type} entries")
+
+            with timer("Deleted entries identified by server from database in", logger):
+                for file in hashes_by_file:
+                    existing_entry_hashes = EntryAdapters.get_existing_entry_hashes_by_file(user, file)
+                    to_delete_entry_hashes = set(existing_entry_hashes) - hashes_by_file[file]
+                    num_deleted_entries += len(to_delete_entry_hashes)
+                    EntryAdapters.delete_entry_by_hash(user, hashed_values=list(to_delete_entry_hashes))
+
+            with timer("Deleted entries requested by clients from database in", logger):
+                if deletion_filenames is not None:
+                    for file_path in deletion_filenames:
+                        deleted_count = EntryAdapters.delete_entry_by_file(user, file_path)
+                        num_deleted_entries += deleted_count
+                        FileObjectAdapters.delete_file_object_by_name(user, file_path)
+
+            if previous_max_entry_id is not None:
+                with timer("Swapped out entries indexed before regeneration in", logger):
+                    num_deleted_entries += EntryAdapters.delete_all_entries(
+                        user, file_type=file_type, max_entry_id=previous_max_entry_id
                     )
-                try:
-                    added_entries += DbEntry.objects.bulk_create(batch_embeddings_to_create)
-                except Exception as e:
-                    batch_indexing_error = "\n\n".join(
-                        f"file: {entry.file_path}\nheading: {entry.heading}\ncompiled: {entry.compiled[:100]}\nraw: {entry.raw[:100]}"
-                        for entry in batch_embeddings_to_create
-                    )
-                    logger.error(f"Error adding entries to database:\n{batch_indexing_error}\n---\n{e}", exc_info=True)
-            logger.debug(f"Added {len(added_entries)} {file_type} entries to database")
-
-        new_dates = []
-        with timer("Indexed dates from added entries in", logger):
-            for added_entry in added_entries:
-                dates_in_entries = zip(self.date_filter.extract_dates(added_entry.compiled), repeat(added_entry))
-                dates_to_create = [
-                    EntryDates(date=date, entry=added_entry)
-                    for date, added_entry in dates_in_entries
-                    if not is_none_or_empty(date)
-                ]
-                new_dates += EntryDates.objects.bulk_create(dates_to_create)
-            logger.debug(f"Indexed {len(new_dates)} dates from added {file_type} entries")
-
-        with timer("Deleted entries identified by server from database in", logger):
-            for file in hashes_by_file:
-                existing_entry_hashes = EntryAdapters.get_existing_entry_hashes_by_file(user, file)
-                to_delete_entry_hashes = set(existing_entry_hashes) - hashes_by_file[file]
-                num_deleted_entries += len(to_delete_entry_hashes)
-                EntryAdapters.delete_entry_by_hash(user, hashed_values=list(to_delete_entry_hashes))
-
-        with timer("Deleted entries requested by clients from database in", logger):
-            if deletion_filenames is not None:
-                for file_path in deletion_filenames:
-                    deleted_count = EntryAdapters.delete_entry_by_file(user, file_path)
-                    num_deleted_entries += deleted_count
-                    FileObjectAdapters.delete_file_object_by_name(user, file_path)
+
+        if file_to_content_hash_map:
+            with timer("Updated content hash of indexed files in", logger):
+                # Only fingerprint files that were fully indexed, so files with failed entries get retried on next sync
+                indexed_file_hashes = {
+                    file: content_hash
+                    for file, content_hash in file_to_content_hash_map.items()
+                    if file not in failed_files
+                }
+                FileObjectAdapters.update_content_hashes(user, indexed_file_hashes)
 
         return len(added_entries), num_deleted_entries
 
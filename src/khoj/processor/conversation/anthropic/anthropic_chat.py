@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime, timedelta
+from functools import partial
 from typing import Dict, List, Optional
 
 import pyjson5
@@ -16,6 +17,7 @@ from khoj.processor.conversation.utils import (
     clean_json,
     construct_structured_message,
     generate_chatml_messages_with_context,
+    get_chat_actor_response,
     messages_to_print,
 )
 from khoj.utils.helpers import (
@@ -41,6 +43,7 @@ def extract_questions_anthropic(
     vision_enabled: bool = False,
     personality_context: Optional[str] = None,
     query_files: str = None,
+    cache_ttl: timedelta = None,
     tracer: dict = {},
 ):
     """
@@ -93,16 +96,26 @@ def extract_questions_anthropic(
     messages = []
 
     messages.append(ChatMessage(content=prompt, role="user"))
+    prompt_messages = [ChatMessage(content=system_prompt, role="system")] + messages
 
     messages, system_prompt = format_messages_for_anthropic(messages, system_prompt)
 
-    response = anthropic_completion_with_backoff(
-        messages=messages,
-        system_prompt=system_prompt,
-        model_name=model,
-        temperature=temperature,
-        api_key=api_key,
+    response = get_chat_actor_response(
+        partial(
+            anthropic_completion_with_backoff,
+            messages=messages,
+            system_prompt=system_prompt,
+            model_name=model,
+            temperature=temperature,
+            api_key=api_key,
+            response_type="json_object",
+            tracer=tracer,
+        ),
+        prompt_messages,
+        ChatModel.ModelType.ANTHROPIC,
+        model,
         response_type="json_object",
+        cache_ttl=cache_ttl,
         tracer=tracer,
     )
 
@@ -231,8 +244,6 @@ def converse_anthropic(
     # Get Response from Claude
     return anthropic_chat_completion_with_backoff(
         messages=messages,
-        compiled_references=references,
-        online_results=online_results,
         model_name=model,
         temperature=0,
         api_key=api_key,
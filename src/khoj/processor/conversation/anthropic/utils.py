@@ -1,6 +1,5 @@
 import logging
-from threading import Thread
-from typing import Dict, List
+from typing import AsyncGenerator, Dict, List
 
 import anthropic
 from langchain.schema import ChatMessage
@@ -13,21 +12,22 @@ from tenacity import (
 )
 
 from khoj.processor.conversation.utils import (
-    ThreadedGenerator,
+    astream_with_completion,
     commit_conversation_trace,
     get_image_from_url,
 )
 from khoj.utils import state
 from khoj.utils.helpers import (
-    get_chat_usage_metrics,
     in_debug_mode,
     is_none_or_empty,
     is_promptrace_enabled,
+    update_chat_usage_metrics,
 )
 
 logger = logging.getLogger(__name__)
 
 anthropic_clients: Dict[str, anthropic.Anthropic] = {}
+async_anthropic_clients: Dict[str, anthropic.AsyncAnthropic] = {}
 
 
 DEFAULT_MAX_TOKENS_ANTHROPIC = 3000
@@ -82,9 +82,9 @@ def anthropic_completion_with_backoff(
         final_message = stream.get_final_message()
 
     # Calculate cost of chat
-    input_tokens = final_message.usage.input_tokens
+    input_tokens, cached_tokens = get_anthropic_input_tokens(final_message.usage)
     output_tokens = final_message.usage.output_tokens
-    tracer["usage"] = get_chat_usage_metrics(model_name, input_tokens, output_tokens, tracer.get("usage"))
+    update_chat_usage_metrics(tracer, model_name, input_tokens, output_tokens, cached_tokens=cached_tokens)
 
     # Save conversation trace
     tracer["chat_model"] = model_name
@@ -95,16 +95,8 @@ def anthropic_completion_with_backoff(
     return aggregated_response
 
 
-@retry(
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    stop=stop_after_attempt(2),
-    before_sleep=before_sleep_log(logger, logging.DEBUG),
-    reraise=True,
-)
 def anthropic_chat_completion_with_backoff(
     messages,
-    compiled_references,
-    online_results,
     model_name,
     temperature,
     api_key,
@@ -113,33 +105,43 @@ def anthropic_chat_completion_with_backoff(
     completion_func=None,
     model_kwargs=None,
     tracer={},
-):
-    g = ThreadedGenerator(compiled_references, online_results, completion_func=completion_func)
-    t = Thread(
-        target=anthropic_llm_thread,
-        args=(g, messages, system_prompt, model_name, temperature, api_key, max_prompt_size, model_kwargs, tracer),
+) -> AsyncGenerator[str, None]:
+    "Stream chat response from the async Anthropic client. The completion func is called with the full response"
+    response_stream = anthropic_llm_stream(
+        messages, system_prompt, model_name, temperature, api_key, max_prompt_size, model_kwargs, tracer
     )
-    t.start()
-    return g
+    return astream_with_completion(response_stream, completion_func=completion_func)
 
 
-def anthropic_llm_thread(
-    g, messages, system_prompt, model_name, temperature, api_key, max_prompt_size=None, model_kwargs=None, tracer={}
-):
+@retry(
+    wait=wait_exponential(multiplier=1, min=4, max=10),
+    stop=stop_after_attempt(2),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=True,
+)
+async def anthropic_acreate_message_stream(client: anthropic.AsyncAnthropic, **kwargs):
+    "Start message stream. Retried until the response starts streaming, so no partial response is repeated"
+    return await client.messages.create(stream=True, **kwargs)
+
+
+async def anthropic_llm_stream(
+    messages, system_prompt, model_name, temperature, api_key, max_prompt_size=None, model_kwargs=None, tracer={}
+) -> AsyncGenerator[str, None]:
     try:
-        if api_key not in anthropic_clients:
-            client: anthropic.Anthropic = anthropic.Anthropic(api_key=api_key)
-            anthropic_clients[api_key] = client
+        if api_key not in async_anthropic_clients:
+            client: anthropic.AsyncAnthropic = anthropic.AsyncAnthropic(api_key=api_key)
+            async_anthropic_clients[api_key] = client
         else:
-            client: anthropic.Anthropic = anthropic_clients[api_key]
+            client: anthropic.AsyncAnthropic = async_anthropic_clients[api_key]
 
         formatted_messages: List[anthropic.types.MessageParam] = [
             anthropic.types.MessageParam(role=message.role, content=message.content) for message in messages
         ]
 
         aggregated_response = ""
-        final_message = None
-        with client.messages.stream(
+        input_tokens, output_tokens, cached_tokens = 0, 0, 0
+        stream = await anthropic_acreate_message_stream(
+            client,
             messages=formatted_messages,
             model=model_name,  # type: ignore
             temperature=temperature,
@@ -147,16 +149,18 @@ def anthropic_llm_thread(
             timeout=20,
             max_tokens=DEFAULT_MAX_TOKENS_ANTHROPIC,
             **(model_kwargs or dict()),
-        ) as stream:
-            for text in stream.text_stream:
-                aggregated_response += text
-                g.send(text)
-            final_message = stream.get_final_message()
+        )
+        async for event in stream:
+            if event.type == "message_start":
+                input_tokens, cached_tokens = get_anthropic_input_tokens(event.message.usage)
+            elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                aggregated_response += event.delta.text
+                yield event.delta.text
+            elif event.type == "message_delta":
+                output_tokens = event.usage.output_tokens
 
         # Calculate cost of chat
-        input_tokens = final_message.usage.input_tokens
-        output_tokens = final_message.usage.output_tokens
-        tracer["usage"] = get_chat_usage_metrics(model_name, input_tokens, output_tokens, tracer.get("usage"))
+        update_chat_usage_metrics(tracer, model_name, input_tokens, output_tokens, cached_tokens=cached_tokens)
 
         # Save conversation trace
         tracer["chat_model"] = model_name
@@ -164,9 +168,7 @@ def anthropic_llm_thread(
         if is_promptrace_enabled():
             commit_conversation_trace(messages, aggregated_response, tracer)
     except Exception as e:
-        logger.error(f"Error in anthropic_llm_thread: {e}", exc_info=True)
-    finally:
-        g.close()
+        logger.error(f"Error in anthropic_llm_stream: {e}", exc_info=True)
 
 
 def format_messages_for_anthropic(messages: list[ChatMessage], system_prompt=None):
@@ -214,4 +216,25 @@ def format_messages_for_anthropic(messages: list[ChatMessage], system_prompt=Non
                     )
             message.content = content
 
+    # Cache prompt prefix up to the system prompt, the end of the chat history and the latest message.
+    # Anthropic only caches prompt prefixes that end at explicit cache breakpoints
+    for message in messages:
+        if message.additional_kwargs.get("cache_breakpoint") or message is messages[-1]:
+            if isinstance(message.content, str):
+                message.content = [{"type": "text", "text": message.content}]
+            if len(message.content) > 0:
+                message.content[-1]["cache_control"] = {"type": "ephemeral"}
+    if system_prompt:
+        system_prompt = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+
     return messages, system_prompt
+
+
+def get_anthropic_input_tokens(usage) -> tuple[int, int]:
+    """
+    Get total input tokens and input tokens read from the prompt cache.
+    Anthropic reports input tokens written to and read from the prompt cache separately from other input tokens
+    """
+    cache_write_tokens = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    cache_read_tokens = getattr(usage, "cache_read_input_tokens", 0) or 0
+    return usage.input_tokens + cache_write_tokens + cache_read_tokens, cache_read_tokens
@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime, timedelta
+from functools import partial
 from typing import Dict, List, Optional
 
 import pyjson5
@@ -16,6 +17,7 @@ from khoj.processor.conversation.utils import (
     clean_json,
     construct_structured_message,
     generate_chatml_messages_with_context,
+    get_chat_actor_response,
     messages_to_print,
 )
 from khoj.utils.helpers import (
@@ -42,6 +44,7 @@ def extract_questions_gemini(
     vision_enabled: bool = False,
     personality_context: Optional[str] = None,
     query_files: str = None,
+    cache_ttl: timedelta = None,
     tracer: dict = {},
 ):
     """
@@ -96,8 +99,22 @@ def extract_questions_gemini(
     messages.append(ChatMessage(content=prompt, role="user"))
     messages.append(ChatMessage(content=system_prompt, role="system"))
 
-    response = gemini_send_message_to_model(
-        messages, api_key, model, response_type="json_object", temperature=temperature, tracer=tracer
+    response = get_chat_actor_response(
+        partial(
+            gemini_send_message_to_model,
+            messages,
+            api_key,
+            model,
+            response_type="json_object",
+            temperature=temperature,
+            tracer=tracer,
+        ),
+        messages,
+        ChatModel.ModelType.GOOGLE,
+        model,
+        response_type="json_object",
+        cache_ttl=cache_ttl,
+        tracer=tracer,
     )
 
     # Extract, Clean Message from Gemini's Response
@@ -242,8 +259,6 @@ def converse_gemini(
     # Get Response from Google AI
     return gemini_chat_completion_with_backoff(
         messages=messages,
-        compiled_references=references,
-        online_results=online_results,
         model_name=model,
         temperature=temperature,
         api_key=api_key,
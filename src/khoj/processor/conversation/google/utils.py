@@ -1,6 +1,6 @@
 import logging
 import random
-from threading import Thread
+from typing import AsyncGenerator
 
 import google.generativeai as genai
 from google.generativeai.types.answer_types import FinishReason
@@ -20,15 +20,15 @@ from tenacity import (
 )
 
 from khoj.processor.conversation.utils import (
-    ThreadedGenerator,
+    astream_with_completion,
     commit_conversation_trace,
     get_image_from_url,
 )
 from khoj.utils import state
 from khoj.utils.helpers import (
-    get_chat_usage_metrics,
     is_none_or_empty,
     is_promptrace_enabled,
+    update_chat_usage_metrics,
 )
 
 logger = logging.getLogger(__name__)
@@ -83,7 +83,8 @@ def gemini_completion_with_backoff(
     # Aggregate cost of chat
     input_tokens = response.usage_metadata.prompt_token_count if response else 0
     output_tokens = response.usage_metadata.candidates_token_count if response else 0
-    tracer["usage"] = get_chat_usage_metrics(model_name, input_tokens, output_tokens, tracer.get("usage"))
+    cached_tokens = response.usage_metadata.cached_content_token_count if response else 0
+    update_chat_usage_metrics(tracer, model_name, input_tokens, output_tokens, cached_tokens=cached_tokens)
 
     # Save conversation trace
     tracer["chat_model"] = model_name
@@ -94,16 +95,8 @@ def gemini_completion_with_backoff(
     return response_text
 
 
-@retry(
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    stop=stop_after_attempt(2),
-    before_sleep=before_sleep_log(logger, logging.DEBUG),
-    reraise=True,
-)
 def gemini_chat_completion_with_backoff(
     messages,
-    compiled_references,
-    online_results,
     model_name,
     temperature,
     api_key,
@@ -111,19 +104,26 @@ def gemini_chat_completion_with_backoff(
     completion_func=None,
     model_kwargs=None,
     tracer: dict = {},
-):
-    g = ThreadedGenerator(compiled_references, online_results, completion_func=completion_func)
-    t = Thread(
-        target=gemini_llm_thread,
-        args=(g, messages, system_prompt, model_name, temperature, api_key, model_kwargs, tracer),
-    )
-    t.start()
-    return g
+) -> AsyncGenerator[str, None]:
+    "Stream chat response from the async Gemini client. The completion func is called with the full response"
+    response_stream = gemini_llm_stream(messages, system_prompt, model_name, temperature, api_key, model_kwargs, tracer)
+    return astream_with_completion(response_stream, completion_func=completion_func)
+
+
+@retry(
+    wait=wait_exponential(multiplier=1, min=4, max=10),
+    stop=stop_after_attempt(2),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=True,
+)
+async def gemini_asend_message_stream(chat_session: genai.ChatSession, content):
+    "Start response stream. Retried until the response starts streaming, so no partial response is repeated"
+    return await chat_session.send_message_async(content, stream=True)
 
 
-def gemini_llm_thread(
-    g, messages, system_prompt, model_name, temperature, api_key, model_kwargs=None, tracer: dict = {}
-):
+async def gemini_llm_stream(
+    messages, system_prompt, model_name, temperature, api_key, model_kwargs=None, tracer: dict = {}
+) -> AsyncGenerator[str, None]:
     try:
         genai.configure(api_key=api_key)
         model_kwargs = model_kwargs or dict()
@@ -148,18 +148,20 @@ def gemini_llm_thread(
         # all messages up to the last are considered to be part of the chat history
         chat_session = model.start_chat(history=formatted_messages[0:-1])
         # the last message is considered to be the current prompt
-        for chunk in chat_session.send_message(formatted_messages[-1]["parts"], stream=True):
+        response = await gemini_asend_message_stream(chat_session, formatted_messages[-1]["parts"])
+        async for chunk in response:
             message, stopped = handle_gemini_response(chunk.candidates, chunk.prompt_feedback)
             message = message or chunk.text
             aggregated_response += message
-            g.send(message)
+            yield message
             if stopped:
                 raise StopCandidateException(message)
 
         # Calculate cost of chat
         input_tokens = chunk.usage_metadata.prompt_token_count
         output_tokens = chunk.usage_metadata.candidates_token_count
-        tracer["usage"] = get_chat_usage_metrics(model_name, input_tokens, output_tokens, tracer.get("usage"))
+        cached_tokens = chunk.usage_metadata.cached_content_token_count
+        update_chat_usage_metrics(tracer, model_name, input_tokens, output_tokens, cached_tokens=cached_tokens)
 
         # Save conversation trace
         tracer["chat_model"] = model_name
@@ -172,9 +174,7 @@ def gemini_llm_thread(
             + f"Last Message by {messages[-1].role}: {messages[-1].content}"
         )
     except Exception as e:
-        logger.error(f"Error in gemini_llm_thread: {e}", exc_info=True)
-    finally:
-        g.close()
+        logger.error(f"Error in gemini_llm_stream: {e}", exc_info=True)
 
 
 def handle_gemini_response(candidates, prompt_feedback=None):
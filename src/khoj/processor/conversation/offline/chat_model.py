@@ -2,6 +2,7 @@ import json
 import logging
 import os
 from datetime import datetime, timedelta
+from functools import partial
 from threading import Thread
 from typing import Any, Dict, Iterator, List, Optional, Union
 
@@ -11,15 +12,24 @@ from llama_cpp import Llama
 
 from khoj.database.models import Agent, ChatModel, KhojUser
 from khoj.processor.conversation import prompts
+from khoj.processor.conversation.offline.prompt_cache import (
+    stream_chat_completion_with_prompt_cache,
+)
+from khoj.processor.conversation.offline.scheduler import (
+    OfflineChatOverloadedError,
+    OfflineChatScheduler,
+    Priority,
+    get_scheduler,
+)
 from khoj.processor.conversation.offline.utils import download_model
 from khoj.processor.conversation.utils import (
     ThreadedGenerator,
     clean_json,
     commit_conversation_trace,
     generate_chatml_messages_with_context,
+    get_chat_actor_response,
     messages_to_print,
 )
-from khoj.utils import state
 from khoj.utils.constants import empty_escape_sequences
 from khoj.utils.helpers import (
     ConversationCommand,
@@ -46,6 +56,7 @@ def extract_questions_offline(
     temperature: float = 0.7,
     personality_context: Optional[str] = None,
     query_files: str = None,
+    cache_ttl: timedelta = None,
     tracer: dict = {},
 ) -> List[str]:
     """
@@ -99,9 +110,9 @@ def extract_questions_offline(
         query_files=query_files,
     )
 
-    state.chat_lock.acquire()
-    try:
-        response = send_message_to_model_offline(
+    response = get_chat_actor_response(
+        partial(
+            send_message_to_model_offline,
             messages,
             loaded_model=offline_chat_model,
             model_name=model,
@@ -109,9 +120,14 @@ def extract_questions_offline(
             temperature=temperature,
             response_type="json_object",
             tracer=tracer,
-        )
-    finally:
-        state.chat_lock.release()
+        ),
+        messages,
+        ChatModel.ModelType.OFFLINE,
+        model,
+        response_type="json_object",
+        cache_ttl=cache_ttl,
+        tracer=tracer,
+    )
 
     # Extract and clean the chat model's response
     try:
@@ -250,10 +266,14 @@ def llm_thread(g, messages: List[ChatMessage], model: Any, max_prompt_size: int
     stop_phrases = ["<s>", "INST]", "Notes:"]
     aggregated_response = ""
 
-    state.chat_lock.acquire()
     try:
         response_iterator = send_message_to_model_offline(
-            messages, loaded_model=model, stop=stop_phrases, max_prompt_size=max_prompt_size, streaming=True
+            messages,
+            loaded_model=model,
+            stop=stop_phrases,
+            max_prompt_size=max_prompt_size,
+            streaming=True,
+            tracer=tracer,
         )
         for response in response_iterator:
             response_delta = response["choices"][0]["delta"].get("content", "")
@@ -263,9 +283,9 @@ def llm_thread(g, messages: List[ChatMessage], model: Any, max_prompt_size: int
         # Save conversation trace
         if is_promptrace_enabled():
             commit_conversation_trace(messages, aggregated_response, tracer)
-
+    except OfflineChatOverloadedError as e:
+        g.fail(e)
     finally:
-        state.chat_lock.release()
         g.close()
 
 
@@ -278,25 +298,24 @@ def send_message_to_model_offline(
     stop=[],
     max_prompt_size: int = None,
     response_type: str = "text",
+    priority: Priority = None,
     tracer: dict = {},
 ):
     assert loaded_model is None or isinstance(loaded_model, Llama), "loaded_model must be of type Llama, if configured"
     offline_chat_model = loaded_model or download_model(model_name, max_tokens=max_prompt_size)
     messages_dict = [{"role": message.role, "content": message.content} for message in messages]
     seed = int(os.getenv("KHOJ_LLM_SEED")) if os.getenv("KHOJ_LLM_SEED") else None
-    response = offline_chat_model.create_chat_completion(
-        messages_dict,
-        stop=stop,
-        stream=streaming,
-        temperature=temperature,
-        response_format={"type": response_type},
-        seed=seed,
-    )
+    model_kwargs = dict(stop=stop, temperature=temperature, response_format={"type": response_type}, seed=seed)
 
+    # Run on a model instance from the pool of the loaded offline chat model
+    scheduler = get_scheduler(offline_chat_model)
     if streaming:
-        return response
+        return stream_chat_completion(scheduler, messages_dict, priority or Priority.CHAT, tracer, **model_kwargs)
 
-    response_text = response["choices"][0]["message"].get("content", "")
+    # Stream response internally to measure prompt eval time
+    priority = priority or Priority.ACTOR
+    response_stream = stream_chat_completion(scheduler, messages_dict, priority, tracer, **model_kwargs)
+    response_text = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in response_stream)
 
     # Save conversation trace for non-streaming responses
     # Streamed responses need to be saved by the calling function
@@ -306,3 +325,12 @@ def send_message_to_model_offline(
         commit_conversation_trace(messages, response_text, tracer)
 
     return response_text
+
+
+def stream_chat_completion(
+    scheduler: OfflineChatScheduler, messages_dict: List[dict], priority: Priority, tracer: dict = {}, **kwargs
+):
+    "Stream chat response. Hold the model instance until the response stream is consumed or closed"
+    with scheduler.acquire(priority) as model_instance:
+        # Reuse evaluated prompt prefixes of earlier conversation turns cached by any instance of the model
+        yield from stream_chat_completion_with_prompt_cache(model_instance, messages_dict, tracer, **kwargs)
@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from llama_cpp import Llama, LlamaRAMCache
+
+logger = logging.getLogger(__name__)
+
+
+class PromptStateCache(LlamaRAMCache):
+    """
+    Cache evaluated prompt states of an offline chat model in RAM, shared by its model instances.
+
+    A new prompt resumes from the cached state with the longest matching prompt prefix,
+    so the shared start of a continuing conversation isn't evaluated again each turn.
+    The least recently used prompt states are evicted once the cache exceeds its capacity.
+
+    A lookup is only counted as a hit if the model loads the cached state. Like llama-cpp-python 0.2.88, pinned in
+    pyproject.toml, that needs the cached prefix to be longer than the prefix already evaluated by the model instance.
+    Short prefix matches, like a shared begin of text token, aren't counted as hits either.
+    """
+
+    def __init__(self, capacity_bytes: int, min_prefix_tokens: int = 16):
+        super().__init__(capacity_bytes=capacity_bytes)
+        self.min_prefix_tokens = min_prefix_tokens
+        self.lock = threading.RLock()
+        # Model instance used and prompt cache lookup made by the current thread
+        self.local = threading.local()
+        self.lookups = 0
+        self.hits = 0
+
+    def __getitem__(self, key: Sequence[int]):
+        with self.lock:
+            model: Optional[Llama] = getattr(self.local, "model", None)
+            # The model instance reuses the prefix shared with its last evaluated prompt without a cache load
+            evaluated_prefix = Llama.longest_token_prefix(model.input_ids.tolist(), key) if model else 0
+            cached_prefix = 0
+            try:
+                state = super().__getitem__(key)
+                cached_prefix = Llama.longest_token_prefix(state.input_ids.tolist(), key)
+                return state
+            finally:
+                reused_tokens = max(evaluated_prefix, cached_prefix)
+                is_hit = cached_prefix > evaluated_prefix and cached_prefix >= self.min_prefix_tokens
+                self.lookups += 1
+                self.hits += 1 if is_hit else 0
+                self.local.lookup = {"prompt_tokens": len(key), "reused_tokens": reused_tokens}
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        with self.lock:
+            return super().__contains__(key)
+
+    def __setitem__(self, key: Sequence[int], value):
+        with self.lock:
+            super().__setitem__(key, value)
+
+    def hit_rate(self) -> float:
+        with self.lock:
+            return self.hits / self.lookups if self.lookups else 0.0
+
+
+prompt_caches: Dict[Tuple[str, int], PromptStateCache] = {}
+prompt_caches_lock = threading.Lock()
+
+
+def get_prompt_cache(model: Llama) -> Optional[PromptStateCache]:
+    """
+    Get prompt state cache shared by instances of the same offline chat model and attach it to the model instance.
+    Set KHOJ_OFFLINE_CHAT_PROMPT_CACHE_GB to the cache capacity. Set it to 0 to disable the prompt cache
+    """
+    capacity_bytes = int(float(os.getenv("KHOJ_OFFLINE_CHAT_PROMPT_CACHE_GB", 2)) * 1e9)
+    if capacity_bytes <= 0:
+        return None
+
+    # Prompt states can only be loaded into instances of the same model with the same context size
+    cache_key = (model.model_path, model.n_ctx())
+    with prompt_caches_lock:
+        if cache_key not in prompt_caches:
+            prompt_caches[cache_key] = PromptStateCache(capacity_bytes)
+        prompt_cache = prompt_caches[cache_key]
+    if model.cache is not prompt_cache:
+        model.set_cache(prompt_cache)
+    return prompt_cache
+
+
+def stream_chat_completion_with_prompt_cache(
+    model: Llama, messages: List[dict], tracer: dict = {}, **kwargs
+) -> Iterator[dict]:
+    "Stream chat response of the model instance. Report prompt eval time and prompt cache reuse to the tracer"
+    prompt_cache = get_prompt_cache(model)
+    if prompt_cache:
+        prompt_cache.local.model = model
+        prompt_cache.local.lookup = None
+
+    start_time = perf_counter()
+    prompt_eval_seconds = None
+    try:
+        for chunk in model.create_chat_completion(messages, stream=True, **kwargs):
+            # The first chunk is streamed once the prompt is evaluated
+            if prompt_eval_seconds is None:
+                prompt_eval_seconds = perf_counter() - start_time
+            yield chunk
+    finally:
+        lookup = (prompt_cache.local.lookup if prompt_cache else None) or {}
+        tracer["prompt_cache"] = {
+            "prompt_eval_seconds": round(prompt_eval_seconds or perf_counter() - start_time, 3),
+            "prompt_tokens": lookup.get("prompt_tokens", 0),
+            "reused_tokens": lookup.get("reused_tokens", 0),
+            "hit_rate": round(prompt_cache.hit_rate(), 3) if prompt_cache else 0.0,
+        }
+        if prompt_cache:
+            prompt_cache.local.model = None
+        logger.debug(f"Offline chat model prompt cache stats: {tracer['prompt_cache']}")
@@ -0,0 +1,154 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from enum import IntEnum
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from khoj.utils.helpers import get_device_memory
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    "Priority of requests to the offline chat model. Lower values are served first"
+
+    ACTOR = 0  # Short chat actor calls, like extracting search queries
+    CHAT = 1  # Long streamed chat responses
+
+
+class OfflineChatOverloadedError(Exception):
+    "Raised when a request to the offline chat model is not admitted, as too many requests are waiting"
+
+
+class OfflineChatScheduler:
+    """
+    Schedule requests to the offline chat model across a pool of loaded model instances.
+
+    Waiting requests are served by priority, and first come first served within a priority.
+    So short chat actor calls jump ahead of long streamed chat responses waiting for a model instance.
+    Requests are rejected quickly when the wait queue is full or a model instance isn't free in time.
+    """
+
+    def __init__(
+        self,
+        loaded_model: Any,
+        load_model: Optional[Callable[[], Any]] = None,
+        pool_size: int = None,
+        ram_budget: float = None,
+        max_queue_size: int = None,
+        max_wait_seconds: float = None,
+    ):
+        pool_size = pool_size or int(os.getenv("KHOJ_OFFLINE_CHAT_POOL_SIZE", 1))
+        ram_budget_gb = os.getenv("KHOJ_OFFLINE_CHAT_RAM_BUDGET_GB")
+        ram_budget = ram_budget or (float(ram_budget_gb) * 1e9 if ram_budget_gb else get_device_memory() / 2)
+        self.max_queue_size = max_queue_size or int(os.getenv("KHOJ_OFFLINE_CHAT_MAX_QUEUE_SIZE", 16))
+        self.max_wait_seconds = max_wait_seconds or float(os.getenv("KHOJ_OFFLINE_CHAT_MAX_WAIT_SECONDS", 120))
+
+        # Load as many model instances as configured and fit within the RAM budget
+        instance_size = self.estimate_model_size(loaded_model)
+        max_instances_in_budget = int(ram_budget // instance_size) if instance_size else pool_size
+        pool_size = max(1, min(pool_size, max_instances_in_budget))
+        self.models: List[Any] = [loaded_model]
+        while load_model and len(self.models) < pool_size:
+            self.models.append(load_model())
+        self.idle_models: List[Any] = list(self.models)
+
+        self.waiting: List[Tuple[int, int]] = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+
+        # Metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+
+    @staticmethod
+    def estimate_model_size(model: Any) -> float:
+        "Estimate memory used by a loaded model instance, from the size of its model file"
+        model_path = getattr(model, "model_path", None)
+        if not model_path or not os.path.exists(model_path):
+            return 0
+        # Leave headroom for the KV cache and compute buffers of the model instance
+        return os.path.getsize(model_path) * 1.25
+
+    def is_overloaded(self) -> bool:
+        "Check if new requests would be rejected, as the wait queue is full"
+        with self.condition:
+            return len(self.waiting) >= self.max_queue_size
+
+    def metrics(self) -> Dict[str, Any]:
+        "Get queue depth and utilization metrics of the offline chat model pool"
+        with self.condition:
+            return {
+                "pool_size": len(self.models),
+                "busy_instances": len(self.models) - len(self.idle_models),
+                "queue_depth": len(self.waiting),
+                "queue_depth_by_priority": {
+                    priority.name.lower(): sum(1 for ticket in self.waiting if ticket[0] == priority)
+                    for priority in Priority
+                },
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "average_wait_seconds": self.total_wait_seconds / self.admitted if self.admitted else 0.0,
+            }
+
+    def checkout(self, priority: Priority = Priority.CHAT) -> Any:
+        "Wait for an idle model instance. Raise OfflineChatOverloadedError if the request isn't admitted"
+        with self.condition:
+            if len(self.waiting) >= self.max_queue_size:
+                self.rejected += 1
+                logger.warning(f"Rejected offline chat request. Queue is full: {len(self.waiting)} requests waiting")
+                raise OfflineChatOverloadedError("Too many requests to the offline chat model. Try again later.")
+
+            ticket = (int(priority), next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            if not self.idle_models:
+                logger.debug(f"Offline chat request queued behind {len(self.waiting) - 1} requests")
+
+            start_time = perf_counter()
+            is_served = self.condition.wait_for(
+                lambda: len(self.idle_models) > 0 and self.waiting[0] == ticket, timeout=self.max_wait_seconds
+            )
+            self.waiting.remove(ticket)
+            heapq.heapify(self.waiting)
+            # Let the next waiting request check if it can be served
+            self.condition.notify_all()
+            if not is_served:
+                self.rejected += 1
+                logger.warning(f"Rejected offline chat request. No model free in {self.max_wait_seconds} seconds")
+                raise OfflineChatOverloadedError("Offline chat model is busy. Try again later.")
+
+            self.admitted += 1
+            self.total_wait_seconds += perf_counter() - start_time
+            return self.idle_models.pop()
+
+    def checkin(self, model: Any):
+        "Return the model instance to the pool of idle instances"
+        with self.condition:
+            self.idle_models.append(model)
+            self.condition.notify_all()
+
+    @contextmanager
+    def acquire(self, priority: Priority = Priority.CHAT) -> Iterator[Any]:
+        "Use an idle model instance for the duration of the context"
+        model = self.checkout(priority)
+        try:
+            yield model
+        finally:
+            self.checkin(model)
+
+
+schedulers: Dict[int, OfflineChatScheduler] = {}
+schedulers_lock = threading.Lock()
+
+
+def get_scheduler(loaded_model: Any, load_model: Optional[Callable[[], Any]] = None) -> OfflineChatScheduler:
+    "Get scheduler of the loaded offline chat model. Create it on first use"
+    with schedulers_lock:
+        if id(loaded_model) not in schedulers:
+            schedulers[id(loaded_model)] = OfflineChatScheduler(loaded_model, load_model=load_model)
+        return schedulers[id(loaded_model)]
@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime, timedelta
+from functools import partial
 from typing import Dict, List, Optional
 
 import pyjson5
@@ -15,6 +16,7 @@ from khoj.processor.conversation.utils import (
     clean_json,
     construct_structured_message,
     generate_chatml_messages_with_context,
+    get_chat_actor_response,
     messages_to_print,
 )
 from khoj.utils.helpers import (
@@ -40,6 +42,7 @@ def extract_questions(
     vision_enabled: bool = False,
     personality_context: Optional[str] = None,
     query_files: str = None,
+    cache_ttl: timedelta = None,
     tracer: dict = {},
 ):
     """
@@ -91,13 +94,23 @@ def extract_questions(
     messages = []
     messages.append(ChatMessage(content=prompt, role="user"))
 
-    response = send_message_to_model(
+    response = get_chat_actor_response(
+        partial(
+            send_message_to_model,
+            messages,
+            api_key,
+            model,
+            response_type="json_object",
+            api_base_url=api_base_url,
+            temperature=temperature,
+            tracer=tracer,
+        ),
         messages,
-        api_key,
+        ChatModel.ModelType.OPENAI,
         model,
-        response_type="json_object",
         api_base_url=api_base_url,
-        temperature=temperature,
+        response_type="json_object",
+        cache_ttl=cache_ttl,
         tracer=tracer,
     )
 
@@ -231,8 +244,6 @@ def converse_openai(
     # Get Response from GPT
     return chat_completion_with_backoff(
         messages=messages,
-        compiled_references=references,
-        online_results=online_results,
         model_name=model,
         temperature=temperature,
         openai_api_key=api_key,
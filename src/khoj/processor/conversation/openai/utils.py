@@ -1,7 +1,6 @@
 import logging
 import os
-from threading import Thread
-from typing import Dict, List
+from typing import AsyncGenerator, Dict, List
 
 import openai
 from openai.types.chat.chat_completion import ChatCompletion
@@ -16,18 +15,20 @@ from tenacity import (
 )
 
 from khoj.processor.conversation.utils import (
-    ThreadedGenerator,
+    astream_with_completion,
     commit_conversation_trace,
 )
 from khoj.utils.helpers import (
-    get_chat_usage_metrics,
+    get_openai_async_client,
     get_openai_client,
     is_promptrace_enabled,
+    update_chat_usage_metrics,
 )
 
 logger = logging.getLogger(__name__)
 
 openai_clients: Dict[str, openai.OpenAI] = {}
+async_openai_clients: Dict[str, openai.AsyncOpenAI] = {}
 
 
 @retry(
@@ -106,8 +107,9 @@ def completion_with_backoff(
     cost = (
         chunk.usage.model_extra.get("estimated_cost", 0) if hasattr(chunk, "usage") and chunk.usage else 0
     )  # Estimated costs returned by DeepInfra API
+    cached_tokens = get_openai_cached_tokens(chunk)
 
-    tracer["usage"] = get_chat_usage_metrics(model_name, input_tokens, output_tokens, tracer.get("usage"), cost)
+    update_chat_usage_metrics(tracer, model_name, input_tokens, output_tokens, cost, cached_tokens=cached_tokens)
 
     # Save conversation trace
     tracer["chat_model"] = model_name
@@ -118,6 +120,21 @@ def completion_with_backoff(
     return aggregated_response
 
 
+def chat_completion_with_backoff(
+    messages,
+    model_name,
+    temperature,
+    openai_api_key=None,
+    api_base_url=None,
+    completion_func=None,
+    model_kwargs=None,
+    tracer: dict = {},
+) -> AsyncGenerator[str, None]:
+    "Stream chat response from the async OpenAI client. The completion func is called with the full response"
+    response_stream = llm_stream(messages, model_name, temperature, openai_api_key, api_base_url, model_kwargs, tracer)
+    return astream_with_completion(response_stream, completion_func=completion_func)
+
+
 @retry(
     retry=(
         retry_if_exception_type(openai._exceptions.APITimeoutError)
@@ -131,46 +148,32 @@ def completion_with_backoff(
     before_sleep=before_sleep_log(logger, logging.DEBUG),
     reraise=True,
 )
-def chat_completion_with_backoff(
-    messages,
-    compiled_references,
-    online_results,
-    model_name,
-    temperature,
-    openai_api_key=None,
-    api_base_url=None,
-    completion_func=None,
-    model_kwargs=None,
-    tracer: dict = {},
-):
-    g = ThreadedGenerator(compiled_references, online_results, completion_func=completion_func)
-    t = Thread(
-        target=llm_thread,
-        args=(g, messages, model_name, temperature, openai_api_key, api_base_url, model_kwargs, tracer),
-    )
-    t.start()
-    return g
+async def acreate_chat_completion(
+    client: openai.AsyncOpenAI, **kwargs
+) -> ChatCompletion | openai.AsyncStream[ChatCompletionChunk]:
+    "Start chat completion. Retried until the response starts streaming, so no partial response is repeated"
+    return await client.chat.completions.create(**kwargs)
 
 
-def llm_thread(
-    g,
+async def llm_stream(
     messages,
     model_name: str,
     temperature,
     openai_api_key=None,
     api_base_url=None,
-    model_kwargs: dict = {},
+    model_kwargs: dict = None,
     tracer: dict = {},
-):
+) -> AsyncGenerator[str, None]:
     try:
         client_key = f"{openai_api_key}--{api_base_url}"
-        if client_key in openai_clients:
-            client = openai_clients[client_key]
+        if client_key in async_openai_clients:
+            client = async_openai_clients[client_key]
         else:
-            client = get_openai_client(openai_api_key, api_base_url)
-            openai_clients[client_key] = client
+            client = get_openai_async_client(openai_api_key, api_base_url)
+            async_openai_clients[client_key] = client
 
         formatted_messages = [{"role": message.role, "content": message.content} for message in messages]
+        model_kwargs = model_kwargs or dict()
 
         # Update request parameters for compatability with o1 model series
         # Refer: https://platform.openai.com/docs/guides/reasoning/beta-limitations
@@ -213,7 +216,8 @@ def llm_thread(
         if os.getenv("KHOJ_LLM_SEED"):
             model_kwargs["seed"] = int(os.getenv("KHOJ_LLM_SEED"))
 
-        chat: ChatCompletion | openai.Stream[ChatCompletionChunk] = client.chat.completions.create(
+        chat: ChatCompletion | openai.AsyncStream[ChatCompletionChunk] = await acreate_chat_completion(
+            client,
             messages=formatted_messages,
             model=model_name,  # type: ignore
             stream=stream,
@@ -226,9 +230,9 @@ def llm_thread(
         if not stream:
             chunk = chat
             aggregated_response = chunk.choices[0].message.content
-            g.send(aggregated_response)
+            yield aggregated_response
         else:
-            for chunk in chat:
+            async for chunk in chat:
                 if len(chunk.choices) == 0:
                     continue
                 delta_chunk = chunk.choices[0].delta
@@ -239,7 +243,7 @@ def llm_thread(
                     text_chunk = delta_chunk.content
                 if text_chunk:
                     aggregated_response += text_chunk
-                    g.send(text_chunk)
+                    yield text_chunk
 
         # Calculate cost of chat
         input_tokens = chunk.usage.prompt_tokens if hasattr(chunk, "usage") and chunk.usage else 0
@@ -247,7 +251,8 @@ def llm_thread(
         cost = (
             chunk.usage.model_extra.get("estimated_cost", 0) if hasattr(chunk, "usage") and chunk.usage else 0
         )  # Estimated costs returned by DeepInfra API
-        tracer["usage"] = get_chat_usage_metrics(model_name, input_tokens, output_tokens, tracer.get("usage"), cost)
+        cached_tokens = get_openai_cached_tokens(chunk)
+        update_chat_usage_metrics(tracer, model_name, input_tokens, output_tokens, cost, cached_tokens=cached_tokens)
 
         # Save conversation trace
         tracer["chat_model"] = model_name
@@ -255,6 +260,11 @@ def llm_thread(
         if is_promptrace_enabled():
             commit_conversation_trace(messages, aggregated_response, tracer)
     except Exception as e:
-        logger.error(f"Error in llm_thread: {e}", exc_info=True)
-    finally:
-        g.close()
+        logger.error(f"Error in llm_stream: {e}", exc_info=True)
+
+
+def get_openai_cached_tokens(chunk) -> int:
+    "Get prompt tokens read from the automatic prompt cache of OpenAI compatible APIs, if reported"
+    usage = getattr(chunk, "usage", None)
+    prompt_tokens_details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    return getattr(prompt_tokens_details, "cached_tokens", 0) or 0
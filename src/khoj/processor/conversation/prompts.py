@@ -1130,6 +1130,48 @@ Assistant:
 """.strip()
 )
 
+conversation_compaction = PromptTemplate.from_template(
+    """
+You are an extremely smart and helpful conversation summarizer. Update the summary of an ongoing conversation between a user and an AI assistant with the new chat messages below.
+- Keep the user's goals, preferences, decisions, open questions and any facts the AI may need to continue the conversation.
+- Drop greetings, pleasantries and details superseded by later messages.
+- Update the references digest with the key facts from the notes and online results referenced in the new chat messages, with their sources.
+- Keep the summary under 400 words and the references digest under 300 words.
+
+Respond with a JSON object with the updated summary and references digest in the following format:
+{{"summary": "<updated summary>", "references": "<updated references digest>"}}
+
+Current Summary:
+{summary}
+
+Current References Digest:
+{references}
+
+New Chat Messages:
+{chat_history}
+""".strip()
+)
+
+conversation_summary_context = PromptTemplate.from_template(
+    """
+Here is a summary of our earlier conversation and the references used in it.
+
+Summary:
+{summary}
+
+References:
+{references}
+""".strip()
+)
+
+recalled_conversation = PromptTemplate.from_template(
+    """
+Here are earlier parts of our conversation that may be relevant to my next message.
+
+{chat_history}
+""".strip()
+)
+
 additional_program_context = PromptTemplate.from_template(
     """
 Here are some additional results from the query execution:
@@ -0,0 +1,97 @@
+import logging
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import tiktoken
+from transformers import AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+
+class ApproximateTokenizer:
+    """
+    Fast approximate tokenizer for when no real tokenizer, not even the default tiktoken encoder, can be loaded.
+    Splits text into runs of whitespace, punctuation marks and word pieces of up to 4 characters.
+    Decoding joins the pieces back, so encoded text can be truncated and decoded like with real tokenizers.
+    """
+
+    pattern = re.compile(r"\s+|\w{1,4}|[^\w\s]")
+
+    def encode(self, text: str) -> List[str]:
+        return self.pattern.findall(text)
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+class TokenizerRegistry:
+    """
+    Resolve the tokenizer of each chat model once, lazily, and share it across threads.
+    OpenAI models use tiktoken, models with a configured tokenizer use their pretrained tokenizer.
+    All other models, or models whose tokenizer fails to load, use the default tiktoken encoder.
+    The approximate tokenizer is only used if the default tiktoken encoder fails to load too.
+    """
+
+    default_key = "tiktoken:gpt-4o"
+
+    def __init__(self):
+        self.tokenizers: Dict[str, Any] = {"approximate": ApproximateTokenizer()}
+        self.lock = threading.Lock()
+        self.loading_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def get_key(model_name: str, tokenizer_name: Optional[str] = None) -> str:
+        "Get key of the tokenizer to use for the chat model"
+        if model_name.startswith("gpt-"):
+            return f"tiktoken:{model_name}"
+        elif model_name.startswith("o1") or model_name.startswith("o3"):
+            # as tiktoken doesn't recognize o-series models yet
+            return TokenizerRegistry.default_key
+        elif tokenizer_name:
+            return f"pretrained:{tokenizer_name}"
+        return TokenizerRegistry.default_key
+
+    def get(self, model_name: str, tokenizer_name: Optional[str] = None):
+        "Get tokenizer of the chat model. Loads it on first use"
+        return self.get_by_key(self.get_key(model_name, tokenizer_name))
+
+    def get_default(self):
+        "Get default tokenizer, used for chat models without a tokenizer. Loads it on first use"
+        return self.get_by_key(self.default_key)
+
+    def get_by_key(self, key: str):
+        "Get tokenizer with the given key. Loads it on first use"
+        tokenizer = self.tokenizers.get(key)
+        if tokenizer is not None:
+            return tokenizer
+
+        # Load each tokenizer only once, without blocking lookups of other tokenizers
+        with self.lock:
+            loading_lock = self.loading_locks.setdefault(key, threading.Lock())
+        with loading_lock:
+            if key not in self.tokenizers:
+                self.tokenizers[key] = self.load(key)
+        return self.tokenizers[key]
+
+    def load(self, key: str):
+        tokenizer_type, _, name = key.partition(":")
+        try:
+            if tokenizer_type == "tiktoken":
+                return tiktoken.encoding_for_model(name)
+            elif tokenizer_type == "pretrained":
+                return AutoTokenizer.from_pretrained(name)
+        except Exception as e:
+            if key == self.default_key:
+                logger.warning(f"Fallback to approximate tokenizer. Failed to load default tokenizer {name}: {e}")
+                return self.tokenizers["approximate"]
+            logger.warning(f"Fallback to default tokenizer. Failed to load tokenizer {name}: {e}")
+        return self.get_default()
+
+    def preload(self, chat_models: Iterable[Tuple[str, Optional[str]]]):
+        "Load tokenizers of the given (chat model name, tokenizer name) pairs ahead of use"
+        for model_name, tokenizer_name in chat_models:
+            self.get(model_name, tokenizer_name)
+
+
+tokenizers = TokenizerRegistry()
@@ -1,4 +1,6 @@
+import asyncio
 import base64
+import hashlib
 import json
 import logging
 import math
@@ -6,37 +8,52 @@ import mimetypes
 import os
 import queue
 import re
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 from io import BytesIO
 from time import perf_counter
-from typing import Any, Callable, Dict, List, Optional
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+)
 
 import PIL.Image
 import pyjson5
 import requests
-import tiktoken
 import yaml
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
 from langchain.schema import ChatMessage
 from llama_cpp.llama import Llama
-from transformers import AutoTokenizer
 
-from khoj.database.adapters import ConversationAdapters
+from khoj.database.adapters import ConversationAdapters, get_default_search_model
 from khoj.database.models import ChatModel, ClientApplication, KhojUser
 from khoj.processor.conversation import prompts
-from khoj.processor.conversation.offline.utils import download_model, infer_max_tokens
+from khoj.processor.conversation.offline.utils import infer_max_tokens
+from khoj.processor.conversation.tokenizers import TokenizerRegistry, tokenizers
 from khoj.search_filter.base_filter import BaseFilter
 from khoj.search_filter.date_filter import DateFilter
 from khoj.search_filter.file_filter import FileFilter
 from khoj.search_filter.word_filter import WordFilter
 from khoj.utils import state
 from khoj.utils.helpers import (
+    LRU,
     ConversationCommand,
+    is_env_var_true,
     is_none_or_empty,
     is_promptrace_enabled,
     merge_dicts,
+    update_chat_usage_metrics,
 )
 from khoj.utils.rawconfig import FileAttachment
 from khoj.utils.yaml import yaml_dump
@@ -79,6 +96,7 @@ class ThreadedGenerator:
         self.online_results = online_results
         self.completion_func = completion_func
         self.response = ""
+        self.error: Optional[Exception] = None
         self.start_time = perf_counter()
 
     def __iter__(self):
@@ -89,6 +107,9 @@ class ThreadedGenerator:
         if item is StopIteration:
             time_to_response = perf_counter() - self.start_time
             logger.info(f"Chat streaming took: {time_to_response:.3f} seconds")
+            if self.error:
+                # Raise the error to the caller instead of adding the failed response to the conversation history
+                raise self.error
             if self.completion_func:
                 # The completion func effectively acts as a callback.
                 # It adds the aggregated response to the conversation history.
@@ -107,6 +128,45 @@ class ThreadedGenerator:
     def close(self):
         self.queue.put(StopIteration)
 
+    def fail(self, error: Exception):
+        "Raise the error to the caller when the stream is closed, instead of completing the response"
+        self.error = error
+
+
+# Completions of streamed chat responses being saved
+chat_completions_in_progress: Set[asyncio.Task] = set()
+
+
+async def astream_with_completion(
+    response_stream: AsyncIterator[str], completion_func: Callable = None
+) -> AsyncGenerator[str, None]:
+    """
+    Stream chat model response chunks from an async chat model client to the caller.
+    The async counterpart of the ThreadedGenerator, without a thread and queue per response.
+    The completion func is called with the partial response if the caller stops streaming early.
+    """
+    start_time = perf_counter()
+    response = ""
+    try:
+        async for chunk in response_stream:
+            if response == "":
+                time_to_first_response = perf_counter() - start_time
+                logger.info(f"First response took: {time_to_first_response:.3f} seconds")
+            response += chunk
+            yield chunk
+
+        time_to_response = perf_counter() - start_time
+        logger.info(f"Chat streaming took: {time_to_response:.3f} seconds")
+    finally:
+        if completion_func:
+            # The completion func effectively acts as a callback.
+            # It adds the aggregated response to the conversation history.
+            # Run it as a task, shielded from cancellation, to save the response even if the client disconnects.
+            completion = asyncio.ensure_future(sync_to_async(completion_func)(chat_response=response))
+            chat_completions_in_progress.add(completion)
+            completion.add_done_callback(chat_completions_in_progress.discard)
+            await asyncio.shield(completion)
+
 
 class InformationCollectionIteration:
     def __init__(
@@ -173,6 +233,21 @@ def construct_chat_history(conversation_history: dict, n: int = 4, agent_name="A
     return chat_history
 
 
+def construct_chat_history_for_compaction(chats: List[dict], max_reference_chars: int = 500) -> str:
+    "Construct chat history of the chats to summarize, with a short excerpt of the notes and online results they used"
+    chat_history = ""
+    for chat in chats:
+        speaker = "User" if chat["by"] == "you" else "AI"
+        chat_history += f"{speaker}: {chat.get('message', '')}\n"
+        for item in chat.get("context") or []:
+            if isinstance(item, dict):
+                chat_history += f"- Note from {item.get('file')}: {item.get('compiled', '')[:max_reference_chars]}\n"
+        for subquery, results in (chat.get("onlineContext") or {}).items():
+            chat_history += f"- Online results for {subquery}: {json.dumps(results)[:max_reference_chars]}\n"
+        chat_history += "\n"
+    return chat_history
+
+
 def construct_tool_chat_history(
     previous_iterations: List[InformationCollectionIteration], tool: ConversationCommand = None
 ) -> Dict[str, list]:
@@ -249,6 +324,31 @@ def message_to_log(
     return conversation_log
 
 
+def is_conversation_recall_enabled() -> bool:
+    "Check if relevant earlier turns of long conversations should be recalled instead of only the latest turns"
+    return is_env_var_true("KHOJ_CONVERSATION_RECALL")
+
+
+# Embeds saved conversation turns in the background.
+# So the chat response completion callback and the event loop don't wait on the embeddings model
+conversation_turn_embedder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation_turn_embedder")
+
+
+def embed_conversation_turn(conversation_id: str, turn_id: str, user_message: str, chat_response: str):
+    "Embed the conversation turn with the default search model, to recall it in later turns it is relevant to"
+    try:
+        search_model = get_default_search_model()
+        if search_model.name not in state.embeddings_model:
+            return
+        turn = f"User: {user_message}\nAI: {chat_response}"
+        embeddings = state.embeddings_model[search_model.name].embed_documents([turn])[0]
+        ConversationAdapters.save_turn_embedding(conversation_id, turn_id, embeddings, search_model)
+    except Exception as e:
+        logger.warning(f"Failed to embed conversation turn. It will not be recalled: {e}")
+    finally:
+        close_old_connections()
+
+
 def save_to_conversation_log(
     q: str,
     chat_response: str,
@@ -294,20 +394,23 @@ def save_to_conversation_log(
     if generated_mermaidjs_diagram:
         khoj_message_metadata["mermaidjsDiagram"] = generated_mermaidjs_diagram
 
-    updated_conversation = message_to_log(
+    new_messages = message_to_log(
         user_message=q,
         chat_response=chat_response,
         user_message_metadata=user_message_metadata,
         khoj_message_metadata=khoj_message_metadata,
-        conversation_log=meta_log.get("chat", []),
+        conversation_log=[],
     )
-    ConversationAdapters.save_conversation(
+    meta_log.setdefault("chat", []).extend(new_messages)
+    conversation = ConversationAdapters.save_conversation(
         user,
-        {"chat": updated_conversation},
+        new_messages,
         client_application=client_application,
         conversation_id=conversation_id,
         user_message=q,
     )
+    if is_conversation_recall_enabled():
+        conversation_turn_embedder.submit(embed_conversation_turn, conversation.id, turn_id, q, chat_response)
 
     if is_promptrace_enabled():
         merge_message_into_conversation_trace(q, chat_response, tracer)
@@ -396,11 +499,28 @@ def generate_chatml_messages_with_context(
     # Scale lookback turns proportional to max prompt size supported by model
     lookback_turns = max_prompt_size // 750
 
+    # Only look back at the most recent turns when relevant earlier turns of the conversation are recalled
+    conversation_recall = conversation_log.get("recall") or {}
+    if conversation_recall:
+        lookback_turns = min(lookback_turns, conversation_recall.get("recent_turns", lookback_turns))
+
     # Extract Chat History for Context
-    chatml_messages: List[ChatMessage] = []
-    for chat in conversation_log.get("chat", []):
+    # Walk back from the latest chat until enough lookback turns are collected, instead of the whole conversation.
+    # Context, attached files and generated assets of each chat are kept with their chat in chronological order,
+    # so the system message and older chats form a byte-stable prompt prefix for chat model providers to cache
+    # Chats summarized by conversation compaction are replaced by their summary
+    chat_log = conversation_log.get("chat", [])
+    conversation_summary = conversation_log.get("summary") or {}
+    summarized_chats_count = min(conversation_summary.get("chats", 0), len(chat_log))
+    messages_by_chat: List[List[ChatMessage]] = []
+    history_turn_ids = set()
+    history_message_count = 0
+    history_stride = 2 * max(1, lookback_turns // 2)
+    for chat_index in range(len(chat_log) - 1, summarized_chats_count - 1, -1):
+        chat = chat_log[chat_index]
         message_context = ""
         message_attached_files = ""
+        chat_attachments: List[ChatMessage] = []
 
         generated_assets = {}
 
@@ -428,15 +548,11 @@ def generate_chatml_messages_with_context(
                 query_files_dict[file["name"]] = file["content"]
 
             message_attached_files = gather_raw_query_files(query_files_dict)
-            chatml_messages.append(ChatMessage(content=message_attached_files, role=role))
+            chat_attachments.append(ChatMessage(content=message_attached_files, role=role))
 
         if not is_none_or_empty(chat.get("onlineContext")):
             message_context += f"{prompts.online_search_conversation.format(online_results=chat.get('onlineContext'))}"
 
-        if not is_none_or_empty(message_context):
-            reconstructed_context_message = ChatMessage(content=message_context, role="user")
-            chatml_messages.insert(0, reconstructed_context_message)
-
         if not is_none_or_empty(chat.get("images")) and role == "assistant":
             generated_assets["image"] = {
                 "query": chat.get("intent", {}).get("inferred-queries", [user_message])[0],
@@ -448,7 +564,7 @@ def generate_chatml_messages_with_context(
             }
 
         if not is_none_or_empty(generated_assets):
-            chatml_messages.append(
+            chat_attachments.append(
                 ChatMessage(
                     content=f"{prompts.generated_assets_context.format(generated_assets=yaml_dump(generated_assets))}\n",
                     role="user",
@@ -459,22 +575,63 @@ def generate_chatml_messages_with_context(
             chat_message, chat.get("images") if role == "user" else [], model_type, vision_enabled
         )
 
-        reconstructed_message = ChatMessage(content=message_content, role=role)
-        chatml_messages.insert(0, reconstructed_message)
-
-        if len(chatml_messages) >= 3 * lookback_turns:
+        # Messages of each chat are in chronological order. Chats are collected in reverse chronological order
+        chat_messages = chat_attachments
+        if not is_none_or_empty(message_context):
+            chat_messages.append(ChatMessage(content=message_context, role="user"))
+        chat_messages.append(ChatMessage(content=message_content, role=role))
+        messages_by_chat.append(chat_messages)
+        history_turn_ids.add(chat.get("turnId"))
+
+        # Start chat history at a chat index in strides of chats. So once the conversation exceeds the lookback window,
+        # the start of chat history, and so the prompt prefix, only moves forward every few turns instead of every turn
+        history_message_count += len(chat_messages)
+        if history_message_count >= 3 * lookback_turns and chat_index % history_stride == 0:
             break
 
+    chatml_messages = [message for chat_messages in reversed(messages_by_chat) for message in chat_messages]
+
+    # Mark end of the stable prompt prefix for chat model providers that need explicit prompt cache breakpoints
+    if len(chatml_messages) > 0:
+        chatml_messages[-1].additional_kwargs["cache_breakpoint"] = True
+
+    # Collect messages in chronological order
     messages = []
 
-    if not is_none_or_empty(generated_asset_results):
+    if not is_none_or_empty(system_message):
+        messages.append(ChatMessage(content=system_message, role="system"))
+
+    if not is_none_or_empty(conversation_summary.get("summary")):
+        summary_context = prompts.conversation_summary_context.format(
+            summary=conversation_summary["summary"], references=conversation_summary.get("references") or "None"
+        )
+        messages.append(ChatMessage(content=summary_context, role="user"))
+
+    messages += chatml_messages
+
+    # Add recalled earlier turns after the chat history, so they don't change the stable prompt prefix
+    recalled_chats = [
+        chat for chat in conversation_recall.get("chats", []) if chat.get("turnId") not in history_turn_ids
+    ]
+    if recalled_chats:
+        recalled_chat_history = "\n".join(
+            f"{'User' if chat['by'] == 'you' else 'AI'}: {chat.get('message', '')}" for chat in recalled_chats
+        )
         messages.append(
-            ChatMessage(
-                content=f"{prompts.generated_assets_context.format(generated_assets=yaml_dump(generated_asset_results))}\n\n",
-                role="user",
-            )
+            ChatMessage(content=prompts.recalled_conversation.format(chat_history=recalled_chat_history), role="user")
         )
 
+    if program_execution_context:
+        program_context_text = "\n".join(program_execution_context)
+        context_message += f"{prompts.additional_program_context.format(context=program_context_text)}\n"
+
+    if not is_none_or_empty(context_message):
+        messages.append(ChatMessage(content=context_message, role="user"))
+
+    if generated_files:
+        message_attached_files = gather_raw_query_files({file.name: file.content for file in generated_files})
+        messages.append(ChatMessage(content=message_attached_files, role="assistant"))
+
     if not is_none_or_empty(user_message):
         messages.append(
             ChatMessage(
@@ -485,28 +642,105 @@ def generate_chatml_messages_with_context(
             )
         )
 
-    if generated_files:
-        message_attached_files = gather_raw_query_files({file.name: file.content for file in generated_files})
-        messages.append(ChatMessage(content=message_attached_files, role="assistant"))
+    if not is_none_or_empty(generated_asset_results):
+        messages.append(
+            ChatMessage(
+                content=f"{prompts.generated_assets_context.format(generated_assets=yaml_dump(generated_asset_results))}\n\n",
+                role="user",
+            )
+        )
 
-    if program_execution_context:
-        program_context_text = "\n".join(program_execution_context)
-        context_message += f"{prompts.additional_program_context.format(context=program_context_text)}\n"
+    # Truncate oldest messages from conversation history until under max supported prompt size by model
+    messages = truncate_messages(messages[::-1], max_prompt_size, model_name, loaded_model, tokenizer_name)
 
-    if not is_none_or_empty(context_message):
-        messages.append(ChatMessage(content=context_message, role="user"))
+    # Return message in chronological order
+    return messages[::-1]
 
-    if len(chatml_messages) > 0:
-        messages += chatml_messages
 
-    if not is_none_or_empty(system_message):
-        messages.append(ChatMessage(content=system_message, role="system"))
+# Token counts of message contents by tokenizer and content hash.
+# Avoids re-encoding the same chat history messages on every chat turn
+message_token_counts = LRU(capacity=10000)
+message_token_counts_lock = threading.Lock()
 
-    # Truncate oldest messages from conversation history until under max supported prompt size by model
-    messages = truncate_messages(messages, max_prompt_size, model_name, loaded_model, tokenizer_name)
 
-    # Return message in chronological order
-    return messages[::-1]
+def count_tokens(content: Any, encoder, encoder_name: str) -> int:
+    "Count tokens in message content with the encoder. Memoized by content hash. Multi-part content counts as 0"
+    if type(content) != str:
+        return 0
+    key = (encoder_name, hashlib.md5(content.encode("utf-8", errors="ignore")).hexdigest())
+    with message_token_counts_lock:
+        if key in message_token_counts:
+            return message_token_counts[key]
+    token_count = len(encoder.encode(content))
+    with message_token_counts_lock:
+        message_token_counts[key] = token_count
+    return token_count
+
+
+# Responses of chat actors by chat model API, chat model, response type and hash of the messages sent to the chat model.
+# Lets chat actors whose response only depends on their prompt skip calling the chat model for repeated prompts
+chat_actor_responses = LRU(capacity=int(os.getenv("KHOJ_CHAT_ACTOR_CACHE_SIZE", 1000)))
+chat_actor_responses_lock = threading.Lock()
+
+
+def get_chat_actor_cache_key(
+    model_type: str, api_base_url: Optional[str], model_name: str, response_type: str, messages: List[ChatMessage]
+) -> str:
+    """
+    Get cache key of chat actor response from the chat model, its API, the response type and final truncated messages.
+    The chat model type and API base url keep responses of same named models served by different APIs apart.
+    """
+    serialized_messages = json.dumps([{"role": message.role, "content": message.content} for message in messages])
+    messages_hash = hashlib.sha256(serialized_messages.encode("utf-8", errors="ignore")).hexdigest()
+    return f"{model_type}:{api_base_url or ''}:{model_name}:{response_type}:{messages_hash}"
+
+
+def get_cached_chat_actor_response(key: str) -> Optional[str]:
+    "Get unexpired cached chat actor response. Returns None if response isn't cached"
+    with chat_actor_responses_lock:
+        if key not in chat_actor_responses:
+            return None
+        expires_at, response = chat_actor_responses[key]
+        if perf_counter() > expires_at:
+            del chat_actor_responses[key]
+            return None
+        return response
+
+
+def cache_chat_actor_response(key: str, response: str, ttl: timedelta):
+    "Cache chat actor response for its time to live"
+    with chat_actor_responses_lock:
+        chat_actor_responses[key] = (perf_counter() + ttl.total_seconds(), response)
+
+
+def get_chat_actor_response(
+    send_message: Callable[[], str],
+    messages: List[ChatMessage],
+    model_type: str,
+    model_name: str,
+    api_base_url: Optional[str] = None,
+    response_type: str = "text",
+    cache_ttl: Optional[timedelta] = None,
+    tracer: dict = {},
+) -> str:
+    """
+    Get chat model response to the messages sent by a chat actor.
+    Set cache_ttl to reuse responses to the same messages for that long, instead of calling the chat model
+    """
+    cache_key = (
+        get_chat_actor_cache_key(model_type, api_base_url, model_name, response_type, messages) if cache_ttl else None
+    )
+    cached_response = get_cached_chat_actor_response(cache_key) if cache_key else None
+    if cached_response is not None:
+        logger.debug(f"Using cached response of {model_name} to chat actor")
+        update_chat_usage_metrics(tracer, model_name, cached_responses=1)
+        return cached_response
+
+    response = send_message()
+
+    if cache_key and not is_none_or_empty(response):
+        cache_chat_actor_response(cache_key, response, cache_ttl)
+    return response
 
 
 def truncate_messages(
@@ -517,28 +751,7 @@ def truncate_messages(
     tokenizer_name=None,
 ) -> list[ChatMessage]:
     """Truncate messages to fit within max prompt size supported by model"""
-    default_tokenizer = "gpt-4o"
-
-    try:
-        if loaded_model:
-            encoder = loaded_model.tokenizer()
-        elif model_name.startswith("gpt-") or model_name.startswith("o1"):
-            # as tiktoken doesn't recognize o1 model series yet
-            encoder = tiktoken.encoding_for_model("gpt-4o" if model_name.startswith("o1") else model_name)
-        elif tokenizer_name:
-            if tokenizer_name in state.pretrained_tokenizers:
-                encoder = state.pretrained_tokenizers[tokenizer_name]
-            else:
-                encoder = AutoTokenizer.from_pretrained(tokenizer_name)
-                state.pretrained_tokenizers[tokenizer_name] = encoder
-        else:
-            encoder = download_model(model_name).tokenizer()
-    except:
-        encoder = tiktoken.encoding_for_model(default_tokenizer)
-        if state.verbose > 2:
-            logger.debug(
-                f"Fallback to default chat model tokenizer: {default_tokenizer}.\nConfigure tokenizer for model: {model_name} in Khoj settings to improve context stuffing."
-            )
+    encoder = loaded_model.tokenizer() if loaded_model else tokenizers.get(model_name, tokenizer_name)
 
     # Extract system message from messages
     system_message = None
@@ -548,17 +761,18 @@ def truncate_messages(
             break
 
     # TODO: Handle truncation of multi-part message.content, i.e when message.content is a list[dict] rather than a string
-    system_message_tokens = (
-        len(encoder.encode(system_message.content)) if system_message and type(system_message.content) == str else 0
-    )
+    encoder_name = model_name if loaded_model else TokenizerRegistry.get_key(model_name, tokenizer_name)
+    system_message_tokens = count_tokens(system_message.content, encoder, encoder_name) if system_message else 0
 
-    tokens = sum([len(encoder.encode(message.content)) for message in messages if type(message.content) == str])
+    # Count tokens of each message once. Keep a running total of tokens as older messages are dropped
+    message_tokens = [count_tokens(message.content, encoder, encoder_name) for message in messages]
+    tokens = sum(message_tokens)
 
     # Drop older messages until under max supported prompt size by model
     # Reserves 4 tokens to demarcate each message (e.g <|im_start|>user, <|im_end|>, <|endoftext|> etc.)
     while (tokens + system_message_tokens + 4 * len(messages)) > max_prompt_size and len(messages) > 1:
         messages.pop()
-        tokens = sum([len(encoder.encode(message.content)) for message in messages if type(message.content) == str])
+        tokens -= message_tokens.pop()
 
     # Truncate current message if still over max supported prompt size by model
     if (tokens + system_message_tokens) > max_prompt_size:
@@ -4,14 +4,20 @@ import logging
 import os
 import urllib.parse
 from collections import defaultdict
+from datetime import timedelta
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
-import aiohttp
 from bs4 import BeautifulSoup
 from markdownify import markdownify
 
-from khoj.database.adapters import ConversationAdapters
-from khoj.database.models import Agent, KhojUser, ServerChatSettings, WebScraper
+from khoj.database.adapters import ConversationAdapters, WebCacheAdapters
+from khoj.database.models import (
+    Agent,
+    KhojUser,
+    ServerChatSettings,
+    WebCache,
+    WebScraper,
+)
 from khoj.processor.conversation import prompts
 from khoj.routers.helpers import (
     ChatEvent,
@@ -26,6 +32,7 @@ from khoj.utils.helpers import (
     is_none_or_empty,
     timer,
 )
+from khoj.utils.http import get_http_session
 from khoj.utils.rawconfig import LocationData
 
 logger = logging.getLogger(__name__)
@@ -58,6 +65,13 @@ OLOSTEP_QUERY_PARAMS = {
 DEFAULT_MAX_WEBPAGES_TO_READ = 1
 MAX_WEBPAGES_TO_INFER = 10
 
+# Time to live of cached web search results and web page content. Set to 0 to disable caching
+WEB_CACHE_TTL = {
+    WebCache.CacheType.SEARCH: timedelta(hours=float(os.getenv("KHOJ_WEB_SEARCH_CACHE_TTL_HOURS", 6))),
+    WebCache.CacheType.PAGE: timedelta(hours=float(os.getenv("KHOJ_WEBPAGE_CACHE_TTL_HOURS", 24))),
+}
+web_cache_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"lookups": 0, "hits": 0})
+
 
 async def search_online(
     query: str,
@@ -118,7 +132,7 @@ async def search_online(
             yield {ChatEvent.STATUS: event}
 
     with timer(f"Internet searches for {subqueries} took", logger):
-        search_tasks = [search_func(subquery, location) for subquery in subqueries]
+        search_tasks = [search_with_cache(search_engine, search_func, subquery, location) for subquery in subqueries]
         search_results = await asyncio.gather(*search_tasks)
         response_dict = {subquery: search_result for subquery, search_result in search_results}
 
@@ -162,6 +176,40 @@ async def search_online(
     yield response_dict
 
 
+async def get_from_web_cache(cache_type: WebCache.CacheType, key_parts: List[str]) -> Optional[Any]:
+    "Get cached web search results or web page content. Log hit rate of the cache"
+    if not WEB_CACHE_TTL[cache_type]:
+        return None
+    cached = await WebCacheAdapters.aget_cached(cache_type, key_parts)
+    stats = web_cache_stats[cache_type]
+    stats["lookups"] += 1
+    stats["hits"] += 1 if cached is not None else 0
+    logger.info(f"Web {cache_type} cache hit rate: {stats['hits']}/{stats['lookups']} lookups")
+    return cached
+
+
+async def add_to_web_cache(cache_type: WebCache.CacheType, key_parts: List[str], value: Any):
+    "Cache web search results or web page content for their time to live"
+    if WEB_CACHE_TTL[cache_type] and not is_none_or_empty(value):
+        await WebCacheAdapters.acache(cache_type, key_parts, value, WEB_CACHE_TTL[cache_type])
+
+
+async def search_with_cache(
+    search_engine: str, search_func: Callable, query: str, location: LocationData
+) -> Tuple[str, Dict[str, List[Dict]]]:
+    "Search online with the search engine, unless results of the same search are cached"
+    # Search engines only localize results by country
+    country_code = location.country_code.lower() if location and location.country_code else "us"
+    cache_key = [search_engine, query, country_code]
+    cached_results = await get_from_web_cache(WebCache.CacheType.SEARCH, cache_key)
+    if cached_results is not None:
+        return query, cached_results
+
+    query, search_results = await search_func(query, location)
+    await add_to_web_cache(WebCache.CacheType.SEARCH, cache_key, search_results)
+    return query, search_results
+
+
 async def search_with_searxng(query: str, location: LocationData) -> Tuple[str, Dict[str, List[Dict]]]:
     """Search using local SearXNG instance."""
     # Use environment variable or default to localhost
@@ -171,36 +219,36 @@ async def search_with_searxng(query: str, location: LocationData) -> Tuple[str,
 
     params = {"q": query, "format": "html", "language": "en", "country": country_code, "categories": "general"}
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(search_url, params=params) as response:
-                if response.status != 200:
-                    logger.error(f"SearXNG search failed to call {searxng_url}: {await response.text()}")
-                    return query, {}
+    session = get_http_session()
+    try:
+        async with session.get(search_url, params=params) as response:
+            if response.status != 200:
+                logger.error(f"SearXNG search failed to call {searxng_url}: {await response.text()}")
+                return query, {}
 
-                html_content = await response.text()
+            html_content = await response.text()
 
-                soup = BeautifulSoup(html_content, "html.parser")
-                organic_results = []
+            soup = BeautifulSoup(html_content, "html.parser")
+            organic_results = []
 
-                for result in soup.find_all("article", class_="result"):
-                    title_elem = result.find("a", rel="noreferrer")
-                    if title_elem:
-                        title = title_elem.text.strip()
-                        link = title_elem["href"]
+            for result in soup.find_all("article", class_="result"):
+                title_elem = result.find("a", rel="noreferrer")
+                if title_elem:
+                    title = title_elem.text.strip()
+                    link = title_elem["href"]
 
-                        description_elem = result.find("p", class_="content")
-                        description = description_elem.text.strip() if description_elem else None
+                    description_elem = result.find("p", class_="content")
+                    description = description_elem.text.strip() if description_elem else None
 
-                        organic_results.append({"title": title, "link": link, "description": description})
+                    organic_results.append({"title": title, "link": link, "description": description})
 
-                extracted_search_result = {"organic": organic_results}
+            extracted_search_result = {"organic": organic_results}
 
-                return query, extracted_search_result
+            return query, extracted_search_result
 
-        except Exception as e:
-            logger.error(f"Error searching with SearXNG: {str(e)}")
-            return query, {}
+    except Exception as e:
+        logger.error(f"Error searching with SearXNG: {str(e)}")
+        return query, {}
 
 
 async def search_with_google(query: str, location: LocationData) -> Tuple[str, Dict[str, List[Dict]]]:
@@ -214,43 +262,43 @@ async def search_with_google(query: str, location: LocationData) -> Tuple[str, D
         "gl": country_code,  # Geolocation parameter
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(base_url, params=params) as response:
-            if response.status != 200:
-                logger.error(await response.text())
-                return query, {}
+    session = get_http_session()
+    async with session.get(base_url, params=params) as response:
+        if response.status != 200:
+            logger.error(await response.text())
+            return query, {}
 
-            json_response = await response.json()
+        json_response = await response.json()
 
-            # Transform Google's response format to match Serper's format
-            organic_results = []
-            if "items" in json_response:
-                organic_results = [
-                    {
-                        "title": item.get("title", ""),
-                        "link": item.get("link", ""),
-                        "snippet": item.get("snippet", ""),
-                        "content": None,  # Google Search API doesn't provide full content
-                    }
-                    for item in json_response["items"]
-                ]
-
-            # Format knowledge graph if available
-            knowledge_graph = {}
-            if "knowledge_graph" in json_response:
-                kg = json_response["knowledge_graph"]
-                knowledge_graph = {
-                    "title": kg.get("name", ""),
-                    "description": kg.get("description", ""),
-                    "type": kg.get("type", ""),
+        # Transform Google's response format to match Serper's format
+        organic_results = []
+        if "items" in json_response:
+            organic_results = [
+                {
+                    "title": item.get("title", ""),
+                    "link": item.get("link", ""),
+                    "snippet": item.get("snippet", ""),
+                    "content": None,  # Google Search API doesn't provide full content
                 }
+                for item in json_response["items"]
+            ]
+
+        # Format knowledge graph if available
+        knowledge_graph = {}
+        if "knowledge_graph" in json_response:
+            kg = json_response["knowledge_graph"]
+            knowledge_graph = {
+                "title": kg.get("name", ""),
+                "description": kg.get("description", ""),
+                "type": kg.get("type", ""),
+            }
 
-            extracted_search_result: Dict[str, Any] = {"organic": organic_results}
+        extracted_search_result: Dict[str, Any] = {"organic": organic_results}
 
-            if knowledge_graph:
-                extracted_search_result["knowledgeGraph"] = knowledge_graph
+        if knowledge_graph:
+            extracted_search_result["knowledgeGraph"] = knowledge_graph
 
-            return query, extracted_search_result
+        return query, extracted_search_result
 
 
 async def search_with_serper(query: str, location: LocationData) -> Tuple[str, Dict[str, List[Dict]]]:
@@ -258,20 +306,18 @@ async def search_with_serper(query: str, location: LocationData) -> Tuple[str, D
     payload = json.dumps({"q": query, "gl": country_code})
     headers = {"X-API-KEY": SERPER_DEV_API_KEY, "Content-Type": "application/json"}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(SERPER_DEV_URL, headers=headers, data=payload) as response:
-            if response.status != 200:
-                logger.error(await response.text())
-                return query, {}
-            json_response = await response.json()
-            extraction_fields = ["organic", "answerBox", "peopleAlsoAsk", "knowledgeGraph"]
-            extracted_search_result = {
-                field: json_response[field]
-                for field in extraction_fields
-                if not is_none_or_empty(json_response.get(field))
-            }
+    session = get_http_session()
+    async with session.post(SERPER_DEV_URL, headers=headers, data=payload) as response:
+        if response.status != 200:
+            logger.error(await response.text())
+            return query, {}
+        json_response = await response.json()
+        extraction_fields = ["organic", "answerBox", "peopleAlsoAsk", "knowledgeGraph"]
+        extracted_search_result = {
+            field: json_response[field] for field in extraction_fields if not is_none_or_empty(json_response.get(field))
+        }
 
-            return query, extracted_search_result
+        return query, extracted_search_result
 
 
 async def read_webpages(
@@ -351,11 +397,16 @@ async def read_webpage_and_extract_content(
     for scraper in web_scrapers:
         try:
             # Read the web page
+            if is_none_or_empty(content):
+                cached_page = await get_from_web_cache(WebCache.CacheType.PAGE, [url, scraper.type])
+                content = cached_page.get("content") if cached_page else None
             if is_none_or_empty(content):
                 with timer(f"Reading web page with {scraper.type} at '{url}' took", logger, log_level=logging.INFO):
                     content, extracted_info = await read_webpage(
                         url, scraper.type, scraper.api_key, scraper.api_url, subqueries, agent
                     )
+                if not is_none_or_empty(content):
+                    await add_to_web_cache(WebCache.CacheType.PAGE, [url, scraper.type], {"content": content})
 
             # Extract relevant information from the web page
             if is_none_or_empty(extracted_info):
@@ -381,13 +432,13 @@ async def read_webpage_at_url(web_url: str) -> str:
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.97 Safari/537.36",
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(web_url, headers=headers, timeout=30) as response:
-            response.raise_for_status()
-            html = await response.text()
-            parsed_html = BeautifulSoup(html, "html.parser")
-            body = parsed_html.body.get_text(separator="\n", strip=True)
-            return markdownify(body)
+    session = get_http_session()
+    async with session.get(web_url, headers=headers, timeout=30) as response:
+        response.raise_for_status()
+        html = await response.text()
+        parsed_html = BeautifulSoup(html, "html.parser")
+        body = parsed_html.body.get_text(separator="\n", strip=True)
+        return markdownify(body)
 
 
 async def read_webpage_with_olostep(web_url: str, api_key: str, api_url: str) -> str:
@@ -395,11 +446,11 @@ async def read_webpage_with_olostep(web_url: str, api_key: str, api_url: str) ->
     web_scraping_params: Dict[str, Union[str, int, bool]] = OLOSTEP_QUERY_PARAMS.copy()  # type: ignore
     web_scraping_params["url"] = web_url
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(api_url, params=web_scraping_params, headers=headers) as response:
-            response.raise_for_status()
-            response_json = await response.json()
-            return response_json["markdown_content"]
+    session = get_http_session()
+    async with session.get(api_url, params=web_scraping_params, headers=headers) as response:
+        response.raise_for_status()
+        response_json = await response.json()
+        return response_json["markdown_content"]
 
 
 async def read_webpage_with_jina(web_url: str, api_key: str, api_url: str) -> str:
@@ -408,11 +459,11 @@ async def read_webpage_with_jina(web_url: str, api_key: str, api_url: str) -> st
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(jina_reader_api_url, headers=headers) as response:
-            response.raise_for_status()
-            response_json = await response.json()
-            return response_json["data"]["content"]
+    session = get_http_session()
+    async with session.get(jina_reader_api_url, headers=headers) as response:
+        response.raise_for_status()
+        response_json = await response.json()
+        return response_json["data"]["content"]
 
 
 async def read_webpage_with_firecrawl(web_url: str, api_key: str, api_url: str) -> str:
@@ -420,11 +471,11 @@ async def read_webpage_with_firecrawl(web_url: str, api_key: str, api_url: str)
     headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
     params = {"url": web_url, "formats": ["markdown"], "excludeTags": ["script", ".ad"]}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(firecrawl_api_url, json=params, headers=headers) as response:
-            response.raise_for_status()
-            response_json = await response.json()
-            return response_json["data"]["markdown"]
+    session = get_http_session()
+    async with session.post(firecrawl_api_url, json=params, headers=headers) as response:
+        response.raise_for_status()
+        response_json = await response.json()
+        return response_json["data"]["markdown"]
 
 
 async def query_webpage_with_firecrawl(
@@ -456,11 +507,11 @@ Collate only relevant information from the website to answer the target query an
 
     params = {"url": web_url, "formats": ["extract"], "extract": {"systemPrompt": system_prompt, "schema": schema}}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(firecrawl_api_url, json=params, headers=headers) as response:
-            response.raise_for_status()
-            response_json = await response.json()
-            return response_json["data"]["extract"]["relevant_extract"]
+    session = get_http_session()
+    async with session.post(firecrawl_api_url, json=params, headers=headers) as response:
+        response.raise_for_status()
+        response_json = await response.json()
+        return response_json["data"]["extract"]["relevant_extract"]
 
 
 async def search_with_jina(query: str, location: LocationData) -> Tuple[str, Dict[str, List[Dict]]]:
@@ -487,25 +538,25 @@ async def search_with_jina(query: str, location: LocationData) -> Tuple[str, Dic
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(jina_search_api_url, headers=headers) as response:
-            if response.status != 200:
-                error_text = await response.text()
-                logger.error(f"Jina search failed: {error_text}")
-                return query, {}
-            response_json = await response.json()
-            parsed_response = [
-                {
-                    "title": item["title"],
-                    "content": item.get("content"),
-                    # rename description -> snippet for consistency
-                    "snippet": item["description"],
-                    # rename url -> link for consistency
-                    "link": item["url"],
-                }
-                for item in response_json["data"]
-            ]
-            return query, {"organic": parsed_response}
+    session = get_http_session()
+    async with session.get(jina_search_api_url, headers=headers) as response:
+        if response.status != 200:
+            error_text = await response.text()
+            logger.error(f"Jina search failed: {error_text}")
+            return query, {}
+        response_json = await response.json()
+        parsed_response = [
+            {
+                "title": item["title"],
+                "content": item.get("content"),
+                # rename description -> snippet for consistency
+                "snippet": item["description"],
+                # rename url -> link for consistency
+                "link": item["url"],
+            }
+            for item in response_json["data"]
+        ]
+        return query, {"organic": parsed_response}
 
 
 def deduplicate_organic_results(online_results: dict) -> dict:
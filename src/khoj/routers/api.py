@@ -6,6 +6,7 @@ import os
 import threading
 import time
 import uuid
+from datetime import timedelta
 from typing import Any, Callable, List, Optional, Set, Union
 
 import cron_descriptor
@@ -45,6 +46,7 @@ from khoj.routers.helpers import (
     ChatEvent,
     CommonQueryParams,
     ConversationCommandRateLimiter,
+    arun_chat_actor,
     get_user_config,
     schedule_automation,
     schedule_query,
@@ -422,7 +424,8 @@ async def extract_references_and_questions(
 
             loaded_model = state.offline_chat_processor_config.loaded_model
 
-            inferred_queries = extract_questions_offline(
+            inferred_queries = await arun_chat_actor(
+                extract_questions_offline,
                 defiltered_query,
                 model=chat_model,
                 loaded_model=loaded_model,
@@ -433,13 +436,15 @@ async def extract_references_and_questions(
                 max_prompt_size=chat_model.max_prompt_size,
                 personality_context=personality_context,
                 query_files=query_files,
+                cache_ttl=timedelta(days=1),
                 tracer=tracer,
             )
         elif chat_model.model_type == ChatModel.ModelType.OPENAI:
             api_key = chat_model.ai_model_api.api_key
             base_url = chat_model.ai_model_api.api_base_url
             chat_model_name = chat_model.name
-            inferred_queries = extract_questions(
+            inferred_queries = await arun_chat_actor(
+                extract_questions,
                 defiltered_query,
                 model=chat_model_name,
                 api_key=api_key,
@@ -451,12 +456,14 @@ async def extract_references_and_questions(
                 vision_enabled=vision_enabled,
                 personality_context=personality_context,
                 query_files=query_files,
+                cache_ttl=timedelta(days=1),
                 tracer=tracer,
             )
         elif chat_model.model_type == ChatModel.ModelType.ANTHROPIC:
             api_key = chat_model.ai_model_api.api_key
             chat_model_name = chat_model.name
-            inferred_queries = extract_questions_anthropic(
+            inferred_queries = await arun_chat_actor(
+                extract_questions_anthropic,
                 defiltered_query,
                 query_images=query_images,
                 model=chat_model_name,
@@ -467,12 +474,14 @@ async def extract_references_and_questions(
                 vision_enabled=vision_enabled,
                 personality_context=personality_context,
                 query_files=query_files,
+                cache_ttl=timedelta(days=1),
                 tracer=tracer,
             )
         elif chat_model.model_type == ChatModel.ModelType.GOOGLE:
             api_key = chat_model.ai_model_api.api_key
             chat_model_name = chat_model.name
-            inferred_queries = extract_questions_gemini(
+            inferred_queries = await arun_chat_actor(
+                extract_questions_gemini,
                 defiltered_query,
                 query_images=query_images,
                 model=chat_model_name,
@@ -484,6 +493,7 @@ async def extract_references_and_questions(
                 vision_enabled=vision_enabled,
                 personality_context=personality_context,
                 query_files=query_files,
+                cache_ttl=timedelta(days=1),
                 tracer=tracer,
             )
 
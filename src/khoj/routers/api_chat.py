@@ -24,6 +24,7 @@ from khoj.database.adapters import (
 )
 from khoj.database.models import Agent, KhojUser
 from khoj.processor.conversation import prompts
+from khoj.processor.conversation.offline.scheduler import OfflineChatOverloadedError
 from khoj.processor.conversation.prompts import help_message, no_entries_found
 from khoj.processor.conversation.utils import defilter_query, save_to_conversation_log
 from khoj.processor.image.generate import text_to_image
@@ -45,9 +46,13 @@ from khoj.routers.helpers import (
     ConversationCommandRateLimiter,
     DeleteMessageRequestBody,
     FeedbackData,
+    OfflineChatAdmissionControl,
+    SpeculativeToolRun,
     acreate_title_from_history,
+    add_summary_to_conversation_log,
     agenerate_chat_response,
     aget_data_sources_and_output_format,
+    arecall_relevant_chats,
     construct_automation_created_message,
     create_automation,
     gather_raw_query_files,
@@ -57,6 +62,7 @@ from khoj.routers.helpers import (
     is_query_empty,
     is_ready_to_chat,
     read_chat_stream,
+    schedule_conversation_compaction,
     update_telemetry_state,
     validate_chat_model,
 )
@@ -71,10 +77,13 @@ from khoj.utils.helpers import (
     ConversationCommand,
     command_descriptions,
     convert_image_to_webp,
+    defer_status_event,
     get_country_code_from_timezone,
     get_country_name_from_timezone,
     get_device,
+    is_env_var_true,
     is_none_or_empty,
+    merge_async_generators,
 )
 from khoj.utils.rawconfig import (
     ChatRequestBody,
@@ -203,7 +212,16 @@ def chat_history(
     common: CommonQueryParams,
     conversation_id: Optional[str] = None,
     n: Optional[int] = None,
+    before_turn_id: Optional[str] = None,
+    after_turn_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    include_context: bool = True,
 ):
+    """
+    Get messages of the conversation. Page through long conversations with the before/after turn id cursors and limit.
+    Set include_context to false to omit the heavy context, online context, code context and images of each message.
+    Fetch these for a message on demand from /history/message.
+    """
     user = request.user.object
     validate_chat_model(user)
 
@@ -233,22 +251,22 @@ def chat_history(
                 "is_hidden": conversation.agent.is_hidden,
             }
 
-    meta_log = conversation.conversation_log
-    meta_log.update(
-        {
-            "conversation_id": conversation.id,
-            "slug": conversation.title if conversation.title else conversation.slug,
-            "agent": agent_metadata,
-        }
+    # Get latest N messages if N > 0. Else get all messages except latest N
+    chat, has_more = ConversationAdapters.get_conversation_messages(
+        conversation,
+        before_turn_id=before_turn_id,
+        after_turn_id=after_turn_id,
+        limit=limit or (n if n and n > 0 else None),
+        skip_latest=-n if n and n < 0 else 0,
+        include_heavy_fields=include_context,
     )
-
-    if n:
-        # Get latest N messages if N > 0
-        if n > 0 and meta_log.get("chat"):
-            meta_log["chat"] = meta_log["chat"][-n:]
-        # Else return all messages except latest N
-        elif n < 0 and meta_log.get("chat"):
-            meta_log["chat"] = meta_log["chat"][:n]
+    meta_log = {
+        "chat": chat,
+        "has_more": has_more,
+        "conversation_id": conversation.id,
+        "slug": conversation.title if conversation.title else conversation.slug,
+        "agent": agent_metadata,
+    }
 
     update_telemetry_state(
         request=request,
@@ -266,6 +284,10 @@ def get_shared_chat(
     common: CommonQueryParams,
     public_conversation_slug: str,
     n: Optional[int] = None,
+    before_turn_id: Optional[str] = None,
+    after_turn_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    include_context: bool = True,
 ):
     user = request.user.object if request.user.is_authenticated else None
 
@@ -305,27 +327,27 @@ def get_shared_chat(
                 "is_hidden": conversation.agent.is_hidden,
             }
 
-    meta_log = conversation.conversation_log
     scrubbed_title = conversation.title if conversation.title else conversation.slug
 
     if scrubbed_title:
         scrubbed_title = scrubbed_title.replace("-", " ")
 
-    meta_log.update(
-        {
-            "conversation_id": conversation.id,
-            "slug": scrubbed_title,
-            "agent": agent_metadata,
-        }
+    # Get latest N messages if N > 0. Else get all messages except latest N
+    chat, has_more = PublicConversationAdapters.get_public_conversation_messages(
+        conversation,
+        before_turn_id=before_turn_id,
+        after_turn_id=after_turn_id,
+        limit=limit or (n if n and n > 0 else None),
+        skip_latest=-n if n and n < 0 else 0,
+        include_heavy_fields=include_context,
     )
-
-    if n:
-        # Get latest N messages if N > 0
-        if n > 0 and meta_log.get("chat"):
-            meta_log["chat"] = meta_log["chat"][-n:]
-        # Else return all messages except latest N
-        elif n < 0 and meta_log.get("chat"):
-            meta_log["chat"] = meta_log["chat"][:n]
+    meta_log = {
+        "chat": chat,
+        "has_more": has_more,
+        "conversation_id": conversation.id,
+        "slug": scrubbed_title,
+        "agent": agent_metadata,
+    }
 
     update_telemetry_state(
         request=request,
@@ -337,6 +359,60 @@ def get_shared_chat(
     return {"status": "ok", "response": meta_log}
 
 
+@api_chat.get("/history/message")
+@requires(["authenticated"])
+def chat_history_message(
+    request: Request,
+    common: CommonQueryParams,
+    conversation_id: str,
+    turn_id: str,
+):
+    "Get the messages of a conversation turn, with their context, online context, code context and images"
+    user = request.user.object
+    conversation = ConversationAdapters.get_conversation_by_user(
+        user=user, client_application=request.user.client_app, conversation_id=conversation_id
+    )
+    if conversation is None:
+        return Response(
+            content=json.dumps({"status": "error", "message": f"Conversation: {conversation_id} not found"}),
+            status_code=404,
+        )
+
+    chat, _ = ConversationAdapters.get_conversation_messages(conversation, turn_id=turn_id)
+    if not chat:
+        return Response(
+            content=json.dumps({"status": "error", "message": f"Message: {turn_id} not found"}),
+            status_code=404,
+        )
+
+    return {"status": "ok", "response": chat}
+
+
+@api_chat.get("/share/history/message")
+def get_shared_chat_message(
+    request: Request,
+    common: CommonQueryParams,
+    public_conversation_slug: str,
+    turn_id: str,
+):
+    "Get the messages of a public conversation turn, with their context, online context, code context and images"
+    conversation = PublicConversationAdapters.get_public_conversation_by_slug(public_conversation_slug)
+    if conversation is None:
+        return Response(
+            content=json.dumps({"status": "error", "message": f"Conversation: {public_conversation_slug} not found"}),
+            status_code=404,
+        )
+
+    chat, _ = PublicConversationAdapters.get_public_conversation_messages(conversation, turn_id=turn_id)
+    if not chat:
+        return Response(
+            content=json.dumps({"status": "error", "message": f"Message: {turn_id} not found"}),
+            status_code=404,
+        )
+
+    return {"status": "ok", "response": chat}
+
+
 @api_chat.delete("/history")
 @requires(["authenticated"])
 async def clear_chat_history(
@@ -614,6 +690,7 @@ async def chat(
         ApiUserRateLimiter(requests=100, subscribed_requests=600, window=60 * 60 * 24, slug="chat_day")
     ),
     image_rate_limiter=Depends(ApiImageRateLimiter(max_images=10, max_combined_size_mb=20)),
+    offline_chat_admission_control=Depends(OfflineChatAdmissionControl()),
 ):
     # Access the parameters from the body
     q = body.q
@@ -631,6 +708,8 @@ async def chat(
     raw_images = body.images
     raw_query_files = body.files
 
+    event_delimiter = "␃🔚␗"
+
     async def event_generator(q: str, images: list[str]):
         start_time = time.perf_counter()
         ttft = None
@@ -638,7 +717,6 @@ async def chat(
         connection_alive = True
         user: KhojUser = request.user.object
         is_subscribed = has_required_scope(request, ["premium"])
-        event_delimiter = "␃🔚␗"
         q = unquote(q)
         train_of_thought = []
         nonlocal conversation_id
@@ -785,7 +863,9 @@ async def chat(
         if city or region or country or country_code:
             location = LocationData(city=city, region=region, country=country, country_code=country_code)
         user_message_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        meta_log = conversation.conversation_log
+        meta_log = add_summary_to_conversation_log(conversation, await conversation.aget_conversation_log())
+        # Summarize older chats of long conversations in the background, for use by later turns
+        schedule_conversation_compaction(user, conversation, meta_log)
 
         researched_results = ""
         online_results: Dict = dict()
@@ -802,6 +882,35 @@ async def chat(
         generated_mermaidjs_diagram: str = None
         program_execution_context: List[str] = []
 
+        # Speculatively search notes while the tools to use are selected, as notes are selected for most turns.
+        # This overlaps notes retrieval with the tool selection chat model call
+        speculative_notes_search: Optional[SpeculativeToolRun] = None
+        speculative_notes_stream = None
+        if (
+            conversation_commands == [ConversationCommand.Default]
+            and is_env_var_true("KHOJ_SPECULATIVE_NOTES_SEARCH")
+            and await EntryAdapters.auser_has_entries(user)
+        ):
+            speculative_notes_search = SpeculativeToolRun(
+                ConversationCommand.Notes,
+                extract_references_and_questions(
+                    request,
+                    meta_log,
+                    q,
+                    (n or 7),
+                    d,
+                    conversation_id,
+                    [ConversationCommand.Notes],
+                    location,
+                    # Defer status events until the speculative notes search is used
+                    defer_status_event,
+                    query_images=uploaded_images,
+                    agent=agent,
+                    query_files=attached_file_context,
+                    tracer=tracer,
+                ),
+            )
+
         if conversation_commands == [ConversationCommand.Default]:
             try:
                 chosen_io = await aget_data_sources_and_output_format(
@@ -828,12 +937,20 @@ async def chat(
             async for result in send_event(ChatEvent.STATUS, f"**Selected Tools:** {conversation_commands_str}"):
                 yield result
 
+        # Use the speculative notes search only if notes were selected. Cancel it otherwise
+        if speculative_notes_search:
+            speculative_notes_stream = speculative_notes_search.use_if_selected(
+                conversation_commands, lambda message: send_event(ChatEvent.STATUS, message)
+            )
+
         cmds_to_rate_limit += conversation_commands
         for cmd in cmds_to_rate_limit:
             try:
                 await conversation_command_rate_limiter.update_and_check_if_valid(request, cmd)
                 q = q.replace(f"/{cmd.value}", "").strip()
             except HTTPException as e:
+                if speculative_notes_stream:
+                    speculative_notes_search.cancel()
                 async for result in send_llm_response(str(e.detail), tracer.get("usage")):
                     yield result
                 return
@@ -974,39 +1091,86 @@ async def chat(
             return
 
         # Gather Context
-        ## Extract Document References
-        if not ConversationCommand.Research in conversation_commands:
-            try:
-                async for result in extract_references_and_questions(
-                    request,
-                    meta_log,
-                    q,
-                    (n or 7),
-                    d,
-                    conversation_id,
-                    conversation_commands,
-                    location,
-                    partial(send_event, ChatEvent.STATUS),
-                    query_images=uploaded_images,
-                    agent=agent,
-                    query_files=attached_file_context,
-                    tracer=tracer,
-                ):
-                    if isinstance(result, dict) and ChatEvent.STATUS in result:
-                        yield result[ChatEvent.STATUS]
-                    else:
-                        compiled_references.extend(result[0])
-                        inferred_queries.extend(result[1])
-                        defiltered_query = result[2]
-            except Exception as e:
-                error_message = (
-                    f"Error searching knowledge base: {e}. Attempting to respond without document references."
+        ## Run independent tools concurrently, so the slowest tool bounds the turn latency
+        tool_streams = {}
+        if speculative_notes_stream:
+            ## Use Document References from the speculative notes search
+            tool_streams[ConversationCommand.Notes] = speculative_notes_stream
+        elif not ConversationCommand.Research in conversation_commands:
+            ## Extract Document References
+            tool_streams[ConversationCommand.Notes] = extract_references_and_questions(
+                request,
+                meta_log,
+                q,
+                (n or 7),
+                d,
+                conversation_id,
+                conversation_commands,
+                location,
+                partial(send_event, ChatEvent.STATUS),
+                query_images=uploaded_images,
+                agent=agent,
+                query_files=attached_file_context,
+                tracer=tracer,
+            )
+        if ConversationCommand.Online in conversation_commands:
+            ## Gather Online References
+            tool_streams[ConversationCommand.Online] = search_online(
+                defiltered_query,
+                meta_log,
+                location,
+                user,
+                partial(send_event, ChatEvent.STATUS),
+                custom_filters,
+                query_images=uploaded_images,
+                agent=agent,
+                query_files=attached_file_context,
+                tracer=tracer,
+            )
+        if ConversationCommand.Webpage in conversation_commands:
+            ## Gather Webpage References
+            tool_streams[ConversationCommand.Webpage] = read_webpages(
+                defiltered_query,
+                meta_log,
+                location,
+                user,
+                partial(send_event, ChatEvent.STATUS),
+                query_images=uploaded_images,
+                agent=agent,
+                query_files=attached_file_context,
+                tracer=tracer,
+            )
+
+        tool_results: Dict[ConversationCommand, Any] = {}
+        tool_status_chunks: Dict[ConversationCommand, List[str]] = {tool: [] for tool in tool_streams}
+        tool_failure_messages = {
+            ConversationCommand.Notes: "Document search failed. I'll try respond without document references",
+            ConversationCommand.Online: "Online search failed. I'll try respond without online references",
+            ConversationCommand.Webpage: "Webpage read failed. I'll try respond without webpage references",
+        }
+        async for tool, result in merge_async_generators(tool_streams):
+            if isinstance(result, dict) and ChatEvent.STATUS in result:
+                # Send each status event of a tool whole, without interleaving it with events of other tools
+                tool_status_chunks[tool].append(result[ChatEvent.STATUS])
+                if result[ChatEvent.STATUS] == event_delimiter:
+                    for chunk in tool_status_chunks[tool]:
+                        yield chunk
+                    tool_status_chunks[tool] = []
+            elif isinstance(result, Exception):
+                logger.warning(
+                    f"Error using {tool.value} tool: {result}. Attempting to respond without its results",
+                    exc_info=result,
                 )
-                logger.error(error_message, exc_info=True)
-                async for result in send_event(
-                    ChatEvent.STATUS, "Document search failed. I'll try respond without document references"
-                ):
-                    yield result
+                async for event in send_event(ChatEvent.STATUS, tool_failure_messages[tool]):
+                    yield event
+            else:
+                tool_results[tool] = result
+
+        ## Merge gathered references in a deterministic order
+        if ConversationCommand.Notes in tool_results:
+            compiled_references.extend(tool_results[ConversationCommand.Notes][0])
+            inferred_queries.extend(tool_results[ConversationCommand.Notes][1])
+            defiltered_query = tool_results[ConversationCommand.Notes][2]
 
             if not is_none_or_empty(compiled_references):
                 headings = "\n- " + "\n- ".join(set([c.get("compiled", c).split("\n")[0] for c in compiled_references]))
@@ -1015,6 +1179,7 @@ async def chat(
                 async for result in send_event(ChatEvent.STATUS, f"**Found Relevant Notes**: {headings}"):
                     yield result
 
+        if ConversationCommand.Notes in tool_streams:
             if conversation_commands == [ConversationCommand.Notes] and not await EntryAdapters.auser_has_entries(user):
                 async for result in send_llm_response(f"{no_entries_found.format()}", tracer.get("usage")):
                     yield result
@@ -1023,71 +1188,22 @@ async def chat(
         if ConversationCommand.Notes in conversation_commands and is_none_or_empty(compiled_references):
             conversation_commands.remove(ConversationCommand.Notes)
 
-        ## Gather Online References
-        if ConversationCommand.Online in conversation_commands:
-            try:
-                async for result in search_online(
-                    defiltered_query,
-                    meta_log,
-                    location,
-                    user,
-                    partial(send_event, ChatEvent.STATUS),
-                    custom_filters,
-                    query_images=uploaded_images,
-                    agent=agent,
-                    query_files=attached_file_context,
-                    tracer=tracer,
-                ):
-                    if isinstance(result, dict) and ChatEvent.STATUS in result:
-                        yield result[ChatEvent.STATUS]
-                    else:
-                        online_results = result
-            except Exception as e:
-                error_message = f"Error searching online: {e}. Attempting to respond without online results"
-                logger.warning(error_message)
-                async for result in send_event(
-                    ChatEvent.STATUS, "Online search failed. I'll try respond without online references"
-                ):
-                    yield result
+        if ConversationCommand.Online in tool_results:
+            online_results = tool_results[ConversationCommand.Online]
 
-        ## Gather Webpage References
-        if ConversationCommand.Webpage in conversation_commands:
-            try:
-                async for result in read_webpages(
-                    defiltered_query,
-                    meta_log,
-                    location,
-                    user,
-                    partial(send_event, ChatEvent.STATUS),
-                    query_images=uploaded_images,
-                    agent=agent,
-                    query_files=attached_file_context,
-                    tracer=tracer,
-                ):
-                    if isinstance(result, dict) and ChatEvent.STATUS in result:
-                        yield result[ChatEvent.STATUS]
-                    else:
-                        direct_web_pages = result
-                webpages = []
-                for query in direct_web_pages:
-                    if online_results.get(query):
-                        online_results[query]["webpages"] = direct_web_pages[query]["webpages"]
-                    else:
-                        online_results[query] = {"webpages": direct_web_pages[query]["webpages"]}
+        if ConversationCommand.Webpage in tool_results:
+            direct_web_pages = tool_results[ConversationCommand.Webpage]
+            webpages = []
+            for query in direct_web_pages:
+                if online_results.get(query):
+                    online_results[query]["webpages"] = direct_web_pages[query]["webpages"]
+                else:
+                    online_results[query] = {"webpages": direct_web_pages[query]["webpages"]}
 
-                    for webpage in direct_web_pages[query]["webpages"]:
-                        webpages.append(webpage["link"])
-                async for result in send_event(ChatEvent.STATUS, f"**Read web pages**: {webpages}"):
-                    yield result
-            except Exception as e:
-                logger.warning(
-                    f"Error reading webpages: {e}. Attempting to respond without webpage results",
-                    exc_info=True,
-                )
-                async for result in send_event(
-                    ChatEvent.STATUS, "Webpage read failed. I'll try respond without webpage references"
-                ):
-                    yield result
+                for webpage in direct_web_pages[query]["webpages"]:
+                    webpages.append(webpage["link"])
+            async for result in send_event(ChatEvent.STATUS, f"**Read web pages**: {webpages}"):
+                yield result
 
         ## Gather Code Results
         if ConversationCommand.Code in conversation_commands:
@@ -1228,6 +1344,7 @@ async def chat(
         async for result in send_event(ChatEvent.STATUS, f"**Generating a well-informed response**"):
             yield result
 
+        meta_log = await arecall_relevant_chats(user, conversation, meta_log, defiltered_query)
         llm_response, chat_metadata = await agenerate_chat_response(
             defiltered_query,
             meta_log,
@@ -1261,30 +1378,50 @@ async def chat(
             yield result
 
         continue_stream = True
-        iterator = AsyncIteratorWrapper(llm_response)
-        async for item in iterator:
-            if item is None:
-                async for result in send_event(ChatEvent.END_LLM_RESPONSE, ""):
-                    yield result
-                # Send Usage Metadata once llm interactions are complete
-                async for event in send_event(ChatEvent.USAGE, tracer.get("usage")):
-                    yield event
-                async for result in send_event(ChatEvent.END_RESPONSE, ""):
-                    yield result
-                logger.debug("Finished streaming response")
-                return
-            if not connection_alive or not continue_stream:
-                continue
-            try:
-                async for result in send_event(ChatEvent.MESSAGE, f"{item}"):
-                    yield result
-            except Exception as e:
-                continue_stream = False
-                logger.info(f"User {user} disconnected. Emitting rest of responses to clear thread: {e}")
+        # Online chat models stream natively async. Offline chat models stream from a thread
+        iterator = llm_response if hasattr(llm_response, "__aiter__") else AsyncIteratorWrapper(llm_response)
+        try:
+            async for item in iterator:
+                if item is None:
+                    break
+                if not connection_alive or not continue_stream:
+                    continue
+                try:
+                    async for result in send_event(ChatEvent.MESSAGE, f"{item}"):
+                        yield result
+                except Exception as e:
+                    continue_stream = False
+                    logger.info(f"User {user} disconnected. Emitting rest of responses to clear stream: {e}")
+        except OfflineChatOverloadedError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+
+        async for result in send_event(ChatEvent.END_LLM_RESPONSE, ""):
+            yield result
+        # Send Usage Metadata once llm interactions are complete
+        async for event in send_event(ChatEvent.USAGE, tracer.get("usage")):
+            yield event
+        async for result in send_event(ChatEvent.END_RESPONSE, ""):
+            yield result
+        logger.debug("Finished streaming response")
+
+    async def stream_events_with_errors(q: str, images: list[str]):
+        """
+        Send errors raised after the chat response started streaming as a status event.
+        The response status can't be changed to an error status once the response has started.
+        """
+        try:
+            async for event in event_generator(q, images=images):
+                yield event
+        except HTTPException as e:
+            logger.warning(f"Chat request by {request.user.object} failed with {e.status_code} error: {e.detail}")
+            yield json.dumps({"type": ChatEvent.STATUS.value, "data": e.detail}, ensure_ascii=False)
+            yield event_delimiter
+            yield json.dumps({"type": ChatEvent.END_RESPONSE.value, "data": ""})
+            yield event_delimiter
 
     ## Stream Text Response
     if stream:
-        return StreamingResponse(event_generator(q, images=raw_images), media_type="text/plain")
+        return StreamingResponse(stream_events_with_errors(q, images=raw_images), media_type="text/plain")
     ## Non-Streaming Text Response
     else:
         response_iterator = event_generator(q, images=raw_images)
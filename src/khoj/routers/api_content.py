@@ -75,6 +75,23 @@ class IndexBatchRequest(BaseModel):
     files: list[File]
 
 
+class FileManifestEntry(BaseModel):
+    path: str
+    hash: str  # MD5 hex digest of the raw file content
+    size: Optional[int] = None  # Size of the raw file content in bytes
+
+
+class IndexManifestRequest(BaseModel):
+    files: list[FileManifestEntry]
+    # Folders and files managed by the client, with all their files listed in the manifest.
+    # Only indexed files under these paths are returned for deletion
+    roots: list[str] = []
+
+
+# Maximum number of files and roots in a manifest diff request
+max_manifest_files = 10000
+
+
 class IndexerInput(BaseModel):
     org: Optional[dict[str, str]] = None
     markdown: Optional[dict[str, str]] = None
@@ -133,6 +150,72 @@ async def patch_content(
     return await indexer(request, files, t, False, client, user_agent, referer, host)
 
 
+@api_content.post("/manifest")
+@requires(["authenticated"])
+async def diff_content_manifest(
+    request: Request,
+    manifest: IndexManifestRequest,
+    client: Optional[str] = None,
+):
+    """
+    Compare manifest of files on client with files indexed on server.
+
+    Returns the files the client needs to upload as their content has changed since they were last indexed,
+    and the indexed files under the manifest roots that are missing from the manifest. Clients should then only
+    upload the changed files and mark the files they deleted for removal from the index, via the PATCH /api/content
+    endpoint. Files indexed by other clients are never returned for deletion, as they are outside the manifest roots.
+    """
+    if len(manifest.files) > max_manifest_files or len(manifest.roots) > max_manifest_files:
+        raise HTTPException(
+            status_code=400, detail=f"Too many files. Maximum number of files in manifest is {max_manifest_files}."
+        )
+
+    user = request.user.object
+    manifest_paths = {file.path for file in manifest.files}
+
+    indexed_files = await sync_to_async(FileObjectAdapters.get_indexed_file_fingerprints)(
+        user, file_names=list(manifest_paths), file_source=DbEntry.EntrySource.COMPUTER
+    )
+    files_to_upload = [
+        file for file in manifest.files if indexed_files.get(file.path, {}).get("content_hash") != file.hash
+    ]
+    indexed_paths: set[str] = set()
+    if manifest.roots:
+        indexed_paths = await sync_to_async(set)(
+            EntryAdapters.get_all_filenames_by_source(user, DbEntry.EntrySource.COMPUTER)
+        )
+    files_to_delete = sorted(
+        path for path in indexed_paths - manifest_paths if is_path_under_roots(path, manifest.roots)
+    )
+
+    update_telemetry_state(
+        request=request,
+        telemetry_type="api",
+        api="diff_content_manifest",
+        client=client,
+        metadata={
+            "num_manifest_files": len(manifest_paths),
+            "num_upload_files": len(files_to_upload),
+            "num_delete_files": len(files_to_delete),
+        },
+    )
+
+    return {
+        "upload": [file.path for file in files_to_upload],
+        "upload_size": sum(file.size or 0 for file in files_to_upload),
+        "delete": files_to_delete,
+    }
+
+
+def is_path_under_roots(path: str, roots: List[str]) -> bool:
+    "Check if the file path is one of the root paths or inside one of the root folders"
+    for root in roots:
+        root = root.rstrip("/\\")
+        if path == root or path.startswith(f"{root}/") or path.startswith(f"{root}\\"):
+            return True
+    return False
+
+
 @api_content.get("/github", response_class=Response)
 @requires(["authenticated"])
 def get_content_github(request: Request) -> Response:
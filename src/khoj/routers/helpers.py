@@ -48,6 +48,7 @@ from khoj.database.adapters import (
     FileObjectAdapters,
     ais_user_subscribed,
     create_khoj_token,
+    get_default_search_model,
     get_khoj_tokens,
     get_user_by_email,
     get_user_name,
@@ -60,6 +61,7 @@ from khoj.database.models import (
     ChatModel,
     ClientApplication,
     Conversation,
+    ConversationMessage,
     GithubConfig,
     KhojUser,
     NotionConfig,
@@ -89,17 +91,22 @@ from khoj.processor.conversation.offline.chat_model import (
     converse_offline,
     send_message_to_model_offline,
 )
+from khoj.processor.conversation.offline.scheduler import OfflineChatOverloadedError
 from khoj.processor.conversation.openai.gpt import (
     converse_openai,
     send_message_to_model,
 )
+from khoj.processor.conversation.tokenizers import tokenizers
 from khoj.processor.conversation.utils import (
     ChatEvent,
     ThreadedGenerator,
     clean_json,
     clean_mermaidjs,
     construct_chat_history,
+    construct_chat_history_for_compaction,
     generate_chatml_messages_with_context,
+    get_chat_actor_response,
+    is_conversation_recall_enabled,
     save_to_conversation_log,
 )
 from khoj.processor.speech.text_to_speech import is_eleven_labs_enabled
@@ -111,7 +118,9 @@ from khoj.utils.config import OfflineChatProcessorModel
 from khoj.utils.helpers import (
     LRU,
     ConversationCommand,
+    collect_async_generator,
     get_file_type,
+    is_env_var_true,
     is_none_or_empty,
     is_valid_url,
     log_telemetry,
@@ -124,6 +133,10 @@ from khoj.utils.rawconfig import ChatRequestBody, FileAttachment, FileData, Loca
 logger = logging.getLogger(__name__)
 
 executor = ThreadPoolExecutor(max_workers=1)
+# Bounded pool to run blocking chat model calls of chat actors without blocking the event loop
+chat_actor_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("KHOJ_CHAT_ACTOR_WORKERS", 16)), thread_name_prefix="chat_actor"
+)
 
 
 NOTION_OAUTH_CLIENT_ID = os.getenv("NOTION_OAUTH_CLIENT_ID")
@@ -264,6 +277,50 @@ async def agenerate_chat_response(*args):
     return await loop.run_in_executor(executor, generate_chat_response, *args)
 
 
+async def arun_chat_actor(func, *args, **kwargs):
+    "Run blocking chat actor call in the chat actor thread pool, so other requests progress while it waits"
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(chat_actor_executor, partial(func, *args, **kwargs))
+
+
+class SpeculativeToolRun:
+    """
+    Run a chat tool in the background before the tools to use for the chat turn are selected.
+    Pass defer_status_event as the status func of the tool stream, so its status events are only sent if it is used.
+    """
+
+    def __init__(self, tool: ConversationCommand, tool_stream: AsyncGenerator):
+        self.tool = tool
+        self.task = asyncio.create_task(collect_async_generator(tool_stream))
+
+    def use_if_selected(
+        self, conversation_commands: List[ConversationCommand], send_status_func: Callable
+    ) -> Optional[AsyncGenerator]:
+        """
+        Get stream replaying the items of the tool run, if its tool was selected. Cancel the tool run otherwise.
+        Automations are created without running tools, so the tool run is cancelled for them.
+        """
+        if self.tool in conversation_commands and ConversationCommand.Automation not in conversation_commands:
+            return self.replay(send_status_func)
+        self.cancel()
+        return None
+
+    async def replay(self, send_status_func: Callable) -> AsyncGenerator:
+        "Yield the items of the tool run. Send its deferred status events via the status func"
+        for item in await self.task:
+            if isinstance(item, dict) and ChatEvent.STATUS in item:
+                async for event in send_status_func(item[ChatEvent.STATUS]):
+                    yield {ChatEvent.STATUS: event}
+            else:
+                yield item
+
+    def cancel(self):
+        "Cancel the tool run. Retrieve and log the exception of a tool run that already failed"
+        if self.task.done() and not self.task.cancelled() and self.task.exception():
+            logger.warning(f"Unused {self.tool.value} tool run failed: {self.task.exception()}")
+        self.task.cancel()
+
+
 def gather_raw_query_files(
     query_files: Dict[str, str],
 ):
@@ -287,7 +344,7 @@ async def acreate_title_from_history(
     """
     Create a title from the given conversation history
     """
-    chat_history = construct_chat_history(conversation.conversation_log)
+    chat_history = construct_chat_history(await conversation.aget_conversation_log())
 
     title_generation_prompt = prompts.conversation_title_generation.format(chat_history=chat_history)
 
@@ -297,6 +354,162 @@ async def acreate_title_from_history(
     return response.strip()
 
 
+# Conversations being compacted
+conversation_compactions_in_progress: Set[str] = set()
+# Background conversation compaction tasks. Referenced until done, so they aren't garbage collected mid-run
+conversation_compaction_tasks: Set[asyncio.Task] = set()
+
+
+def is_conversation_compaction_enabled() -> bool:
+    "Check if older chats of long conversations should be summarized in the background"
+    return is_env_var_true("KHOJ_CONVERSATION_COMPACTION")
+
+
+async def acompact_conversation(
+    user: KhojUser,
+    conversation: Conversation,
+    conversation_log: dict,
+    recent_chats_to_keep: int = None,
+    min_chats_to_summarize: int = None,
+):
+    """
+    Fold older chats of the conversation into its rolling summary and references digest.
+    The most recent chats are kept verbatim. Only chats not summarized yet are sent to the chat model.
+    """
+    recent_chats_to_keep = recent_chats_to_keep or int(os.getenv("KHOJ_COMPACTION_RECENT_CHATS", 8))
+    min_chats_to_summarize = min_chats_to_summarize or int(os.getenv("KHOJ_COMPACTION_MIN_CHATS", 8))
+
+    chats = conversation_log.get("chat", [])
+    summarized_until_turn_id = conversation.summarized_until_turn_id
+    summarized_chats_count = Conversation.count_summarized_chats(
+        [chat.get("turnId") for chat in chats], summarized_until_turn_id
+    )
+    # Rebuild summary from scratch if the turn it was summarized until is no longer in the conversation
+    summary, references_digest = (
+        (conversation.summary, conversation.references_digest) if summarized_chats_count else (None, None)
+    )
+    compact_until = max(len(chats) - recent_chats_to_keep, 0)
+    # Keep each turn, the user message and its response, together
+    while compact_until > summarized_chats_count and compact_until < len(chats) and chats[compact_until]["by"] != "you":
+        compact_until -= 1
+    if compact_until - summarized_chats_count < min_chats_to_summarize:
+        return
+    compact_until_turn_id = chats[compact_until - 1].get("turnId")
+    if not compact_until_turn_id:
+        logger.debug(f"Skip compacting conversation {conversation.id}. Its older chats have no turn id")
+        return
+
+    compaction_prompt = prompts.conversation_compaction.format(
+        summary=summary or "None",
+        references=references_digest or "None",
+        chat_history=construct_chat_history_for_compaction(chats[summarized_chats_count:compact_until]),
+    )
+
+    with timer("Chat actor: Summarize older chats of conversation", logger):
+        response = await send_message_to_model_wrapper(compaction_prompt, response_type="json_object", user=user)
+
+    response = json.loads(clean_json(response))
+    if is_none_or_empty(response.get("summary")):
+        raise ValueError(f"Invalid conversation summary: {response}")
+
+    # Only save summary if the conversation wasn't compacted in the meantime
+    await Conversation.objects.filter(id=conversation.id, summarized_until_turn_id=summarized_until_turn_id).aupdate(
+        summary=str(response["summary"]),
+        references_digest=str(response.get("references") or ""),
+        summarized_until_turn_id=compact_until_turn_id,
+    )
+    logger.info(f"Summarized {compact_until - summarized_chats_count} older chats of conversation {conversation.id}")
+
+
+def schedule_conversation_compaction(user: KhojUser, conversation: Conversation, conversation_log: dict):
+    "Compact the conversation in the background, if enabled and not already being compacted"
+    conversation_id = str(conversation.id)
+    if not is_conversation_compaction_enabled() or conversation_id in conversation_compactions_in_progress:
+        return
+
+    async def compact():
+        try:
+            await acompact_conversation(user, conversation, {"chat": list(conversation_log.get("chat", []))})
+        except Exception as e:
+            logger.warning(f"Failed to compact conversation {conversation_id}: {e}", exc_info=True)
+        finally:
+            conversation_compactions_in_progress.discard(conversation_id)
+
+    conversation_compactions_in_progress.add(conversation_id)
+    compaction_task = asyncio.create_task(compact())
+    conversation_compaction_tasks.add(compaction_task)
+    compaction_task.add_done_callback(conversation_compaction_tasks.discard)
+
+
+def add_summary_to_conversation_log(conversation: Conversation, conversation_log: dict) -> dict:
+    "Add rolling summary of the older chats of the conversation, if any, for prompts to use instead of those chats"
+    if not is_conversation_compaction_enabled() or is_none_or_empty(conversation.summary):
+        return conversation_log
+    summarized_chats_count = Conversation.count_summarized_chats(
+        [chat.get("turnId") for chat in conversation_log.get("chat", [])], conversation.summarized_until_turn_id
+    )
+    # Skip stale summary of a conversation whose summarized turns were removed
+    if summarized_chats_count == 0:
+        return conversation_log
+    conversation_log["summary"] = {
+        "summary": conversation.summary,
+        "references": conversation.references_digest,
+        "chats": summarized_chats_count,
+    }
+    return conversation_log
+
+
+async def arecall_relevant_chats(
+    user: KhojUser, conversation: Conversation, conversation_log: dict, query: str
+) -> dict:
+    """
+    Recall earlier turns of the conversation most relevant to the query, within a token budget.
+    Chat prompts then use the recalled turns with only the latest turns, instead of a long fixed lookback window.
+    """
+    recent_turns = int(os.getenv("KHOJ_CONVERSATION_RECALL_RECENT_TURNS", 2))
+    chats = conversation_log.get("chat", [])
+    if not is_conversation_recall_enabled() or is_none_or_empty(query) or len(chats) <= 2 * recent_turns:
+        return conversation_log
+
+    search_model = await sync_to_async(get_default_search_model)()
+    if search_model.name not in state.embeddings_model:
+        return conversation_log
+    max_turns = int(os.getenv("KHOJ_CONVERSATION_RECALL_TURNS", 5))
+    max_tokens = int(os.getenv("KHOJ_CONVERSATION_RECALL_TOKENS", 1000))
+
+    # Recent turns are always in the chat prompt, so only recall earlier turns
+    recent_turn_ids = [chat["turnId"] for chat in chats[-2 * recent_turns :] if chat.get("turnId")]
+    with timer("Recall relevant earlier chats of conversation", logger):
+        query_embedding = await arun_chat_actor(state.embeddings_model[search_model.name].embed_query, query)
+        turn_ids = await ConversationAdapters.aget_relevant_turn_ids(
+            conversation, query_embedding, search_model, exclude_turn_ids=recent_turn_ids, max_results=max_turns
+        )
+
+    # Recall the most relevant turns that fit in the token budget
+    chat_indices_by_turn: Dict[str, List[int]] = {}
+    for chat_index, chat in enumerate(chats):
+        chat_indices_by_turn.setdefault(chat.get("turnId"), []).append(chat_index)
+    recalled_chat_indices: List[int] = []
+    recalled_tokens = 0
+    recall_tokenizer = tokenizers.get_default()
+    for turn_id in turn_ids:
+        chat_indices = chat_indices_by_turn.get(turn_id, [])
+        turn_tokens = sum(len(recall_tokenizer.encode(str(chats[i].get("message", "")))) for i in chat_indices)
+        if chat_indices and recalled_tokens + turn_tokens <= max_tokens:
+            recalled_chat_indices += chat_indices
+            recalled_tokens += turn_tokens
+
+    # Recalled chats are added to the chat prompt in chronological order, without their large context fields
+    conversation_log["recall"] = {
+        "chats": [
+            {key: value for key, value in chats[i].items() if key not in ConversationMessage.HEAVY_FIELDS}
+            for i in sorted(recalled_chat_indices)
+        ],
+        "recent_turns": recent_turns,
+    }
+    return conversation_log
+
+
 async def acreate_title_from_query(query: str, user: KhojUser = None) -> str:
     """
     Create a title from the given query
@@ -304,7 +517,7 @@ async def acreate_title_from_query(query: str, user: KhojUser = None) -> str:
     title_generation_prompt = prompts.subject_generation.format(query=query)
 
     with timer("Chat actor: Generate title from query", logger):
-        response = await send_message_to_model_wrapper(title_generation_prompt, user=user)
+        response = await send_message_to_model_wrapper(title_generation_prompt, user=user, cache_ttl=timedelta(days=7))
 
     return response.strip()
 
@@ -406,6 +619,7 @@ async def aget_data_sources_and_output_format(
             user=user,
             query_files=query_files,
             agent_chat_model=agent_chat_model,
+            cache_ttl=timedelta(days=1),
             tracer=tracer,
         )
 
@@ -489,6 +703,7 @@ async def infer_webpage_urls(
             user=user,
             query_files=query_files,
             agent_chat_model=agent_chat_model,
+            cache_ttl=timedelta(days=1),
             tracer=tracer,
         )
 
@@ -548,6 +763,7 @@ async def generate_online_subqueries(
             user=user,
             query_files=query_files,
             agent_chat_model=agent_chat_model,
+            cache_ttl=timedelta(days=1),
             tracer=tracer,
         )
 
@@ -649,6 +865,7 @@ async def extract_relevant_info(
         user=user,
         agent_chat_model=agent_chat_model,
         tracer=tracer,
+        cache_ttl=timedelta(days=1),
     )
     return response.strip()
 
@@ -1130,8 +1347,13 @@ async def send_message_to_model_wrapper(
     context: str = "",
     query_files: str = None,
     agent_chat_model: ChatModel = None,
+    cache_ttl: timedelta = None,
     tracer: dict = {},
 ):
+    """
+    Send message to the chat model of the user or agent and get its response.
+    Set cache_ttl to reuse responses to the same final messages for that long, instead of calling the chat model
+    """
     chat_model: ChatModel = await ConversationAdapters.aget_default_chat_model(user, agent_chat_model)
     vision_available = chat_model.vision_enabled
     if not vision_available and query_images:
@@ -1153,6 +1375,7 @@ async def send_message_to_model_wrapper(
     tokenizer = chat_model.tokenizer
     model_type = chat_model.model_type
     vision_available = chat_model.vision_enabled
+    api_base_url = None
 
     if model_type == ChatModel.ModelType.OFFLINE:
         if state.offline_chat_processor_config is None or state.offline_chat_processor_config.loaded_model is None:
@@ -1172,14 +1395,13 @@ async def send_message_to_model_wrapper(
             query_files=query_files,
         )
 
-        return send_message_to_model_offline(
-            messages=truncated_messages,
+        send_message = partial(
+            send_message_to_model_offline,
             loaded_model=loaded_model,
             model_name=chat_model_name,
             max_prompt_size=max_tokens,
             streaming=False,
             response_type=response_type,
-            tracer=tracer,
         )
 
     elif model_type == ChatModel.ModelType.OPENAI:
@@ -1199,13 +1421,12 @@ async def send_message_to_model_wrapper(
             query_files=query_files,
         )
 
-        return send_message_to_model(
-            messages=truncated_messages,
+        send_message = partial(
+            send_message_to_model,
             api_key=api_key,
             model=chat_model_name,
             response_type=response_type,
             api_base_url=api_base_url,
-            tracer=tracer,
         )
     elif model_type == ChatModel.ModelType.ANTHROPIC:
         api_key = chat_model.ai_model_api.api_key
@@ -1222,12 +1443,11 @@ async def send_message_to_model_wrapper(
             query_files=query_files,
         )
 
-        return anthropic_send_message_to_model(
-            messages=truncated_messages,
+        send_message = partial(
+            anthropic_send_message_to_model,
             api_key=api_key,
             model=chat_model_name,
             response_type=response_type,
-            tracer=tracer,
         )
     elif model_type == ChatModel.ModelType.GOOGLE:
         api_key = chat_model.ai_model_api.api_key
@@ -1244,16 +1464,30 @@ async def send_message_to_model_wrapper(
             query_files=query_files,
         )
 
-        return gemini_send_message_to_model(
-            messages=truncated_messages,
+        send_message = partial(
+            gemini_send_message_to_model,
             api_key=api_key,
             model=chat_model_name,
             response_type=response_type,
-            tracer=tracer,
         )
     else:
         raise HTTPException(status_code=500, detail="Invalid conversation config")
 
+    try:
+        return await arun_chat_actor(
+            get_chat_actor_response,
+            partial(send_message, messages=truncated_messages, tracer=tracer),
+            truncated_messages,
+            model_type,
+            chat_model_name,
+            api_base_url=api_base_url,
+            response_type=response_type,
+            cache_ttl=cache_ttl,
+            tracer=tracer,
+        )
+    except OfflineChatOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 
 def send_message_to_model_wrapper_sync(
     message: str,
@@ -1262,8 +1496,13 @@ def send_message_to_model_wrapper_sync(
     user: KhojUser = None,
     query_images: List[str] = None,
     query_files: str = "",
+    cache_ttl: timedelta = None,
     tracer: dict = {},
 ):
+    """
+    Send message to the default chat model of the user and get its response.
+    Set cache_ttl to reuse responses to the same final messages for that long, instead of calling the chat model
+    """
     chat_model: ChatModel = ConversationAdapters.get_default_chat_model(user)
 
     if chat_model is None:
@@ -1272,6 +1511,7 @@ def send_message_to_model_wrapper_sync(
     chat_model_name = chat_model.name
     max_tokens = chat_model.max_prompt_size
     vision_available = chat_model.vision_enabled
+    api_base_url = None
 
     if chat_model.model_type == ChatModel.ModelType.OFFLINE:
         if state.offline_chat_processor_config is None or state.offline_chat_processor_config.loaded_model is None:
@@ -1290,14 +1530,13 @@ def send_message_to_model_wrapper_sync(
             query_files=query_files,
         )
 
-        return send_message_to_model_offline(
-            messages=truncated_messages,
+        send_message = partial(
+            send_message_to_model_offline,
             loaded_model=loaded_model,
             model_name=chat_model_name,
             max_prompt_size=max_tokens,
             streaming=False,
             response_type=response_type,
-            tracer=tracer,
         )
 
     elif chat_model.model_type == ChatModel.ModelType.OPENAI:
@@ -1314,17 +1553,14 @@ def send_message_to_model_wrapper_sync(
             query_files=query_files,
         )
 
-        openai_response = send_message_to_model(
-            messages=truncated_messages,
+        send_message = partial(
+            send_message_to_model,
             api_key=api_key,
             api_base_url=api_base_url,
             model=chat_model_name,
             response_type=response_type,
-            tracer=tracer,
         )
 
-        return openai_response
-
     elif chat_model.model_type == ChatModel.ModelType.ANTHROPIC:
         api_key = chat_model.ai_model_api.api_key
         truncated_messages = generate_chatml_messages_with_context(
@@ -1338,12 +1574,11 @@ def send_message_to_model_wrapper_sync(
             query_files=query_files,
         )
 
-        return anthropic_send_message_to_model(
-            messages=truncated_messages,
+        send_message = partial(
+            anthropic_send_message_to_model,
             api_key=api_key,
             model=chat_model_name,
             response_type=response_type,
-            tracer=tracer,
         )
 
     elif chat_model.model_type == ChatModel.ModelType.GOOGLE:
@@ -1359,16 +1594,26 @@ def send_message_to_model_wrapper_sync(
             query_files=query_files,
         )
 
-        return gemini_send_message_to_model(
-            messages=truncated_messages,
+        send_message = partial(
+            gemini_send_message_to_model,
             api_key=api_key,
             model=chat_model_name,
             response_type=response_type,
-            tracer=tracer,
         )
     else:
         raise HTTPException(status_code=500, detail="Invalid conversation config")
 
+    return get_chat_actor_response(
+        partial(send_message, messages=truncated_messages, tracer=tracer),
+        truncated_messages,
+        chat_model.model_type,
+        chat_model_name,
+        api_base_url=api_base_url,
+        response_type=response_type,
+        cache_ttl=cache_ttl,
+        tracer=tracer,
+    )
+
 
 def generate_chat_response(
     q: str,
@@ -1396,7 +1641,7 @@ def generate_chat_response(
     generated_asset_results: Dict[str, Dict] = {},
     is_subscribed: bool = False,
     tracer: dict = {},
-) -> Tuple[Union[ThreadedGenerator, Iterator[str]], Dict[str, str]]:
+) -> Tuple[Union[ThreadedGenerator, Iterator[str], AsyncGenerator[str, None]], Dict[str, str]]:
     # Initialize Variables
     chat_response = None
     logger.debug(f"Conversation Types: {conversation_commands}")
@@ -1659,6 +1904,28 @@ class ApiUserRateLimiter:
         UserRequests.objects.create(user=user, slug=self.slug)
 
 
+class OfflineChatAdmissionControl:
+    "Reject chat requests to the offline chat model with a 503 when it is overloaded, instead of queueing them"
+
+    async def __call__(self, request: Request):
+        scheduler = state.offline_chat_processor_config.scheduler if state.offline_chat_processor_config else None
+        if not scheduler or not scheduler.is_overloaded():
+            return
+
+        # Only reject requests of users chatting with the offline chat model
+        user: KhojUser = request.user.object if request.user.is_authenticated else None
+        user_chat_model = await ConversationAdapters.aget_user_chat_model(user) if user else None
+        if user_chat_model is None:
+            user_chat_model = await ConversationAdapters.aget_default_chat_model(user)
+        if user_chat_model and user_chat_model.model_type == ChatModel.ModelType.OFFLINE:
+            logger.warning(f"Offline chat model overloaded. Rejecting chat request: {scheduler.metrics()}")
+            raise HTTPException(
+                status_code=503,
+                detail="I'm busy answering other questions right now. Please try again in a bit.",
+                headers={"Retry-After": "10"},
+            )
+
+
 class ApiImageRateLimiter:
     def __init__(self, max_images: int = 10, max_combined_size_mb: float = 10):
         self.max_images = max_images
@@ -1872,7 +2139,9 @@ def should_notify(original_query: str, executed_query: str, ai_response: str, us
     with timer("Chat actor: Decide to notify user of automation response", logger):
         try:
             # TODO Replace with async call so we don't have to maintain a sync version
-            raw_response = send_message_to_model_wrapper_sync(to_notify_or_not, user=user, response_type="json_object")
+            raw_response = send_message_to_model_wrapper_sync(
+                to_notify_or_not, user=user, response_type="json_object", cache_ttl=timedelta(days=1)
+            )
             response = json.loads(clean_json(raw_response))
             should_notify_result = response["decision"] == "Yes"
             reason = response.get("reason", "unknown")
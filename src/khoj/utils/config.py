@@ -4,10 +4,15 @@ from __future__ import annotations  # to avoid quoting type hints
 import logging
 from dataclasses import dataclass
 from enum import Enum
+from functools import partial
 from typing import TYPE_CHECKING, Any, List, Optional, Union
 
 import torch
 
+from khoj.processor.conversation.offline.scheduler import (
+    OfflineChatScheduler,
+    get_scheduler,
+)
 from khoj.processor.conversation.offline.utils import download_model
 
 logger = logging.getLogger(__name__)
@@ -73,8 +78,13 @@ class OfflineChatProcessorModel:
     def __init__(self, chat_model: str = "bartowski/Meta-Llama-3.1-8B-Instruct-GGUF", max_tokens: int = None):
         self.chat_model = chat_model
         self.loaded_model = None
+        self.scheduler: OfflineChatScheduler = None
         try:
             self.loaded_model = download_model(self.chat_model, max_tokens=max_tokens)
+            # Load pool of model instances to serve concurrent requests to the offline chat model
+            self.scheduler = get_scheduler(
+                self.loaded_model, load_model=partial(download_model, self.chat_model, max_tokens=max_tokens)
+            )
         except ValueError as e:
             self.loaded_model = None
             logger.error(f"Error while loading offline chat model: {e}", exc_info=True)
@@ -1,12 +1,16 @@
+import fnmatch
 import glob
 import logging
 import os
+import time
 from pathlib import Path
 from typing import Optional
 
 from bs4 import BeautifulSoup
 from magika import Magika
 
+from khoj.database.adapters import FileObjectAdapters
+from khoj.database.models import Entry as DbEntry
 from khoj.database.models import (
     KhojUser,
     LocalMarkdownConfig,
@@ -14,6 +18,7 @@ from khoj.database.models import (
     LocalPdfConfig,
     LocalPlaintextConfig,
 )
+from khoj.processor.content.text_to_entries import TextToEntries
 from khoj.utils.config import SearchType
 from khoj.utils.helpers import get_absolute_path, is_none_or_empty
 from khoj.utils.rawconfig import TextContentConfig
@@ -22,26 +27,102 @@ logger = logging.getLogger(__name__)
 magika = Magika()
 
 
-def collect_files(user: KhojUser, search_type: Optional[SearchType] = SearchType.All) -> dict:
+def collect_files(
+    user: KhojUser, search_type: Optional[SearchType] = SearchType.All, skip_unchanged: bool = False
+) -> dict:
+    """
+    Collect content of files to index from the local content sources configured by the user.
+    Set skip_unchanged to skip reading files with same size and modification time as when they were last indexed.
+    """
     files: dict[str, dict] = {"docx": {}, "image": {}}
+    collection_started_ns = time.time_ns()
+
+    def get_indexed_files(file_type: str) -> dict[str, dict]:
+        return FileObjectAdapters.get_indexed_file_fingerprints(user, file_type) if skip_unchanged else {}
 
     if search_type == SearchType.All or search_type == SearchType.Org:
         org_config = LocalOrgConfig.objects.filter(user=user).first()
-        files["org"] = get_org_files(construct_config_from_db(org_config)) if org_config else {}
+        indexed_files = get_indexed_files(DbEntry.EntryType.ORG) if org_config else {}
+        files["org"] = get_org_files(construct_config_from_db(org_config), indexed_files) if org_config else {}
+        update_unchanged_file_stats(user, files["org"], indexed_files, collection_started_ns)
     if search_type == SearchType.All or search_type == SearchType.Markdown:
         markdown_config = LocalMarkdownConfig.objects.filter(user=user).first()
-        files["markdown"] = get_markdown_files(construct_config_from_db(markdown_config)) if markdown_config else {}
+        indexed_files = get_indexed_files(DbEntry.EntryType.MARKDOWN) if markdown_config else {}
+        files["markdown"] = (
+            get_markdown_files(construct_config_from_db(markdown_config), indexed_files) if markdown_config else {}
+        )
+        update_unchanged_file_stats(user, files["markdown"], indexed_files, collection_started_ns)
     if search_type == SearchType.All or search_type == SearchType.Plaintext:
         plaintext_config = LocalPlaintextConfig.objects.filter(user=user).first()
-        files["plaintext"] = get_plaintext_files(construct_config_from_db(plaintext_config)) if plaintext_config else {}
+        indexed_files = get_indexed_files(DbEntry.EntryType.PLAINTEXT) if plaintext_config else {}
+        files["plaintext"] = (
+            get_plaintext_files(construct_config_from_db(plaintext_config), indexed_files) if plaintext_config else {}
+        )
+        update_unchanged_file_stats(user, files["plaintext"], indexed_files, collection_started_ns)
     if search_type == SearchType.All or search_type == SearchType.Pdf:
         pdf_config = LocalPdfConfig.objects.filter(user=user).first()
-        files["pdf"] = get_pdf_files(construct_config_from_db(pdf_config)) if pdf_config else {}
+        indexed_files = get_indexed_files(DbEntry.EntryType.PDF) if pdf_config else {}
+        files["pdf"] = get_pdf_files(construct_config_from_db(pdf_config), indexed_files) if pdf_config else {}
+        update_unchanged_file_stats(user, files["pdf"], indexed_files, collection_started_ns)
     files["image"] = {}
     files["docx"] = {}
     return files
 
 
+def get_file_stats(file: str) -> tuple[int, int]:
+    "Get size and modification time of file"
+    file_stat = os.stat(file)
+    return file_stat.st_size, file_stat.st_mtime_ns
+
+
+def is_file_unchanged(file: str, indexed_files: Optional[dict[str, dict]]) -> bool:
+    "Check if file has same size and modification time as when it was last indexed"
+    indexed_file = (indexed_files or {}).get(file)
+    if indexed_file is None or indexed_file["file_size"] is None or indexed_file["file_mtime_ns"] is None:
+        return False
+    try:
+        return get_file_stats(file) == (indexed_file["file_size"], indexed_file["file_mtime_ns"])
+    except OSError:
+        return False
+
+
+def skip_unchanged_files(files: list[str], indexed_files: Optional[dict[str, dict]]) -> list[str]:
+    "Drop files with same size and modification time as when they were last indexed"
+    if not indexed_files:
+        return files
+    files_to_read = [file for file in files if not is_file_unchanged(file, indexed_files)]
+    if len(files_to_read) < len(files):
+        logger.debug(f"Skipping {len(files) - len(files_to_read)} unchanged files")
+    return files_to_read
+
+
+def update_unchanged_file_stats(
+    user: KhojUser, files: dict[str, str], indexed_files: dict[str, dict], collection_started_ns: int
+):
+    """
+    Record size and modification time of files with same content as when they were last indexed.
+    This allows skipping reading these files on subsequent syncs until they are modified again.
+    """
+    if not indexed_files:
+        return
+
+    file_to_stats_map: dict[str, tuple[int, int]] = {}
+    for file, content in files.items():
+        indexed_file = indexed_files.get(file)
+        if indexed_file is None or indexed_file["content_hash"] != TextToEntries.hash_content(content):
+            continue
+        try:
+            file_stats = get_file_stats(file)
+        except OSError:
+            continue
+        # Only trust stats of files not modified since collection started, as read content may be stale otherwise
+        if file_stats[1] < collection_started_ns:
+            file_to_stats_map[file] = file_stats
+
+    if file_to_stats_map:
+        FileObjectAdapters.update_file_stats(user, file_to_stats_map)
+
+
 def construct_config_from_db(db_config) -> TextContentConfig:
     return TextContentConfig(
         input_files=db_config.input_files,
@@ -50,7 +131,32 @@ def construct_config_from_db(db_config) -> TextContentConfig:
     )
 
 
-def get_plaintext_files(config: TextContentConfig) -> dict[str, str]:
+def get_configured_files(config: TextContentConfig) -> list[str]:
+    "Get absolute paths of the files specified, or matched by the file filters, in the content config"
+    absolute_files, filtered_files = set(), set()
+    if config.input_files:
+        absolute_files = {get_absolute_path(input_file) for input_file in config.input_files}
+    if config.input_filter:
+        filtered_files = {
+            filtered_file
+            for input_filter in config.input_filter
+            for filtered_file in glob.glob(get_absolute_path(input_filter), recursive=True)
+            if os.path.isfile(filtered_file)
+        }
+    return sorted(absolute_files | filtered_files)
+
+
+def is_configured_file(file: str, config: TextContentConfig) -> bool:
+    """
+    Check if file path is specified, or matched by a file filter, in the content config.
+    Matches file paths by pattern, so it also works for deleted files.
+    """
+    if file in {get_absolute_path(input_file) for input_file in config.input_files or []}:
+        return True
+    return any(fnmatch.fnmatch(file, get_absolute_path(input_filter)) for input_filter in config.input_filter or [])
+
+
+def get_plaintext_files(config: TextContentConfig, indexed_files: dict[str, dict] = None) -> dict[str, str]:
     def is_plaintextfile(file: str):
         "Check if file is plaintext file"
         # Check if file path exists
@@ -76,18 +182,8 @@ def get_plaintext_files(config: TextContentConfig) -> dict[str, str]:
         return {}
 
     # Get all plain text files to process
-    absolute_plaintext_files, filtered_plaintext_files = set(), set()
-    if input_files:
-        absolute_plaintext_files = {get_absolute_path(jsonl_file) for jsonl_file in input_files}
-    if input_filters:
-        filtered_plaintext_files = {
-            filtered_file
-            for plaintext_file_filter in input_filters
-            for filtered_file in glob.glob(get_absolute_path(plaintext_file_filter), recursive=True)
-            if os.path.isfile(filtered_file)
-        }
-
-    all_target_files = sorted(absolute_plaintext_files | filtered_plaintext_files)
+    all_target_files = get_configured_files(config)
+    all_target_files = skip_unchanged_files(all_target_files, indexed_files)
 
     files_with_no_plaintext_extensions = {
         target_files for target_files in all_target_files if not is_plaintextfile(target_files)
@@ -113,7 +209,7 @@ def get_plaintext_files(config: TextContentConfig) -> dict[str, str]:
     return filename_to_content_map
 
 
-def get_org_files(config: TextContentConfig):
+def get_org_files(config: TextContentConfig, indexed_files: dict[str, dict] = None):
     # Extract required fields from config
     org_files, org_file_filters = (
         config.input_files,
@@ -126,18 +222,8 @@ def get_org_files(config: TextContentConfig):
         return {}
 
     # Get Org files to process
-    absolute_org_files, filtered_org_files = set(), set()
-    if org_files:
-        absolute_org_files = {get_absolute_path(org_file) for org_file in org_files}
-    if org_file_filters:
-        filtered_org_files = {
-            filtered_file
-            for org_file_filter in org_file_filters
-            for filtered_file in glob.glob(get_absolute_path(org_file_filter), recursive=True)
-            if os.path.isfile(filtered_file)
-        }
-
-    all_org_files = sorted(absolute_org_files | filtered_org_files)
+    all_org_files = get_configured_files(config)
+    all_org_files = skip_unchanged_files(all_org_files, indexed_files)
 
     files_with_non_org_extensions = {org_file for org_file in all_org_files if not org_file.endswith(".org")}
     if any(files_with_non_org_extensions):
@@ -157,7 +243,7 @@ def get_org_files(config: TextContentConfig):
     return filename_to_content_map
 
 
-def get_markdown_files(config: TextContentConfig):
+def get_markdown_files(config: TextContentConfig, indexed_files: dict[str, dict] = None):
     # Extract required fields from config
     markdown_files, markdown_file_filters = (
         config.input_files,
@@ -170,19 +256,8 @@ def get_markdown_files(config: TextContentConfig):
         return {}
 
     # Get markdown files to process
-    absolute_markdown_files, filtered_markdown_files = set(), set()
-    if markdown_files:
-        absolute_markdown_files = {get_absolute_path(markdown_file) for markdown_file in markdown_files}
-
-    if markdown_file_filters:
-        filtered_markdown_files = {
-            filtered_file
-            for markdown_file_filter in markdown_file_filters
-            for filtered_file in glob.glob(get_absolute_path(markdown_file_filter), recursive=True)
-            if os.path.isfile(filtered_file)
-        }
-
-    all_markdown_files = sorted(absolute_markdown_files | filtered_markdown_files)
+    all_markdown_files = get_configured_files(config)
+    all_markdown_files = skip_unchanged_files(all_markdown_files, indexed_files)
 
     files_with_non_markdown_extensions = {
         md_file for md_file in all_markdown_files if not md_file.endswith(".md") and not md_file.endswith(".markdown")
@@ -207,7 +282,7 @@ def get_markdown_files(config: TextContentConfig):
     return filename_to_content_map
 
 
-def get_pdf_files(config: TextContentConfig):
+def get_pdf_files(config: TextContentConfig, indexed_files: dict[str, dict] = None):
     # Extract required fields from config
     pdf_files, pdf_file_filters = (
         config.input_files,
@@ -220,18 +295,8 @@ def get_pdf_files(config: TextContentConfig):
         return {}
 
     # Get PDF files to process
-    absolute_pdf_files, filtered_pdf_files = set(), set()
-    if pdf_files:
-        absolute_pdf_files = {get_absolute_path(pdf_file) for pdf_file in pdf_files}
-    if pdf_file_filters:
-        filtered_pdf_files = {
-            filtered_file
-            for pdf_file_filter in pdf_file_filters
-            for filtered_file in glob.glob(get_absolute_path(pdf_file_filter), recursive=True)
-            if os.path.isfile(filtered_file)
-        }
-
-    all_pdf_files = sorted(absolute_pdf_files | filtered_pdf_files)
+    all_pdf_files = get_configured_files(config)
+    all_pdf_files = skip_unchanged_files(all_pdf_files, indexed_files)
 
     files_with_non_pdf_extensions = {pdf_file for pdf_file in all_pdf_files if not pdf_file.endswith(".pdf")}
 
@@ -0,0 +1,259 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Set
+
+from django.db import close_old_connections
+
+from khoj.database.adapters import FileObjectAdapters, ProcessLockAdapters
+from khoj.database.models import Entry as DbEntry
+from khoj.database.models import (
+    KhojUser,
+    LocalMarkdownConfig,
+    LocalOrgConfig,
+    LocalPdfConfig,
+    LocalPlaintextConfig,
+    ProcessLock,
+)
+from khoj.routers.helpers import configure_content
+from khoj.utils.fs_syncer import (
+    construct_config_from_db,
+    get_configured_files,
+    get_markdown_files,
+    get_org_files,
+    get_pdf_files,
+    get_plaintext_files,
+    is_configured_file,
+    is_file_unchanged,
+    update_unchanged_file_stats,
+)
+from khoj.utils.helpers import get_absolute_path
+from khoj.utils.rawconfig import TextContentConfig
+
+logger = logging.getLogger(__name__)
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# Local content sources to watch as (content type, config model, entry type, files getter, deleted file content)
+local_content_sources = [
+    ("org", LocalOrgConfig, DbEntry.EntryType.ORG, get_org_files, ""),
+    ("markdown", LocalMarkdownConfig, DbEntry.EntryType.MARKDOWN, get_markdown_files, ""),
+    ("plaintext", LocalPlaintextConfig, DbEntry.EntryType.PLAINTEXT, get_plaintext_files, ""),
+    ("pdf", LocalPdfConfig, DbEntry.EntryType.PDF, get_pdf_files, b""),
+]
+
+
+def get_users_with_local_content() -> List[KhojUser]:
+    "Get users with local content sources configured on the server"
+    users = {}
+    for _, config_model, _, _, _ in local_content_sources:
+        for config in config_model.objects.select_related("user"):
+            users[config.user.id] = config.user
+    return list(users.values())
+
+
+def get_watched_directories() -> Set[str]:
+    "Get directories to watch for changes to the files in local content sources of all users"
+    directories = set()
+    for _, config_model, _, _, _ in local_content_sources:
+        for db_config in config_model.objects.all():
+            config = construct_config_from_db(db_config)
+            for input_file in config.input_files or []:
+                directories.add(str(Path(get_absolute_path(input_file)).parent))
+            for input_filter in config.input_filter or []:
+                # Watch the deepest directory in the file filter without glob patterns
+                filter_parts = Path(get_absolute_path(input_filter)).parts
+                base_parts = []
+                for part in filter_parts[:-1]:
+                    if any(char in part for char in "*?["):
+                        break
+                    base_parts.append(part)
+                directories.add(str(Path(*base_parts)))
+    return {directory for directory in directories if os.path.isdir(directory)}
+
+
+def collect_touched_files(user: KhojUser, touched_files: Set[str]) -> dict:
+    """
+    Collect content of touched files in the local content sources configured by the user.
+    Touched files that were deleted are collected with empty content to delete them from the index.
+    """
+    files: dict[str, dict] = {"org": {}, "markdown": {}, "plaintext": {}, "pdf": {}, "docx": {}, "image": {}}
+    collection_started_ns = time.time_ns()
+
+    for content_type, config_model, file_type, get_files, deleted_file_content in local_content_sources:
+        db_config = config_model.objects.filter(user=user).first()
+        if not db_config:
+            continue
+        config = construct_config_from_db(db_config)
+        configured_files = set(get_configured_files(config))
+        modified_files = sorted(touched_files & configured_files)
+        deleted_files = [
+            file for file in touched_files if not os.path.exists(file) and is_configured_file(file, config)
+        ]
+        if not modified_files and not deleted_files:
+            continue
+
+        touched_configured_files = modified_files + deleted_files
+        indexed_files = FileObjectAdapters.get_indexed_file_fingerprints(user, file_type, touched_configured_files)
+        if modified_files:
+            modified_files_config = TextContentConfig(
+                input_files=modified_files, index_heading_entries=config.index_heading_entries
+            )
+            files[content_type] = get_files(modified_files_config, indexed_files)
+            update_unchanged_file_stats(user, files[content_type], indexed_files, collection_started_ns)
+        files[content_type].update({file: deleted_file_content for file in deleted_files if file in indexed_files})
+
+    return files
+
+
+def get_files_to_reconcile(user: KhojUser) -> Set[str]:
+    """
+    Get files in the local content sources of the user that were modified or deleted since they were last indexed.
+    Only compares file sizes and modification times with the indexed files, without reading any file.
+    """
+    files_to_reconcile = set()
+    for _, config_model, file_type, _, _ in local_content_sources:
+        db_config = config_model.objects.filter(user=user).first()
+        if not db_config:
+            continue
+        config = construct_config_from_db(db_config)
+        configured_files = get_configured_files(config)
+        indexed_files = FileObjectAdapters.get_indexed_file_fingerprints(user, file_type)
+        files_to_reconcile |= {file for file in configured_files if not is_file_unchanged(file, indexed_files)}
+        files_to_reconcile |= {
+            file for file in indexed_files if not os.path.exists(file) and is_configured_file(file, config)
+        }
+    return files_to_reconcile
+
+
+def index_touched_files(touched_files: Set[str]):
+    "Index touched files in the local content sources of all users"
+    for user in get_users_with_local_content():
+        files = collect_touched_files(user, touched_files)
+        if any(files.values()):
+            configure_content(user, files)
+
+
+class ContentWatcher(FileSystemEventHandler):
+    """
+    Watch local content sources configured on the server for file changes.
+
+    Change events are debounced, so only the touched files are indexed once the files settle.
+    A periodic reconciliation sweep catches changes missed by the watcher, like changes
+    made while the server was down, and watches directories of updated content configs.
+    """
+
+    def __init__(self, debounce_seconds: float = 5.0, reconcile_interval_seconds: float = 60 * 60):
+        self.debounce_seconds = debounce_seconds
+        self.reconcile_interval_seconds = reconcile_interval_seconds
+        self.touched_files: Set[str] = set()
+        self.lock = threading.Lock()
+        self.debounce_timer: Optional[threading.Timer] = None
+        self.reconcile_timer: Optional[threading.Timer] = None
+        self.observer = None
+
+    def start(self):
+        self.observer = Observer()
+        self.observer.daemon = True
+        self.observer.start()
+        self.reconcile()
+
+    def stop(self):
+        for timer in [self.debounce_timer, self.reconcile_timer]:
+            if timer:
+                timer.cancel()
+        if self.observer:
+            self.observer.stop()
+
+    def watch_directories(self):
+        "Watch directories of the local content sources currently configured"
+        self.observer.unschedule_all()
+        for directory in get_watched_directories():
+            self.observer.schedule(self, directory, recursive=True)
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type in ["opened", "closed_no_write"]:
+            return
+        touched_files = {os.fsdecode(event.src_path)}
+        if getattr(event, "dest_path", None):
+            touched_files.add(os.fsdecode(event.dest_path))
+        self.touch(touched_files)
+
+    def touch(self, touched_files: Set[str]):
+        "Queue touched files to index once no more files are touched for the debounce period"
+        with self.lock:
+            self.touched_files |= touched_files
+            if self.debounce_timer:
+                self.debounce_timer.cancel()
+            self.debounce_timer = threading.Timer(self.debounce_seconds, self.flush)
+            self.debounce_timer.daemon = True
+            self.debounce_timer.start()
+
+    def flush(self):
+        "Index the queued touched files"
+        close_old_connections()
+        # Retry later if content is being indexed by another process
+        if ProcessLockAdapters.is_process_locked_by_name(ProcessLock.Operation.INDEX_CONTENT):
+            self.touch(set())
+            return
+
+        with self.lock:
+            touched_files, self.touched_files = self.touched_files, set()
+        if not touched_files:
+            return
+
+        is_lock_acquired = False
+
+        def index_touched_files_with_lock():
+            nonlocal is_lock_acquired
+            is_lock_acquired = True
+            index_touched_files(touched_files)
+
+        try:
+            logger.info(f"👀 Indexing {len(touched_files)} touched files in local content sources")
+            ProcessLockAdapters.run_with_lock(index_touched_files_with_lock, ProcessLock.Operation.INDEX_CONTENT)
+        finally:
+            close_old_connections()
+
+        # Retry later if another process started indexing content before the lock was acquired
+        if not is_lock_acquired:
+            self.touch(touched_files)
+
+    def reconcile(self):
+        "Queue files changed since they were last indexed and refresh watched directories"
+        close_old_connections()
+        try:
+            self.watch_directories()
+            files_to_reconcile = set()
+            for user in get_users_with_local_content():
+                files_to_reconcile |= get_files_to_reconcile(user)
+            if files_to_reconcile:
+                logger.info(f"👀 Found {len(files_to_reconcile)} files to reconcile in local content sources")
+                self.touch(files_to_reconcile)
+        except Exception as e:
+            logger.error(f"🚨 Failed to reconcile local content sources: {e}", exc_info=True)
+        finally:
+            close_old_connections()
+
+        self.reconcile_timer = threading.Timer(self.reconcile_interval_seconds, self.reconcile)
+        self.reconcile_timer.daemon = True
+        self.reconcile_timer.start()
+
+
+def start_content_watcher() -> Optional[ContentWatcher]:
+    "Start watching local content sources for changes. Returns None if the watchdog package is not installed"
+    if Observer is None:
+        logger.warning("🚨 Install watchdog with `pip install 'khoj[watch]'` to watch local content sources for changes")
+        return None
+
+    content_watcher = ContentWatcher()
+    content_watcher.start()
+    logger.info("👀 Watching local content sources for changes")
+    return content_watcher
@@ -1,5 +1,6 @@
 from __future__ import annotations  # to avoid quoting type hints
 
+import asyncio
 import copy
 import datetime
 import io
@@ -8,6 +9,7 @@ import logging
 import os
 import platform
 import random
+import threading
 import urllib.parse
 import uuid
 from collections import OrderedDict
@@ -19,7 +21,7 @@ from itertools import islice
 from os import path
 from pathlib import Path
 from time import perf_counter
-from typing import TYPE_CHECKING, Any, Optional, Union
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Dict, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import openai
@@ -67,6 +69,47 @@ class AsyncIteratorWrapper:
             raise StopAsyncIteration
 
 
+async def merge_async_generators(generators: Dict[Any, AsyncGenerator]) -> AsyncGenerator[Tuple[Any, Any], None]:
+    """
+    Run the async generators concurrently and yield their (key, item) pairs as the items are produced.
+    An exception raised by a generator is yielded as its item, so the other generators run to completion.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    generator_done = object()
+
+    async def drain(key, generator: AsyncGenerator):
+        try:
+            async for item in generator:
+                queue.put_nowait((key, item))
+        except Exception as e:
+            queue.put_nowait((key, e))
+        finally:
+            queue.put_nowait((key, generator_done))
+
+    tasks = [asyncio.create_task(drain(key, generator)) for key, generator in generators.items()]
+    try:
+        running_generators = len(tasks)
+        while running_generators > 0:
+            key, item = await queue.get()
+            if item is generator_done:
+                running_generators -= 1
+                continue
+            yield key, item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def collect_async_generator(generator: AsyncGenerator) -> list:
+    "Collect all items of the async generator. Useful to run the generator in a task"
+    return [item async for item in generator]
+
+
+async def defer_status_event(message: str):
+    "Pass status message through as is, to send it later. Use as status func of chat tools"
+    yield message
+
+
 def is_none_or_empty(item):
     return item == None or (hasattr(item, "__iter__") and len(item) == 0) or item == ""
 
@@ -596,19 +639,55 @@ def get_cost_of_chat_message(model_name: str, input_tokens: int = 0, output_toke
 
 
 def get_chat_usage_metrics(
-    model_name: str, input_tokens: int = 0, output_tokens: int = 0, usage: dict = {}, cost: float = None
+    model_name: str,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    usage: dict = {},
+    cost: float = None,
+    cached_tokens: int = 0,
+    cached_responses: int = 0,
 ):
     """
-    Get usage metrics for chat message based on input and output tokens and cost
+    Get usage metrics for chat message based on input and output tokens and cost.
+    Cached tokens count input tokens read from the prompt cache of the chat model provider.
+    Cached responses count chat model calls served from the chat actor response cache
     """
     prev_usage = usage or {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
     return {
         "input_tokens": prev_usage["input_tokens"] + input_tokens,
         "output_tokens": prev_usage["output_tokens"] + output_tokens,
         "cost": cost or get_cost_of_chat_message(model_name, input_tokens, output_tokens, prev_cost=prev_usage["cost"]),
+        "cached_tokens": prev_usage.get("cached_tokens", 0) + cached_tokens,
+        "cached_responses": prev_usage.get("cached_responses", 0) + cached_responses,
     }
 
 
+# Chat actors of tools run concurrently in worker threads and update the usage metrics of a shared tracer
+chat_usage_lock = threading.Lock()
+
+
+def update_chat_usage_metrics(
+    tracer: dict,
+    model_name: str,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    cost: float = None,
+    cached_tokens: int = 0,
+    cached_responses: int = 0,
+):
+    "Add usage metrics of a chat model call to the tracer. Guard the update, so concurrent updates aren't lost"
+    with chat_usage_lock:
+        tracer["usage"] = get_chat_usage_metrics(
+            model_name,
+            input_tokens,
+            output_tokens,
+            tracer.get("usage"),
+            cost,
+            cached_tokens=cached_tokens,
+            cached_responses=cached_responses,
+        )
+
+
 def get_openai_client(api_key: str, api_base_url: str) -> Union[openai.OpenAI, openai.AzureOpenAI]:
     """Get OpenAI or AzureOpenAI client based on the API Base URL"""
     parsed_url = urlparse(api_base_url)
@@ -626,6 +705,23 @@ def get_openai_client(api_key: str, api_base_url: str) -> Union[openai.OpenAI, o
     return client
 
 
+def get_openai_async_client(api_key: str, api_base_url: str) -> Union[openai.AsyncOpenAI, openai.AsyncAzureOpenAI]:
+    """Get async OpenAI or AzureOpenAI client based on the API Base URL"""
+    parsed_url = urlparse(api_base_url)
+    if parsed_url.hostname and parsed_url.hostname.endswith(".openai.azure.com"):
+        client = openai.AsyncAzureOpenAI(
+            api_key=api_key,
+            azure_endpoint=api_base_url,
+            api_version="2024-10-21",
+        )
+    else:
+        client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=api_base_url,
+        )
+    return client
+
+
 def normalize_email(email: str, check_deliverability=False) -> tuple[str, bool]:
     """Normalize, validate and check deliverability of email address"""
     lower_email = email.lower()
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+
+class HttpSessionManager:
+    """
+    Share pooled HTTP client sessions across outbound requests of tools, like web search, web page reads and code runs.
+
+    Sessions reuse connections and cache DNS lookups across requests, limit concurrent connections
+    in total and, optionally, per host. A session is created per event loop,
+    as aiohttp sessions can't be used across event loops.
+
+    Connections per host are unlimited by default, as most requests go to a few API backends, like the search
+    or code sandbox APIs. Timeouts apply to connecting and to each socket read, rather than to the whole
+    request, so long running but progressing requests, like reading large web pages, aren't cut off.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = None,
+        max_connections_per_host: int = None,
+        dns_cache_seconds: int = None,
+        connect_timeout_seconds: float = None,
+        read_timeout_seconds: float = None,
+    ):
+        if max_connections is None:
+            max_connections = int(os.getenv("KHOJ_HTTP_MAX_CONNECTIONS", 100))
+        if max_connections_per_host is None:
+            # 0 means unlimited connections per host
+            max_connections_per_host = int(os.getenv("KHOJ_HTTP_MAX_CONNECTIONS_PER_HOST", 0))
+        if dns_cache_seconds is None:
+            dns_cache_seconds = int(os.getenv("KHOJ_HTTP_DNS_CACHE_SECONDS", 300))
+        if connect_timeout_seconds is None:
+            connect_timeout_seconds = float(os.getenv("KHOJ_HTTP_CONNECT_TIMEOUT_SECONDS", 10))
+        if read_timeout_seconds is None:
+            read_timeout_seconds = float(os.getenv("KHOJ_HTTP_READ_TIMEOUT_SECONDS", 120))
+
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.dns_cache_seconds = dns_cache_seconds
+        self.timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=connect_timeout_seconds, sock_read=read_timeout_seconds
+        )
+        self.sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self.lock = threading.Lock()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        "Get HTTP session of the running event loop. Create it on first use"
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            session = self.sessions.get(loop)
+            if session is None or session.closed:
+                # Forget sessions of event loops that have since closed
+                self.sessions = {
+                    event_loop: loop_session
+                    for event_loop, loop_session in self.sessions.items()
+                    if not event_loop.is_closed()
+                }
+                connector = aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    limit_per_host=self.max_connections_per_host,
+                    ttl_dns_cache=self.dns_cache_seconds,
+                )
+                # Don't keep cookies, as the session is shared by requests of all users
+                session = aiohttp.ClientSession(
+                    connector=connector, timeout=self.timeout, cookie_jar=aiohttp.DummyCookieJar()
+                )
+                self.sessions[loop] = session
+            return session
+
+    async def close(self):
+        "Close HTTP session of the running event loop and its pooled connections"
+        with self.lock:
+            session = self.sessions.pop(asyncio.get_running_loop(), None)
+        if session and not session.closed:
+            await session.close()
+            logger.debug("Closed pooled HTTP session")
+
+
+http_sessions = HttpSessionManager()
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    "Get shared HTTP session to make outbound requests with from the running event loop"
+    return http_sessions.get_session()
+
+
+async def close_http_sessions():
+    "Close the shared HTTP session of the running event loop. Call on server shutdown"
+    await http_sessions.close()
@@ -1,5 +1,4 @@
 import os
-import threading
 from collections import defaultdict
 from pathlib import Path
 from typing import Any, Dict, List
@@ -30,17 +29,16 @@ port: int = None
 ssl_config: Dict[str, str] = None
 cli_args: List[str] = None
 query_cache: Dict[str, LRU] = defaultdict(LRU)
-chat_lock = threading.Lock()
 SearchType = utils_config.SearchType
 scheduler: BackgroundScheduler = None
 schedule_leader_process_lock: ProcessLock = None
+content_watcher: Any = None
 telemetry: List[Dict[str, str]] = []
 telemetry_disabled: bool = is_env_var_true("KHOJ_TELEMETRY_DISABLE")
 khoj_version: str = None
 device = get_device()
 chat_on_gpu: bool = True
 anonymous_mode: bool = False
-pretrained_tokenizers: Dict[str, Any] = dict()
 billing_enabled: bool = (
     os.getenv("STRIPE_API_KEY") is not None
     and os.getenv("STRIPE_SIGNING_SECRET") is not None
@@ -23,6 +23,8 @@ from khoj.database.models import (
     LocalPdfConfig,
     LocalPlaintextConfig,
 )
+from khoj.processor.content.github.github_to_entries import GithubToEntries
+from khoj.processor.content.notion.notion_to_entries import NotionToEntries
 from khoj.processor.content.org_mode.org_to_entries import OrgToEntries
 from khoj.processor.content.plaintext.plaintext_to_entries import PlaintextToEntries
 from khoj.processor.embeddings import CrossEncoderModel, EmbeddingsModel
@@ -36,6 +38,8 @@ from khoj.utils.rawconfig import ContentConfig, ImageSearchConfig, SearchConfig
 from tests.helpers import (
     AiModelApiFactory,
     ChatModelFactory,
+    FakeGithubApi,
+    FakeNotionApi,
     ProcessLockFactory,
     SubscriptionFactory,
     UserConversationProcessorConfigFactory,
@@ -267,6 +271,24 @@ def content_config(tmp_path_factory, search_models: SearchModels, default_user:
     return content_config
 
 
+@pytest.fixture(scope="function")
+def fake_github_api(monkeypatch):
+    fake_api = FakeGithubApi()
+    monkeypatch.setattr(GithubToEntries, "api_url", fake_api.url)
+    yield fake_api
+    fake_api.shutdown()
+
+
+@pytest.fixture(scope="function")
+def fake_notion_api(monkeypatch):
+    fake_api = FakeNotionApi()
+    monkeypatch.setattr(NotionToEntries, "api_url", f"{fake_api.url}/v1")
+    # Avoid slowing down tests with rate limiting against the local fake api
+    monkeypatch.setattr(NotionToEntries, "requests_per_second", 1000)
+    yield fake_api
+    fake_api.shutdown()
+
+
 @pytest.fixture(scope="session")
 def md_content_config():
     markdown_config = LocalMarkdownConfig.objects.create(
@@ -1,5 +1,11 @@
+import hashlib
+import json
 import os
+import threading
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Set
+from urllib.parse import urlparse
 
 import factory
 from django.utils.timezone import make_aware
@@ -134,3 +140,157 @@ class ProcessLockFactory(factory.django.DjangoModelFactory):
         model = ProcessLock
 
     name = "test_lock"
+
+
+class FakeApiServer:
+    "Local HTTP server to fake the API of a content source in tests"
+
+    def __init__(self):
+        self.requests: List[str] = []
+        fake_api = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake_api.requests.append(urlparse(self.path).path)
+                fake_api.respond(self)
+
+            def do_POST(self):
+                fake_api.requests.append(urlparse(self.path).path)
+                fake_api.respond(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, request: BaseHTTPRequestHandler):
+        "Respond to the request. Fake API servers override this to fake their endpoints"
+        self.send(request, b"", status=404)
+
+    @staticmethod
+    def send(request: BaseHTTPRequestHandler, body: bytes, headers: Dict[str, str] = {}, status: int = 200):
+        request.send_response(status)
+        for header, value in headers.items():
+            request.send_header(header, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+class FakeGithubApi(FakeApiServer):
+    "Local fake of the Github API endpoints used to index the files of a repo branch"
+
+    def __init__(self):
+        self.files: Dict[str, str] = {}
+        # Files left out of the tree listing, as Github does for large repos, with the tree marked as truncated
+        self.truncated_files: Set[str] = set()
+        super().__init__()
+
+    @staticmethod
+    def get_blob_sha(content: str) -> str:
+        content_bytes = content.encode("utf-8")
+        return hashlib.sha1(b"blob %d\0" % len(content_bytes) + content_bytes).hexdigest()
+
+    def get_commit_sha(self) -> str:
+        tree = "\n".join(f"{path} {self.get_blob_sha(content)}" for path, content in sorted(self.files.items()))
+        return hashlib.sha1(tree.encode("utf-8")).hexdigest()
+
+    def get_requests(self, endpoint: str) -> List[str]:
+        return [request for request in self.requests if f"/{endpoint}/" in request]
+
+    def respond(self, request: BaseHTTPRequestHandler):
+        path = urlparse(request.path).path
+        commit_sha = self.get_commit_sha()
+        repo_url = path.split("/commits/")[0].split("/git/")[0]
+
+        if "/commits/" in path:
+            etag = f'"{commit_sha}"'
+            if request.headers.get("If-None-Match") == etag:
+                self.send(request, b"", status=304)
+                return
+            self.send(request, commit_sha.encode("utf-8"), {"ETag": etag})
+        elif "/git/trees/" in path:
+            tree = [
+                {
+                    "path": file_path,
+                    "type": "blob",
+                    "sha": self.get_blob_sha(content),
+                    "url": f"{self.url}{repo_url}/git/blobs/{self.get_blob_sha(content)}",
+                }
+                for file_path, content in self.files.items()
+                if file_path not in self.truncated_files
+            ]
+            is_truncated = len(self.truncated_files) > 0
+            self.send(request, json.dumps({"sha": commit_sha, "tree": tree, "truncated": is_truncated}).encode("utf-8"))
+        elif "/git/blobs/" in path:
+            blob_sha = path.rsplit("/", 1)[-1]
+            blobs = {self.get_blob_sha(content): content for content in self.files.values()}
+            if blob_sha not in blobs:
+                self.send(request, b"", status=404)
+                return
+            self.send(request, blobs[blob_sha].encode("utf-8"))
+        else:
+            self.send(request, b"", status=404)
+
+
+class FakeNotionApi(FakeApiServer):
+    "Local fake of the Notion API endpoints used to index the pages of a workspace"
+
+    def __init__(self):
+        self.pages: Dict[str, dict] = {}
+        self.block_children: Dict[str, List[dict]] = {}
+        # Number of upcoming requests to respond to with a rate limit error
+        self.rate_limited_requests = 0
+        super().__init__()
+
+    @staticmethod
+    def make_block(block_id: str, text: str, block_type: str = "paragraph", children: List[dict] = []) -> dict:
+        return {
+            "object": "block",
+            "id": block_id,
+            "type": block_type,
+            block_type: {"rich_text": [{"type": "text", "plain_text": text}]},
+            "children": children,
+        }
+
+    def add_page(self, page_id: str, title: str, blocks: List[dict], last_edited_time: str):
+        self.pages[page_id] = {
+            "object": "page",
+            "id": page_id,
+            "url": f"https://www.notion.so/{page_id}",
+            "last_edited_time": last_edited_time,
+            "properties": {"title": {"title": [{"text": {"content": title}}]}},
+        }
+        self.add_block_children(page_id, blocks)
+
+    def add_block_children(self, block_id: str, blocks: List[dict]):
+        self.block_children[block_id] = [
+            {**{key: value for key, value in block.items() if key != "children"}, "has_children": bool(children)}
+            for block in blocks
+            for children in [block["children"]]
+        ]
+        for block in blocks:
+            if block["children"]:
+                self.add_block_children(block["id"], block["children"])
+
+    def respond(self, request: BaseHTTPRequestHandler):
+        path = urlparse(request.path).path
+        if self.rate_limited_requests > 0:
+            self.rate_limited_requests -= 1
+            self.send(request, b"{}", {"Retry-After": "0"}, status=429)
+        elif path == "/v1/search":
+            request.rfile.read(int(request.headers.get("Content-Length", 0)))
+            results = {"results": list(self.pages.values()), "has_more": False}
+            self.send(request, json.dumps(results).encode("utf-8"), {"Content-Type": "application/json"})
+        elif path.startswith("/v1/blocks/") and path.endswith("/children"):
+            block_id = path.split("/")[3]
+            results = {"results": self.block_children.get(block_id, []), "has_more": False}
+            self.send(request, json.dumps(results).encode("utf-8"), {"Content-Type": "application/json"})
+        else:
+            self.send(request, b"", status=404)
@@ -1,4 +1,5 @@
 # Standard Modules
+import hashlib
 import os
 from urllib.parse import quote
 
@@ -199,6 +200,49 @@ def test_index_update(client):
     assert response.status_code == 200
 
 
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db(transaction=True)
+def test_index_manifest_returns_changed_and_deleted_files(client):
+    # Arrange
+    headers = {"Authorization": "Bearer kk-secret"}
+    files = [
+        ("files", ("path/to/manifest1.org", "* practicing piano", "text/org")),
+        ("files", ("path/to/manifest2.org", "* how to build a search engine", "text/org")),
+        ("files", ("other/client/manifest4.org", "* synced by another client", "text/org")),
+    ]
+    client.patch("/api/content", files=files, headers=headers)
+    manifest = {
+        "files": [
+            {"path": "path/to/manifest1.org", "hash": hashlib.md5(b"* practicing piano").hexdigest(), "size": 18},
+            {"path": "path/to/manifest3.org", "hash": hashlib.md5(b"* a new file").hexdigest(), "size": 12},
+        ],
+        "roots": ["path/to/"],
+    }
+
+    # Act
+    response = client.post("/api/content/manifest", json=manifest, headers=headers)
+
+    # Assert
+    assert response.status_code == 200
+    assert response.json()["upload"] == ["path/to/manifest3.org"]
+    assert response.json()["upload_size"] == 12
+    assert response.json()["delete"] == ["path/to/manifest2.org"]
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db(transaction=True)
+def test_index_manifest_fails_if_too_many_files(client):
+    # Arrange
+    headers = {"Authorization": "Bearer kk-secret"}
+    manifest = {"files": [{"path": f"path/to/filename{i}.org", "hash": f"{i}"} for i in range(10001)]}
+
+    # Act
+    response = client.post("/api/content/manifest", json=manifest, headers=headers)
+
+    # Assert
+    assert response.status_code == 400
+
+
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.django_db(transaction=True)
 def test_index_update_fails_if_more_than_1000_files(client, api_user4: KhojApiUser):
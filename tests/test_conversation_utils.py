@@ -1,7 +1,49 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+import openai
+import pytest
 import tiktoken
+from asgiref.sync import sync_to_async
 from langchain.schema import ChatMessage
+from tenacity import wait_none
 
+from khoj.database.adapters import ConversationAdapters, PublicConversationAdapters
+from khoj.database.models import (
+    ChatModel,
+    Conversation,
+    ConversationMessage,
+    KhojUser,
+    PublicConversation,
+)
 from khoj.processor.conversation import utils
+from khoj.processor.conversation.anthropic.utils import format_messages_for_anthropic
+from khoj.processor.conversation.offline import chat_model as offline_chat_model
+from khoj.processor.conversation.offline.prompt_cache import (
+    PromptStateCache,
+    stream_chat_completion_with_prompt_cache,
+)
+from khoj.processor.conversation.offline.scheduler import (
+    OfflineChatOverloadedError,
+    OfflineChatScheduler,
+    Priority,
+)
+from khoj.processor.conversation.openai import gpt
+from khoj.processor.conversation.openai import utils as openai_utils
+from khoj.processor.conversation.tokenizers import (
+    ApproximateTokenizer,
+    TokenizerRegistry,
+)
+from khoj.routers import helpers
+from tests.helpers import AiModelApiFactory, ChatModelFactory, ConversationFactory
 
 
 class TestTruncateMessage:
@@ -103,6 +145,361 @@ class TestTruncateMessage:
         assert len(chat_messages) == 1
         assert truncated_chat_history[0] != copy_big_chat_message
 
+    def test_truncate_message_encodes_each_message_once(self, monkeypatch):
+        # Arrange
+        chat_history = [ChatMessage(role="user", content=f"Unique message {index}") for index in range(500)]
+        encoded_contents = []
+
+        class CountingEncoder:
+            def encode(self, content):
+                encoded_contents.append(content)
+                return TestTruncateMessage.encoder.encode(content)
+
+        monkeypatch.setitem(utils.tokenizers.tokenizers, f"tiktoken:{self.model_name}", CountingEncoder())
+
+        # Act
+        utils.truncate_messages(chat_history, 100, self.model_name)
+        encoded_contents_after_first_call = len(encoded_contents)
+        utils.truncate_messages(list(chat_history), 100, self.model_name)
+
+        # Assert
+        assert len(chat_history) < 500
+        assert encoded_contents_after_first_call == 500
+        assert len(encoded_contents) == 500
+
+
+def test_generate_chatml_messages_uses_latest_turns():
+    # Arrange
+    conversation_log = generate_turns(500)
+
+    # Act
+    messages = utils.generate_chatml_messages_with_context(
+        "What did I ask last?", conversation_log=conversation_log, model_name="gpt-4o-mini", max_prompt_size=1500
+    )
+
+    # Assert
+    message_contents = [message.content for message in messages]
+    assert message_contents[-1] == "What did I ask last?"
+    assert "Answer 499" in message_contents
+    assert "Answer 0" not in message_contents
+
+
+class FakePromptCachingProvider:
+    "Mimic automatic prompt caching of chat model providers. Caches prompt prefix shared with earlier prompts"
+
+    def __init__(self):
+        self.prompts: list[str] = []
+
+    def send(self, messages: list[ChatMessage]) -> int:
+        "Send prompt. Returns number of prompt characters read from the prompt cache"
+        prompt = "".join(f"<|{message.role}|>{message.content}" for message in messages)
+        cached_chars = max([len(os.path.commonprefix([prompt, earlier])) for earlier in self.prompts], default=0)
+        self.prompts.append(prompt)
+        return cached_chars
+
+
+def test_generate_chatml_messages_keeps_prompt_prefix_stable_across_turns():
+    # Arrange
+    provider = FakePromptCachingProvider()
+    conversation_log = generate_turns(2)
+    previous_history_chars = 0
+    is_prefix_cached_by_turn = []
+
+    # Act
+    for index in range(2, 40):
+        messages = utils.generate_chatml_messages_with_context(
+            f"Question {index}",
+            system_message="You are Khoj.",
+            conversation_log=conversation_log,
+            context_message=f"Note {index}",
+            model_name="gpt-4o-mini",
+            max_prompt_size=9000,
+        )
+        cached_chars = provider.send(messages)
+        if index > 2:
+            is_prefix_cached_by_turn.append(cached_chars >= previous_history_chars)
+        # Chat history is all but the context and user message of the current turn
+        previous_history_chars = len("".join(f"<|{message.role}|>{message.content}" for message in messages[:-2]))
+        conversation_log["chat"] += generate_turns(index + 1)["chat"][-2:]
+
+    # Assert
+    # System message and chat history of the previous turn are a prefix of the prompt until the lookback window is full
+    assert all(is_prefix_cached_by_turn[:12])
+    # Start of chat history only moves forward every few turns after
+    assert sum(is_prefix_cached_by_turn) >= 0.8 * len(is_prefix_cached_by_turn)
+
+
+def test_anthropic_messages_have_prompt_cache_breakpoints_at_end_of_history():
+    # Arrange
+    messages = utils.generate_chatml_messages_with_context(
+        "Question 2",
+        system_message="You are Khoj.",
+        conversation_log=generate_turns(2),
+        context_message="Note 2",
+        model_name="claude-3-5-sonnet-20241022",
+        max_prompt_size=3000,
+    )
+
+    # Act
+    formatted_messages, system_prompt = format_messages_for_anthropic(messages)
+
+    # Assert
+    breakpoints = [
+        index
+        for index, message in enumerate(formatted_messages)
+        if isinstance(message.content, list) and "cache_control" in message.content[-1]
+    ]
+    assert system_prompt == [{"type": "text", "text": "You are Khoj.", "cache_control": {"type": "ephemeral"}}]
+    assert [formatted_messages[index].content[-1]["text"] for index in breakpoints] == ["Answer 1", "Question 2"]
+
+
+def test_generate_chatml_messages_replaces_summarized_chats_with_summary():
+    # Arrange
+    conversation_log = generate_turns(10)
+    conversation_log["summary"] = {"summary": "User asked questions 0 to 5.", "references": "Notes 0 to 5", "chats": 12}
+
+    # Act
+    messages = utils.generate_chatml_messages_with_context(
+        "Question 10",
+        system_message="You are Khoj.",
+        conversation_log=conversation_log,
+        model_name="gpt-4o-mini",
+        max_prompt_size=9000,
+    )
+
+    # Assert
+    message_contents = [message.content for message in messages]
+    assert message_contents[0] == "You are Khoj."
+    assert "User asked questions 0 to 5." in message_contents[1]
+    assert message_contents[2] == "Question 6"
+    assert "Answer 5" not in message_contents
+    assert message_contents[-1] == "Question 10"
+
+
+def test_generate_chatml_messages_uses_recalled_chats_with_recent_chats():
+    # Arrange
+    conversation_log = generate_turns(10)
+    recalled_chats = [
+        {key: value for key, value in chat.items() if key != "context"} for chat in conversation_log["chat"][2:4]
+    ]
+    conversation_log["recall"] = {"chats": recalled_chats, "recent_turns": 2}
+
+    # Act
+    messages = utils.generate_chatml_messages_with_context(
+        "Question 10",
+        system_message="You are Khoj.",
+        conversation_log=conversation_log,
+        model_name="gpt-4o-mini",
+        max_prompt_size=9000,
+    )
+
+    # Assert
+    message_contents = [message.content for message in messages]
+    assert message_contents[1] == "Question 8"
+    assert "Question 7" not in message_contents
+    assert "User: Question 1\nAI: Answer 1" in message_contents[-2]
+    assert message_contents[-1] == "Question 10"
+
+
+def test_approximate_tokenizer_round_trips_text():
+    # Arrange
+    tokenizer = ApproximateTokenizer()
+    text = "Khoj is an open-source, personal AI.\n  It answers questions from your notes!"
+
+    # Act
+    tokens = tokenizer.encode(text)
+
+    # Assert
+    assert tokenizer.decode(tokens) == text
+    assert len(text) / 5 < len(tokens) < len(text) / 2
+
+
+def test_tokenizer_registry_loads_each_tokenizer_once(monkeypatch):
+    # Arrange
+    registry = TokenizerRegistry()
+    loaded_keys = []
+
+    def load(key):
+        loaded_keys.append(key)
+        time.sleep(0.1)
+        return ApproximateTokenizer()
+
+    monkeypatch.setattr(registry, "load", load)
+
+    # Act
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        loaded_tokenizers = list(executor.map(lambda _: registry.get("gpt-4o-mini"), range(8)))
+    unconfigured_model_tokenizer = registry.get("bartowski/Meta-Llama-3.1-8B-Instruct-GGUF")
+
+    # Assert
+    assert loaded_keys == ["tiktoken:gpt-4o-mini", "tiktoken:gpt-4o"]
+    assert all(tokenizer is loaded_tokenizers[0] for tokenizer in loaded_tokenizers)
+    assert unconfigured_model_tokenizer is registry.get_default()
+
+
+def test_tokenizer_registry_falls_back_to_default_then_approximate_tokenizer(monkeypatch):
+    # Arrange
+    registry = TokenizerRegistry()
+
+    def fail_to_load(name):
+        raise OSError(f"Failed to load {name}")
+
+    monkeypatch.setattr("khoj.processor.conversation.tokenizers.AutoTokenizer.from_pretrained", fail_to_load)
+
+    # Act
+    unloadable_model_tokenizer = registry.get("llama-3", "unknown/tokenizer")
+
+    # Assert
+    assert unloadable_model_tokenizer is registry.get_default()
+    assert isinstance(unloadable_model_tokenizer, tiktoken.Encoding)
+
+    # Arrange
+    registry = TokenizerRegistry()
+    monkeypatch.setattr("khoj.processor.conversation.tokenizers.tiktoken.encoding_for_model", fail_to_load)
+
+    # Act
+    unloadable_model_tokenizer = registry.get("llama-3")
+
+    # Assert
+    assert isinstance(unloadable_model_tokenizer, ApproximateTokenizer)
+
+
+def test_offline_chat_scheduler_serves_actors_first_and_rejects_when_queue_full():
+    # Arrange
+    scheduler = OfflineChatScheduler(object(), pool_size=1, ram_budget=1e9, max_queue_size=2, max_wait_seconds=5)
+    served_requests = []
+
+    def send_request(name: str, priority: Priority):
+        with scheduler.acquire(priority):
+            served_requests.append(name)
+
+    def wait_for_queue_depth(depth: int):
+        while scheduler.metrics()["queue_depth"] < depth:
+            time.sleep(0.01)
+
+    busy_model = scheduler.checkout(Priority.CHAT)
+    chat_request = threading.Thread(target=send_request, args=("chat", Priority.CHAT))
+    chat_request.start()
+    wait_for_queue_depth(1)
+    actor_request = threading.Thread(target=send_request, args=("actor", Priority.ACTOR))
+    actor_request.start()
+    wait_for_queue_depth(2)
+
+    # Act
+    with pytest.raises(OfflineChatOverloadedError):
+        scheduler.checkout(Priority.ACTOR)
+    metrics = scheduler.metrics()
+    scheduler.checkin(busy_model)
+    chat_request.join()
+    actor_request.join()
+
+    # Assert
+    assert served_requests == ["actor", "chat"]
+    assert metrics["queue_depth_by_priority"] == {"actor": 1, "chat": 1}
+    assert metrics["rejected"] == 1
+    assert scheduler.metrics()["busy_instances"] == 0
+
+
+def test_overloaded_offline_chat_response_is_raised_and_not_saved(monkeypatch):
+    # Arrange
+    saved_responses = []
+    generator = utils.ThreadedGenerator(
+        [], {}, completion_func=lambda chat_response: saved_responses.append(chat_response)
+    )
+    scheduler = OfflineChatScheduler(object(), pool_size=1, ram_budget=1e9, max_queue_size=1, max_wait_seconds=0.01)
+    busy_model = scheduler.checkout(Priority.CHAT)
+    monkeypatch.setattr(offline_chat_model, "get_scheduler", lambda loaded_model: scheduler)
+    monkeypatch.setattr(offline_chat_model, "Llama", object)
+
+    # Act
+    offline_chat_model.llm_thread(generator, [ChatMessage(content="Hi", role="user")], model=busy_model)
+
+    # Assert
+    with pytest.raises(OfflineChatOverloadedError):
+        list(generator)
+    assert saved_responses == []
+
+
+class FakePromptCachingModel:
+    "Mimic how llama.cpp models reuse evaluated prompt prefixes and cache prompt states"
+
+    def __init__(self, model_path: str = "fake-model.gguf"):
+        self.model_path = model_path
+        self.cache = None
+        self.input_ids = np.array([], dtype=np.intc)
+
+    def n_ctx(self):
+        return 512
+
+    def set_cache(self, cache):
+        self.cache = cache
+
+    def create_chat_completion(self, messages, stream=True, **kwargs):
+        prompt_tokens = [ord(char) for message in messages for char in message["content"]]
+        if self.cache:
+            try:
+                self.cache[prompt_tokens]
+            except KeyError:
+                pass
+        self.input_ids = np.array(prompt_tokens, dtype=np.intc)
+        self.cache[prompt_tokens] = SimpleNamespace(input_ids=self.input_ids, llama_state_size=len(prompt_tokens))
+        yield {"choices": [{"delta": {"content": "Hi"}}]}
+
+
+def test_prompt_cache_reuses_conversation_prefix_across_model_instances(monkeypatch):
+    # Arrange
+    monkeypatch.setenv("KHOJ_OFFLINE_CHAT_PROMPT_CACHE_GB", "1")
+    first_model, second_model = FakePromptCachingModel(), FakePromptCachingModel()
+    first_turn = [{"role": "system", "content": "You are Khoj."}, {"role": "user", "content": "Hello"}]
+    second_turn = first_turn + [{"role": "assistant", "content": "Hi"}, {"role": "user", "content": "Bye"}]
+    first_tracer: dict = {}
+    second_tracer: dict = {}
+
+    # Act
+    list(stream_chat_completion_with_prompt_cache(first_model, first_turn, first_tracer))
+    list(stream_chat_completion_with_prompt_cache(second_model, second_turn, second_tracer))
+
+    # Assert
+    assert first_model.cache is second_model.cache
+    assert isinstance(second_model.cache, PromptStateCache)
+    assert first_tracer["prompt_cache"]["reused_tokens"] == 0
+    assert second_tracer["prompt_cache"]["reused_tokens"] == len("You are Khoj.Hello")
+    assert second_tracer["prompt_cache"]["prompt_tokens"] == len("You are Khoj.HelloHiBye")
+    assert second_tracer["prompt_cache"]["hit_rate"] == 0.5
+
+
+def test_prompt_cache_does_not_count_short_or_already_evaluated_prefix_matches_as_hits():
+    # Arrange
+    prompt_cache = PromptStateCache(capacity_bytes=100, min_prefix_tokens=4)
+    prompt_cache[[1, 2, 3, 4, 5, 6]] = SimpleNamespace(input_ids=np.array([1, 2, 3, 4, 5, 6]), llama_state_size=6)
+    prompt_cache.local.model = SimpleNamespace(input_ids=np.array([1, 2, 3, 4, 5, 6, 7]))
+
+    # Act
+    prompt_cache[[1, 9, 9, 9]]  # Only shares the begin of text token
+    prompt_cache[[1, 2, 3, 4, 5, 6, 8]]  # Already evaluated by the model instance
+    prompt_cache.local.model = SimpleNamespace(input_ids=np.array([1, 2]))
+    prompt_cache[[1, 2, 3, 4, 5, 6, 8]]  # Loads the longer cached prefix into the model instance
+
+    # Assert
+    assert prompt_cache.lookups == 3
+    assert prompt_cache.hits == 1
+
+
+def test_prompt_cache_evicts_least_recently_used_prompt_states():
+    # Arrange
+    prompt_cache = PromptStateCache(capacity_bytes=10, min_prefix_tokens=2)
+    for prompt_tokens in [[1, 2, 3, 4], [5, 6, 7, 8]]:
+        prompt_cache[prompt_tokens] = SimpleNamespace(input_ids=np.array(prompt_tokens), llama_state_size=4)
+    prompt_cache[[1, 2]]
+
+    # Act
+    prompt_cache[[9, 10, 11, 12]] = SimpleNamespace(input_ids=np.array([9, 10, 11, 12]), llama_state_size=4)
+
+    # Assert
+    assert [1, 2, 3, 4] in prompt_cache
+    assert [5, 6, 7, 8] not in prompt_cache
+    assert prompt_cache.hit_rate() == 1.0
+
 
 def test_load_complex_raw_json_string():
     # Arrange
@@ -116,6 +513,481 @@ def test_load_complex_raw_json_string():
     assert parsed_json == expeced_json
 
 
+@pytest.mark.django_db
+def test_save_to_conversation_log_appends_only_new_turn(default_user: KhojUser):
+    # Arrange
+    conversation_log = {"chat": []}
+    user_message_metadata = {"created": "2025-02-15 08:00:00"}
+    utils.message_to_log("Hello", "Hi there", user_message_metadata, conversation_log=conversation_log["chat"])
+    utils.message_to_log("How are you?", "Doing well", user_message_metadata, conversation_log=conversation_log["chat"])
+    conversation = ConversationFactory(user=default_user, conversation_log=conversation_log)
+    previous_message_ids = list(conversation.chat_messages.values_list("id", flat=True))
+
+    # Act
+    utils.save_to_conversation_log(
+        "What is the weather?",
+        "It is sunny",
+        default_user,
+        meta_log=conversation.conversation_log,
+        compiled_references=[{"compiled": "Weather is sunny today", "file": "weather.org"}],
+        conversation_id=str(conversation.id),
+    )
+
+    # Assert
+    saved_chat = Conversation.objects.get(id=conversation.id).conversation_log["chat"]
+    assert len(previous_message_ids) == 4
+    assert list(conversation.chat_messages.values_list("id", flat=True))[:4] == previous_message_ids
+    assert [chat["message"] for chat in saved_chat] == [
+        "Hello",
+        "Hi there",
+        "How are you?",
+        "Doing well",
+        "What is the weather?",
+        "It is sunny",
+    ]
+    assert saved_chat[-1]["context"] == [{"compiled": "Weather is sunny today", "file": "weather.org"}]
+    assert saved_chat[-1]["turnId"] == saved_chat[-2]["turnId"]
+
+
+@pytest.mark.django_db
+def test_save_to_conversation_log_embeds_turn_in_background(default_user: KhojUser, monkeypatch):
+    # Arrange
+    conversation = ConversationFactory(user=default_user)
+    embedding_jobs = []
+    monkeypatch.setenv("KHOJ_CONVERSATION_RECALL", "true")
+    monkeypatch.setattr(utils.conversation_turn_embedder, "submit", lambda *args: embedding_jobs.append(args))
+
+    # Act
+    utils.save_to_conversation_log(
+        "What is the weather?",
+        "It is sunny",
+        default_user,
+        meta_log={"chat": []},
+        conversation_id=str(conversation.id),
+        tracer={"mid": "turn-1"},
+    )
+
+    # Assert
+    # Turn is saved before it is embedded, instead of waiting on the embeddings model
+    assert ConversationMessage.objects.filter(conversation=conversation).count() == 2
+    assert embedding_jobs == [
+        (utils.embed_conversation_turn, conversation.id, "turn-1", "What is the weather?", "It is sunny")
+    ]
+
+
+@pytest.mark.django_db
+def test_conversation_message_stores_heavy_fields_apart(default_user: KhojUser):
+    # Arrange
+    chat = {
+        "message": "It is sunny",
+        "by": "khoj",
+        "created": "2025-02-15 08:00:00",
+        "turnId": "turn-1",
+        "context": [{"compiled": "Weather is sunny today", "file": "weather.org"}],
+        "onlineContext": {"weather": {"answerBox": {"title": "Sunny"}}},
+        "intent": {"type": "remember", "query": "What is the weather?", "memory-type": "notes"},
+    }
+
+    # Act
+    conversation = ConversationFactory(user=default_user, conversation_log={"chat": [chat]})
+    chat_message = ConversationMessage.objects.get(conversation=conversation)
+
+    # Assert
+    assert chat_message.turn_id == "turn-1"
+    assert set(chat_message.heavy_fields) == {"context", "onlineContext"}
+    assert "context" not in chat_message.to_chat(include_heavy_fields=False)
+    assert chat_message.to_chat() == chat
+
+
+@pytest.mark.django_db
+def test_get_conversation_messages_pages_by_turn(default_user: KhojUser):
+    # Arrange
+    conversation = ConversationFactory(user=default_user, conversation_log=generate_turns(5))
+
+    # Act
+    latest_page, has_more_before_latest = ConversationAdapters.get_conversation_messages(conversation, limit=4)
+    previous_page, has_more_before_previous = ConversationAdapters.get_conversation_messages(
+        conversation, before_turn_id=latest_page[0]["turnId"], limit=4, include_heavy_fields=False
+    )
+    next_page, has_more_after_previous = ConversationAdapters.get_conversation_messages(
+        conversation, after_turn_id=previous_page[-1]["turnId"], limit=2
+    )
+
+    # Assert
+    assert [chat["message"] for chat in latest_page] == ["Question 3", "Answer 3", "Question 4", "Answer 4"]
+    assert has_more_before_latest
+    assert [chat["message"] for chat in previous_page] == ["Question 1", "Answer 1", "Question 2", "Answer 2"]
+    assert has_more_before_previous
+    assert all("context" not in chat for chat in previous_page)
+    assert [chat["message"] for chat in next_page] == ["Question 3", "Answer 3"]
+    assert has_more_after_previous
+    assert latest_page[-1]["context"] == [{"compiled": "Note 4", "file": "notes.org"}]
+
+
+@pytest.mark.anyio
+@pytest.mark.django_db(transaction=True)
+async def test_conversation_messages_load_lazily_on_conversation_lookup(default_user: KhojUser):
+    # Arrange
+    await sync_to_async(ConversationFactory)(user=default_user, conversation_log=generate_turns(2))
+
+    # Act
+    conversation = await ConversationAdapters.aget_conversation_by_user(default_user)
+    prefetched_messages = getattr(conversation, "_prefetched_objects_cache", {}).get("chat_messages")
+    conversation_log = await conversation.aget_conversation_log()
+
+    # Assert
+    assert prefetched_messages is None
+    assert [chat["message"] for chat in conversation_log["chat"]] == [
+        "Question 0",
+        "Answer 0",
+        "Question 1",
+        "Answer 1",
+    ]
+    assert conversation_log["chat"][-1]["context"] == [{"compiled": "Note 1", "file": "notes.org"}]
+
+
+@pytest.mark.django_db
+def test_get_public_conversation_messages_pages_by_turn(default_user: KhojUser):
+    # Arrange
+    public_conversation = PublicConversation.objects.create(
+        source_owner=default_user, conversation_log=generate_turns(5), slug="paged-conversation"
+    )
+
+    # Act
+    latest_page, has_more_before_latest = PublicConversationAdapters.get_public_conversation_messages(
+        public_conversation, limit=4, include_heavy_fields=False
+    )
+    earliest_page, has_more_before_earliest = PublicConversationAdapters.get_public_conversation_messages(
+        public_conversation, before_turn_id="turn-1", limit=4
+    )
+    turn_messages, _ = PublicConversationAdapters.get_public_conversation_messages(
+        public_conversation, turn_id="turn-4"
+    )
+
+    # Assert
+    assert [chat["message"] for chat in latest_page] == ["Question 3", "Answer 3", "Question 4", "Answer 4"]
+    assert has_more_before_latest
+    assert all("context" not in chat for chat in latest_page)
+    assert [chat["message"] for chat in earliest_page] == ["Question 0", "Answer 0"]
+    assert not has_more_before_earliest
+    assert [chat["message"] for chat in turn_messages] == ["Question 4", "Answer 4"]
+    assert turn_messages[-1]["context"] == [{"compiled": "Note 4", "file": "notes.org"}]
+
+
+@pytest.mark.anyio
+@pytest.mark.django_db(transaction=True)
+async def test_chat_actors_waiting_on_chat_model_do_not_block_event_loop(default_user: KhojUser, monkeypatch):
+    # Arrange
+    chat_model = await sync_to_async(
+        lambda: ChatModelFactory(
+            name="gpt-4o-mini",
+            model_type=ChatModel.ModelType.OPENAI,
+            ai_model_api=AiModelApiFactory(api_key="fake-api-key"),
+        )
+    )()
+
+    def slow_send_message_to_model(**kwargs):
+        # Simulate a blocking chat model client waiting on the network
+        time.sleep(0.5)
+        return "Khoj response"
+
+    monkeypatch.setattr(helpers, "send_message_to_model", slow_send_message_to_model)
+
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    # Act
+    ticker = asyncio.create_task(tick())
+    start = time.perf_counter()
+    responses = await asyncio.gather(
+        *[
+            helpers.send_message_to_model_wrapper("Hello", user=default_user, agent_chat_model=chat_model)
+            for _ in range(3)
+        ]
+    )
+    elapsed = time.perf_counter() - start
+    ticker.cancel()
+
+    # Assert
+    assert responses == ["Khoj response"] * 3
+    # Requests waited on the chat model concurrently instead of one after the other
+    assert elapsed < 1.0
+    # Event loop kept serving other tasks while the chat actors waited
+    assert ticks > 10
+
+
+@pytest.mark.anyio
+@pytest.mark.django_db(transaction=True)
+async def test_chat_actor_responses_are_cached_when_opted_in(default_user: KhojUser, monkeypatch):
+    # Arrange
+    chat_model = await sync_to_async(
+        lambda: ChatModelFactory(
+            name="gpt-4o-mini",
+            model_type=ChatModel.ModelType.OPENAI,
+            ai_model_api=AiModelApiFactory(api_key="fake-api-key"),
+        )
+    )()
+    chat_model_calls = 0
+
+    def fake_send_message_to_model(**kwargs):
+        nonlocal chat_model_calls
+        chat_model_calls += 1
+        return f"Khoj response {chat_model_calls}"
+
+    monkeypatch.setattr(helpers, "send_message_to_model", fake_send_message_to_model)
+    tracer: dict = {}
+
+    # Act
+    responses = [
+        await helpers.send_message_to_model_wrapper(
+            "Which tools to use?", user=default_user, agent_chat_model=chat_model, cache_ttl=ttl, tracer=tracer
+        )
+        for ttl in [timedelta(hours=1), timedelta(hours=1), None]
+    ]
+
+    # Assert
+    assert responses == ["Khoj response 1", "Khoj response 1", "Khoj response 2"]
+    assert chat_model_calls == 2
+    assert tracer["usage"]["cached_responses"] == 1
+
+
+def test_extract_questions_responses_are_cached_when_opted_in(monkeypatch):
+    # Arrange
+    chat_model_calls = 0
+
+    def fake_send_message_to_model(messages, api_key, model, **kwargs):
+        nonlocal chat_model_calls
+        chat_model_calls += 1
+        return json.dumps({"queries": [f"Search query {chat_model_calls}"]})
+
+    monkeypatch.setattr(gpt, "send_message_to_model", fake_send_message_to_model)
+
+    # Act
+    questions = [
+        gpt.extract_questions(
+            "What did I eat at the cached dinner?",
+            api_key="fake-api-key",
+            api_base_url=api_base_url,
+            cache_ttl=timedelta(hours=1),
+        )
+        for api_base_url in [None, None, "http://localhost:8000/v1"]
+    ]
+
+    # Assert
+    assert questions == [["Search query 1"], ["Search query 1"], ["Search query 2"]]
+    assert chat_model_calls == 2
+
+
+def test_cached_chat_actor_response_expires_after_ttl():
+    # Arrange
+    messages = [ChatMessage(role="user", content="Title for this query?")]
+    cache_key = utils.get_chat_actor_cache_key(ChatModel.ModelType.OPENAI, None, "gpt-4o-mini", "text", messages)
+
+    # Act
+    utils.cache_chat_actor_response(cache_key, "Fresh title", timedelta(hours=1))
+    fresh_response = utils.get_cached_chat_actor_response(cache_key)
+    utils.cache_chat_actor_response(cache_key, "Stale title", timedelta(seconds=-1))
+    stale_response = utils.get_cached_chat_actor_response(cache_key)
+
+    # Assert
+    assert fresh_response == "Fresh title"
+    assert stale_response is None
+    assert cache_key != utils.get_chat_actor_cache_key(
+        ChatModel.ModelType.OPENAI, None, "gpt-4o-mini", "json_object", messages
+    )
+    # Responses of same named chat models served by different APIs are cached apart
+    assert cache_key != utils.get_chat_actor_cache_key(
+        ChatModel.ModelType.OPENAI, "http://localhost:8000/v1", "gpt-4o-mini", "text", messages
+    )
+
+
+@pytest.mark.anyio
+@pytest.mark.django_db(transaction=True)
+async def test_conversation_compaction_summarizes_only_new_older_chats(default_user: KhojUser, monkeypatch):
+    # Arrange
+    conversation = await sync_to_async(ConversationFactory)(user=default_user, conversation_log=generate_turns(10))
+    conversation_log = await sync_to_async(lambda: conversation.conversation_log)()
+    compaction_prompts = []
+
+    async def fake_send_message_to_model_wrapper(query, **kwargs):
+        compaction_prompts.append(query)
+        return json.dumps({"summary": f"Summary {len(compaction_prompts)}", "references": "Notes"})
+
+    monkeypatch.setattr(helpers, "send_message_to_model_wrapper", fake_send_message_to_model_wrapper)
+
+    # Act
+    await helpers.acompact_conversation(default_user, conversation, conversation_log)
+    compacted_conversation = await Conversation.objects.aget(id=conversation.id)
+    await helpers.acompact_conversation(default_user, compacted_conversation, conversation_log)
+
+    # Assert
+    assert len(compaction_prompts) == 1
+    assert "Question 5" in compaction_prompts[0] and "Question 6" not in compaction_prompts[0]
+    assert compacted_conversation.summary == "Summary 1"
+    assert compacted_conversation.summarized_until_turn_id == "turn-5"
+
+
+@pytest.mark.anyio
+@pytest.mark.django_db(transaction=True)
+async def test_conversation_compaction_summarizes_all_complete_turns_when_keeping_no_recent_chats(
+    default_user: KhojUser, monkeypatch
+):
+    # Arrange
+    conversation = await sync_to_async(ConversationFactory)(user=default_user, conversation_log=generate_turns(4))
+    conversation_log = await sync_to_async(lambda: conversation.conversation_log)()
+    monkeypatch.setenv("KHOJ_COMPACTION_RECENT_CHATS", "0")
+
+    async def fake_send_message_to_model_wrapper(query, **kwargs):
+        return json.dumps({"summary": "Summary", "references": "Notes"})
+
+    monkeypatch.setattr(helpers, "send_message_to_model_wrapper", fake_send_message_to_model_wrapper)
+
+    # Act
+    await helpers.acompact_conversation(default_user, conversation, conversation_log)
+    compacted_conversation = await Conversation.objects.aget(id=conversation.id)
+
+    # Assert
+    assert compacted_conversation.summarized_until_turn_id == "turn-3"
+
+
+@pytest.mark.django_db
+def test_deleting_turn_keeps_conversation_summary_in_sync(default_user: KhojUser, monkeypatch):
+    # Arrange
+    monkeypatch.setenv("KHOJ_CONVERSATION_COMPACTION", "true")
+    conversation = ConversationFactory(user=default_user, conversation_log=generate_turns(6))
+    conversation.summary = "User asked questions 0 to 2."
+    conversation.summarized_until_turn_id = "turn-2"
+    conversation.save()
+
+    # Act
+    ConversationAdapters.delete_message_by_turn_id(default_user, str(conversation.id), "turn-4")
+    conversation = Conversation.objects.get(id=conversation.id)
+    conversation_log = helpers.add_summary_to_conversation_log(conversation, conversation.conversation_log)
+    summary_after_unsummarized_turn_deleted = conversation.summary
+
+    ConversationAdapters.delete_message_by_turn_id(default_user, str(conversation.id), "turn-1")
+    conversation = Conversation.objects.get(id=conversation.id)
+
+    # Assert
+    # Deleting a newer turn keeps the summary of the older turns, and the chats it summarizes
+    assert summary_after_unsummarized_turn_deleted == "User asked questions 0 to 2."
+    assert conversation_log["summary"]["chats"] == 6
+    # Deleting a summarized turn forgets the summary, for it to be rebuilt without the deleted turn
+    assert conversation.summary is None and conversation.summarized_until_turn_id is None
+
+
+@pytest.mark.anyio
+async def test_recall_relevant_chats_within_token_budget(monkeypatch):
+    # Arrange
+    conversation_log = generate_turns(10)
+    conversation_log["chat"][5]["message"] = "Long answer " * 600
+    search_model = SimpleNamespace(name="fake-search-model")
+    recall_queries = []
+
+    async def fake_aget_relevant_turn_ids(conversation, embeddings, search_model, exclude_turn_ids, max_results):
+        recall_queries.append(exclude_turn_ids)
+        return ["turn-6", "turn-2", "turn-1"]
+
+    monkeypatch.setenv("KHOJ_CONVERSATION_RECALL", "true")
+    monkeypatch.setattr(helpers, "get_default_search_model", lambda: search_model)
+    embeddings_model = SimpleNamespace(embed_query=lambda query: [1.0])
+    monkeypatch.setattr(helpers.state, "embeddings_model", {search_model.name: embeddings_model})
+    monkeypatch.setattr(ConversationAdapters, "aget_relevant_turn_ids", fake_aget_relevant_turn_ids)
+
+    # Act
+    conversation_log = await helpers.arecall_relevant_chats(None, None, conversation_log, "Question 1")
+
+    # Assert
+    assert recall_queries == [["turn-8", "turn-8", "turn-9", "turn-9"]]
+    recalled_chats = conversation_log["recall"]["chats"]
+    assert [chat["message"] for chat in recalled_chats] == ["Question 1", "Answer 1", "Question 6", "Answer 6"]
+    assert all("context" not in chat for chat in recalled_chats)
+
+
+@pytest.mark.anyio
+async def test_openai_chat_response_streams_async_with_retries_and_usage(monkeypatch):
+    # Arrange
+    class FakeCompletions:
+        calls = 0
+
+        async def create(self, **kwargs):
+            FakeCompletions.calls += 1
+            if FakeCompletions.calls == 1:
+                raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1"))
+            return fake_response_stream()
+
+    async def fake_response_stream():
+        for text in ["Hello", " there"]:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=2, model_extra={})
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    monkeypatch.setitem(openai_utils.async_openai_clients, "fake-api-key--None", fake_client)
+    monkeypatch.setattr(openai_utils.acreate_chat_completion.retry, "wait", wait_none())
+    completed_responses = []
+    tracer: dict = {}
+
+    # Act
+    response_stream = openai_utils.chat_completion_with_backoff(
+        messages=[ChatMessage(role="user", content="Hi")],
+        model_name="gpt-4o-mini",
+        temperature=0,
+        openai_api_key="fake-api-key",
+        completion_func=lambda chat_response: completed_responses.append(chat_response),
+        tracer=tracer,
+    )
+    chunks = [chunk async for chunk in response_stream]
+
+    # Assert
+    assert chunks == ["Hello", " there"]
+    # Failed request to start the response stream was retried
+    assert FakeCompletions.calls == 2
+    assert completed_responses == ["Hello there"]
+    assert tracer["usage"]["input_tokens"] == 10
+    assert tracer["usage"]["output_tokens"] == 2
+
+
+@pytest.mark.anyio
+async def test_streamed_chat_response_is_saved_when_client_disconnects():
+    # Arrange
+    async def fake_response_stream():
+        for text in ["Hello", " there", " friend"]:
+            yield text
+
+    completed_responses = []
+    response_stream = utils.astream_with_completion(
+        fake_response_stream(), completion_func=lambda chat_response: completed_responses.append(chat_response)
+    )
+
+    # Act
+    chunks = [await response_stream.__anext__(), await response_stream.__anext__()]
+    await response_stream.aclose()
+
+    # Assert
+    assert chunks == ["Hello", " there"]
+    assert completed_responses == ["Hello there"]
+    assert not utils.chat_completions_in_progress
+
+
+def generate_turns(count):
+    conversation_log = {"chat": []}
+    for index in range(count):
+        utils.message_to_log(
+            f"Question {index}",
+            f"Answer {index}",
+            {"created": "2025-02-15 08:00:00", "turnId": f"turn-{index}"},
+            {"context": [{"compiled": f"Note {index}", "file": "notes.org"}], "turnId": f"turn-{index}"},
+            conversation_log=conversation_log["chat"],
+        )
+    return conversation_log
+
+
 def generate_content(count):
     return " ".join([f"{index}" for index, _ in enumerate(range(count))])
 
@@ -1,5 +1,9 @@
+import asyncio
+import logging
 import os
 import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import psutil
@@ -10,8 +14,13 @@ from khoj.processor.embeddings import EmbeddingsModel
 from khoj.processor.tools.online_search import (
     read_webpage_at_url,
     read_webpage_with_olostep,
+    search_with_cache,
 )
+from khoj.routers.helpers import ChatEvent, SpeculativeToolRun
 from khoj.utils import helpers
+from khoj.utils.helpers import ConversationCommand
+from khoj.utils.http import HttpSessionManager
+from khoj.utils.rawconfig import LocationData
 
 
 def test_get_from_null_dict():
@@ -59,6 +68,198 @@ def test_lru_cache():
     assert cache == {"b": 2, "d": 4}
 
 
+def test_concurrent_chat_usage_updates_are_not_lost(monkeypatch):
+    # Arrange
+    get_chat_usage_metrics = helpers.get_chat_usage_metrics
+
+    def slow_get_chat_usage_metrics(*args, **kwargs):
+        time.sleep(0.01)
+        return get_chat_usage_metrics(*args, **kwargs)
+
+    monkeypatch.setattr(helpers, "get_chat_usage_metrics", slow_get_chat_usage_metrics)
+    tracer: dict = {}
+
+    # Act
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for _ in range(8):
+            executor.submit(helpers.update_chat_usage_metrics, tracer, "gpt-4o-mini", input_tokens=10, output_tokens=1)
+
+    # Assert
+    assert tracer["usage"]["input_tokens"] == 80
+    assert tracer["usage"]["output_tokens"] == 8
+
+
+@pytest.mark.asyncio
+async def test_merge_async_generators_runs_generators_concurrently():
+    # Arrange
+    async def tool(name: str, delay: float):
+        yield f"{name} started"
+        await asyncio.sleep(delay)
+        yield f"{name} done"
+
+    async def failing_tool():
+        yield "failing started"
+        raise ValueError("Tool failed")
+
+    # Act
+    start = time.perf_counter()
+    results = [
+        result
+        async for result in helpers.merge_async_generators(
+            {"slow": tool("slow", 0.3), "fast": tool("fast", 0.1), "failing": failing_tool()}
+        )
+    ]
+    elapsed = time.perf_counter() - start
+
+    # Assert
+    items = [item for _, item in results]
+    assert items.index("fast done") < items.index("slow done")
+    assert ("slow", "slow done") in results and ("fast", "fast done") in results
+    failures = [item for key, item in results if isinstance(item, Exception)]
+    assert len(failures) == 1 and str(failures[0]) == "Tool failed"
+    # Slowest generator bounds the run time, not the sum of all generators
+    assert elapsed < 0.35
+
+
+@pytest.mark.asyncio
+async def test_collect_async_generator_defers_status_events_of_tool():
+    # Arrange
+    async def tool(send_status_func):
+        async for event in send_status_func("Searching notes"):
+            yield {"status": event}
+        yield ["note"]
+
+    # Act
+    task = asyncio.create_task(helpers.collect_async_generator(tool(helpers.defer_status_event)))
+    items = await task
+
+    # Assert
+    assert items == [{"status": "Searching notes"}, ["note"]]
+
+
+@pytest.mark.asyncio
+async def test_speculative_tool_run_is_reused_and_replays_status_events_once_when_selected():
+    # Arrange
+    tool_runs = 0
+    sent_statuses = []
+
+    async def search_notes(send_status_func):
+        nonlocal tool_runs
+        tool_runs += 1
+        async for event in send_status_func("Searching notes"):
+            yield {ChatEvent.STATUS: event}
+        yield ["note"]
+
+    async def send_status(message):
+        sent_statuses.append(message)
+        yield f"Sent: {message}"
+
+    speculative_run = SpeculativeToolRun(ConversationCommand.Notes, search_notes(helpers.defer_status_event))
+    await speculative_run.task
+
+    # Act
+    tool_stream = speculative_run.use_if_selected([ConversationCommand.Notes, ConversationCommand.Text], send_status)
+    items = [item async for item in tool_stream]
+
+    # Assert
+    assert tool_runs == 1
+    assert items == [{ChatEvent.STATUS: "Sent: Searching notes"}, ["note"]]
+    assert sent_statuses == ["Searching notes"]
+
+
+@pytest.mark.asyncio
+async def test_speculative_tool_run_is_cancelled_when_not_selected():
+    # Arrange
+    async def search_notes(send_status_func):
+        await asyncio.Event().wait()
+        yield ["note"]
+
+    speculative_run = SpeculativeToolRun(ConversationCommand.Notes, search_notes(helpers.defer_status_event))
+
+    # Act
+    tool_stream = speculative_run.use_if_selected([ConversationCommand.Online], helpers.defer_status_event)
+    with pytest.raises(asyncio.CancelledError):
+        await speculative_run.task
+
+    # Assert
+    assert tool_stream is None
+    assert speculative_run.task.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_speculative_tool_run_failure_is_retrieved_when_not_selected(caplog):
+    # Arrange
+    async def search_notes(send_status_func):
+        raise ValueError("Search failed")
+        yield
+
+    speculative_run = SpeculativeToolRun(ConversationCommand.Notes, search_notes(helpers.defer_status_event))
+    await asyncio.wait([speculative_run.task])
+
+    # Act
+    with caplog.at_level(logging.WARNING):
+        tool_stream = speculative_run.use_if_selected([ConversationCommand.Online], helpers.defer_status_event)
+
+    # Assert
+    assert tool_stream is None
+    assert "Search failed" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_http_session_is_pooled_and_shared_within_event_loop():
+    # Arrange
+    http_sessions = HttpSessionManager(max_connections=20, max_connections_per_host=5, dns_cache_seconds=60)
+
+    # Act
+    session = http_sessions.get_session()
+    shared_session = http_sessions.get_session()
+    await http_sessions.close()
+    new_session = http_sessions.get_session()
+
+    # Assert
+    assert session is shared_session
+    assert session.connector.limit == 20 and session.connector.limit_per_host == 5
+    assert session.timeout.total is None and session.timeout.sock_read is not None
+    assert session.closed
+    assert new_session is not session and not new_session.closed
+    await http_sessions.close()
+
+
+@pytest.mark.asyncio
+async def test_http_session_does_not_limit_connections_per_host_by_default(monkeypatch):
+    # Arrange
+    monkeypatch.delenv("KHOJ_HTTP_MAX_CONNECTIONS_PER_HOST", raising=False)
+    http_sessions = HttpSessionManager()
+
+    # Act
+    session = http_sessions.get_session()
+
+    # Assert
+    assert session.connector.limit_per_host == 0
+    await http_sessions.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_web_search_results_are_cached_by_engine_query_and_country():
+    # Arrange
+    searches = []
+
+    async def search_func(query, location):
+        searches.append((query, location.country_code))
+        return query, {"organic": [{"title": query, "link": "https://khoj.dev"}]} if query != "failing" else {}
+
+    # Act
+    results = []
+    for query, country_code in [("khoj", "US"), ("khoj", "US"), ("khoj", "IN"), ("failing", "US"), ("failing", "US")]:
+        location = LocationData(city=None, region=None, country=None, country_code=country_code)
+        results.append(await search_with_cache("Fake", search_func, query, location))
+
+    # Assert
+    assert searches == [("khoj", "US"), ("khoj", "IN"), ("failing", "US"), ("failing", "US")]
+    assert results[0] == results[1] == ("khoj", {"organic": [{"title": "khoj", "link": "https://khoj.dev"}]})
+
+
 @pytest.mark.skip(reason="Memory leak exists on GPU, MPS devices")
 def test_encode_docs_memory_leak():
     # Arrange
@@ -1,7 +1,12 @@
 import os
+import random
+import re
+import time
 from pathlib import Path
+from typing import Dict, List, Tuple
 
 from khoj.processor.content.markdown.markdown_to_entries import MarkdownToEntries
+from khoj.processor.content.text_to_entries import TextToEntries
 from khoj.utils.fs_syncer import get_markdown_files
 from khoj.utils.rawconfig import TextContentConfig
 
@@ -248,6 +253,46 @@ def test_get_markdown_files(tmp_path):
     assert set(extracted_org_files.keys()) == expected_files
 
 
+def test_heading_tree_parser_matches_legacy_parser_on_corpus():
+    "Single pass heading tree parser should split markdown into the same entries as the legacy recursive parser."
+    # Arrange
+    markdown_dir = Path(__file__).parent / "data" / "markdown"
+    documents = {str(path): path.read_text() for path in sorted(markdown_dir.glob("*.markdown"))}
+    random.seed(42)
+    documents.update({f"generated-{index}.md": generate_nested_markdown(sections=60) for index in range(20)})
+
+    for max_tokens in [3, 12, 50, 256]:
+        for markdown_file, markdown_content in documents.items():
+            # Act
+            expected = legacy_process_single_markdown_file(markdown_content, markdown_file, [], [], max_tokens)
+            actual = MarkdownToEntries.process_single_markdown_file(markdown_content, markdown_file, [], [], max_tokens)
+
+            # Assert
+            assert actual == expected, f"Entries differ for {markdown_file} at max_tokens={max_tokens}"
+
+
+def test_heading_tree_parser_scales_linearly_on_large_vault():
+    "Parsing a large, deeply nested markdown file should scale roughly linearly with its size."
+    # Arrange
+    random.seed(7)
+    small_vault = generate_nested_markdown(sections=1_000, max_depth=30)
+    large_vault = generate_nested_markdown(sections=10_000, max_depth=30)
+
+    # Act
+    start = time.perf_counter()
+    MarkdownToEntries.process_single_markdown_file(small_vault, "small.md", [], [], max_tokens=256)
+    small_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    entries, _ = MarkdownToEntries.process_single_markdown_file(large_vault, "large.md", [], [], max_tokens=256)
+    large_duration = time.perf_counter() - start
+
+    # Assert
+    assert len(entries) > 1_000
+    # 10x the content should take well under 100x the time, i.e parsing is not quadratic in document size
+    assert large_duration < max(small_duration, 0.01) * 40
+
+
 # Helper Functions
 def create_file(tmp_path: Path, entry=None, filename="test.md"):
     markdown_file = tmp_path / filename
@@ -255,3 +300,58 @@ def create_file(tmp_path: Path, entry=None, filename="test.md"):
     if entry:
         markdown_file.write_text(entry)
     return markdown_file
+
+
+def generate_nested_markdown(sections: int, max_depth: int = 6) -> str:
+    "Generate markdown with randomly nested, uniquely titled headings and body text"
+    lines = ["Preamble text before the first heading"]
+    level = 0
+    for index in range(sections):
+        level = random.randint(1, min(level + 1, max_depth))
+        lines.append(f"{'#' * level} Section {index:05d}")
+        lines += [" ".join(f"word{index}-{word}" for word in range(random.randint(0, 40)))] * random.randint(0, 3)
+        if random.random() < 0.2:
+            lines.append("")
+    return "\n".join(lines)
+
+
+def legacy_process_single_markdown_file(
+    markdown_content: str,
+    markdown_file: str,
+    entries: List[str],
+    entry_to_file_map: List[Tuple[str, str]],
+    max_tokens=256,
+    ancestry: Dict[int, str] = {},
+) -> Tuple[List[str], List[Tuple[str, str]]]:
+    "Recursive, regex based markdown section splitter used before the single pass heading tree parser"
+    ancestry_string = "\n".join([f"{'#' * key} {ancestry[key]}" for key in sorted(ancestry.keys())])
+    markdown_content_with_ancestry = f"{ancestry_string}{markdown_content}"
+
+    if len(TextToEntries.tokenizer(markdown_content_with_ancestry)) <= max_tokens or not re.search(
+        rf"^#{{{len(ancestry)+1},}}\s", markdown_content, flags=re.MULTILINE
+    ):
+        entry_to_file_map += [(markdown_content_with_ancestry, markdown_file)]
+        entries.extend([markdown_content_with_ancestry])
+        return entries, entry_to_file_map
+
+    next_heading_level = len(ancestry)
+    sections: List[str] = []
+    while len(sections) < 2:
+        next_heading_level += 1
+        sections = re.split(rf"(\n|^)(?=[#]{{{next_heading_level}}} .+\n?)", markdown_content, flags=re.MULTILINE)
+
+    for section in sections:
+        if section.strip() == "":
+            continue
+        current_ancestry = ancestry.copy()
+        first_line = [line for line in section.split("\n") if line.strip() != ""][0]
+        if re.search(rf"^#{{{next_heading_level}}} ", first_line):
+            current_section_body = "\n".join(section.split(first_line)[1:])
+            current_ancestry[next_heading_level] = first_line[next_heading_level:].strip()
+        else:
+            current_section_body = section
+        legacy_process_single_markdown_file(
+            current_section_body, markdown_file, entries, entry_to_file_map, max_tokens, current_ancestry
+        )
+
+    return entries, entry_to_file_map
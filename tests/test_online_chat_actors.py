@@ -156,14 +156,15 @@ def test_generate_search_query_using_question_and_answer_from_chat_history():
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_chat_with_no_chat_history_or_retrieved_content():
+@pytest.mark.anyio
+async def test_chat_with_no_chat_history_or_retrieved_content():
     # Act
     response_gen = converse_openai(
         references=[],  # Assume no context retrieved from notes for the user_query
         user_query="Hello, my name is Testatron. Who are you?",
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     expected_responses = ["Khoj", "khoj"]
@@ -175,7 +176,8 @@ def test_chat_with_no_chat_history_or_retrieved_content():
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_answer_from_chat_history_and_no_content():
+@pytest.mark.anyio
+async def test_answer_from_chat_history_and_no_content():
     # Arrange
     message_list = [
         ("Hello, my name is Testatron. Who are you?", "Hi, I am Khoj, a personal assistant. How can I help?", []),
@@ -189,7 +191,7 @@ def test_answer_from_chat_history_and_no_content():
         conversation_log=populate_chat_history(message_list),
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     expected_responses = ["Testatron", "testatron"]
@@ -201,7 +203,8 @@ def test_answer_from_chat_history_and_no_content():
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_answer_from_chat_history_and_previously_retrieved_content():
+@pytest.mark.anyio
+async def test_answer_from_chat_history_and_previously_retrieved_content():
     "Chat actor needs to use context in previous notes and chat history to answer question"
     # Arrange
     message_list = [
@@ -220,7 +223,7 @@ def test_answer_from_chat_history_and_previously_retrieved_content():
         conversation_log=populate_chat_history(message_list),
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     assert len(response) > 0
@@ -230,7 +233,8 @@ def test_answer_from_chat_history_and_previously_retrieved_content():
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_answer_from_chat_history_and_currently_retrieved_content():
+@pytest.mark.anyio
+async def test_answer_from_chat_history_and_currently_retrieved_content():
     "Chat actor needs to use context across currently retrieved notes and chat history to answer question"
     # Arrange
     message_list = [
@@ -247,7 +251,7 @@ def test_answer_from_chat_history_and_currently_retrieved_content():
         conversation_log=populate_chat_history(message_list),
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     assert len(response) > 0
@@ -256,7 +260,8 @@ def test_answer_from_chat_history_and_currently_retrieved_content():
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_refuse_answering_unanswerable_question():
+@pytest.mark.anyio
+async def test_refuse_answering_unanswerable_question():
     "Chat actor should not try make up answers to unanswerable questions."
     # Arrange
     message_list = [
@@ -271,7 +276,7 @@ def test_refuse_answering_unanswerable_question():
         conversation_log=populate_chat_history(message_list),
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     expected_responses = [
@@ -291,7 +296,8 @@ def test_refuse_answering_unanswerable_question():
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_answer_requires_current_date_awareness():
+@pytest.mark.anyio
+async def test_answer_requires_current_date_awareness():
     "Chat actor should be able to answer questions relative to current date using provided notes"
     # Arrange
     context = [
@@ -323,7 +329,7 @@ Expenses:Food:Dining  10.00 USD""",
         user_query="What did I have for Dinner today?",
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     expected_responses = ["tacos", "Tacos"]
@@ -335,7 +341,8 @@ Expenses:Food:Dining  10.00 USD""",
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_answer_requires_date_aware_aggregation_across_provided_notes():
+@pytest.mark.anyio
+async def test_answer_requires_date_aware_aggregation_across_provided_notes():
     "Chat actor should be able to answer questions that require date aware aggregation across multiple notes"
     # Arrange
     context = [
@@ -367,7 +374,7 @@ Expenses:Food:Dining  10.00 USD""",
         user_query="How much did I spend on dining this year?",
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     assert len(response) > 0
@@ -376,7 +383,8 @@ Expenses:Food:Dining  10.00 USD""",
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_answer_general_question_not_in_chat_history_or_retrieved_content():
+@pytest.mark.anyio
+async def test_answer_general_question_not_in_chat_history_or_retrieved_content():
     "Chat actor should be able to answer general questions not requiring looking at chat history or notes"
     # Arrange
     message_list = [
@@ -392,7 +400,7 @@ def test_answer_general_question_not_in_chat_history_or_retrieved_content():
         conversation_log=populate_chat_history(message_list),
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     expected_responses = ["test", "bug", "code"]
@@ -404,7 +412,8 @@ def test_answer_general_question_not_in_chat_history_or_retrieved_content():
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_ask_for_clarification_if_not_enough_context_in_question():
+@pytest.mark.anyio
+async def test_ask_for_clarification_if_not_enough_context_in_question():
     "Chat actor should ask for clarification if question cannot be answered unambiguously with the provided context"
     # Arrange
     context = [
@@ -431,7 +440,7 @@ My sister, Aiyla is married to Tolga. They have 3 kids, Yildiz, Ali and Ahmet.""
         user_query="How many kids does my older sister have?",
         api_key=api_key,
     )
-    response = "".join([response_chunk for response_chunk in response_gen])
+    response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert
     expected_responses = [
@@ -448,7 +457,8 @@ My sister, Aiyla is married to Tolga. They have 3 kids, Yildiz, Ali and Ahmet.""
 
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.chatquality
-def test_agent_prompt_should_be_used(openai_agent):
+@pytest.mark.anyio
+async def test_agent_prompt_should_be_used(openai_agent):
     "Chat actor should ask be tuned to think like an accountant based on the agent definition"
     # Arrange
     context = [
@@ -464,14 +474,14 @@ def test_agent_prompt_should_be_used(openai_agent):
         user_query="What did I buy?",
         api_key=api_key,
     )
-    no_agent_response = "".join([response_chunk for response_chunk in response_gen])
+    no_agent_response = "".join([response_chunk async for response_chunk in response_gen])
     response_gen = converse_openai(
         references=context,  # Assume context retrieved from notes for the user_query
         user_query="What did I buy?",
         api_key=api_key,
         agent=openai_agent,
     )
-    agent_response = "".join([response_chunk for response_chunk in response_gen])
+    agent_response = "".join([response_chunk async for response_chunk in response_gen])
 
     # Assert that the model without the agent prompt does not include the summary of purchases
     assert all([expected_response not in no_agent_response for expected_response in expected_responses]), (
@@ -2,23 +2,41 @@
 import asyncio
 import logging
 import os
+import time
 from pathlib import Path
 
 import pytest
 
 from khoj.database.adapters import EntryAdapters
-from khoj.database.models import Entry, GithubConfig, KhojUser, LocalOrgConfig
+from khoj.database.models import (
+    Entry,
+    EntryDates,
+    GithubConfig,
+    GithubRepoConfig,
+    KhojUser,
+    LocalOrgConfig,
+    NotionConfig,
+)
 from khoj.processor.content.docx.docx_to_entries import DocxToEntries
 from khoj.processor.content.github.github_to_entries import GithubToEntries
 from khoj.processor.content.images.image_to_entries import ImageToEntries
 from khoj.processor.content.markdown.markdown_to_entries import MarkdownToEntries
+from khoj.processor.content.notion.notion_to_entries import NotionToEntries
 from khoj.processor.content.org_mode.org_to_entries import OrgToEntries
 from khoj.processor.content.pdf.pdf_to_entries import PdfToEntries
 from khoj.processor.content.plaintext.plaintext_to_entries import PlaintextToEntries
 from khoj.processor.content.text_to_entries import TextToEntries
 from khoj.search_type import text_search
+from khoj.utils import fs_watcher
 from khoj.utils.fs_syncer import collect_files, get_org_files
+from khoj.utils.fs_watcher import (
+    ContentWatcher,
+    get_files_to_reconcile,
+    index_touched_files,
+)
+from khoj.utils.helpers import get_absolute_path
 from khoj.utils.rawconfig import ContentConfig, SearchConfig
+from tests.helpers import FakeGithubApi, FakeNotionApi
 
 logger = logging.getLogger(__name__)
 
@@ -134,6 +152,148 @@ def test_text_index_same_if_content_unchanged(content_config: ContentConfig, def
     assert "Deleting all entries for file type org" not in final_logs
 
 
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_text_index_skips_unchanged_files(
+    org_config_with_only_new_file: LocalOrgConfig, default_user: KhojUser, caplog
+):
+    # Arrange
+    new_file_to_index = Path(org_config_with_only_new_file.input_files[0])
+    with open(new_file_to_index, "w") as f:
+        f.write("* A Chihuahua doing Tango\n- Saw a super cute video of a chihuahua doing the Tango on Youtube\n")
+    data = get_org_files(org_config_with_only_new_file)
+    text_search.setup(OrgToEntries, data, regenerate=False, user=default_user)
+
+    # Act
+    # Run setup again with no changes to file content
+    with caplog.at_level(logging.DEBUG):
+        text_search.setup(OrgToEntries, data, regenerate=False, user=default_user)
+
+    # Assert
+    assert "Skipping 1 unchanged org files" in caplog.text
+    assert "Deleted 0 entries. Created 0 new entries for user " in caplog.records[-1].message
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_collect_files_skips_reading_unchanged_files(
+    org_config_with_only_new_file: LocalOrgConfig, default_user: KhojUser
+):
+    # Arrange
+    new_file_to_index = Path(org_config_with_only_new_file.input_files[0])
+    with open(new_file_to_index, "w") as f:
+        f.write("* A Chihuahua doing Tango\n- Saw a super cute video of a chihuahua doing the Tango on Youtube\n")
+    text_search.setup(OrgToEntries, collect_files(user=default_user)["org"], regenerate=False, user=default_user)
+
+    # Act
+    # First sync after indexing verifies file content is unchanged and records its size, modification time
+    first_sync_files = collect_files(user=default_user, skip_unchanged=True)["org"]
+    second_sync_files = collect_files(user=default_user, skip_unchanged=True)["org"]
+    # Modify file to ensure it is read again
+    with open(new_file_to_index, "a") as f:
+        f.write("* A Poodle doing Salsa\n")
+    third_sync_files = collect_files(user=default_user, skip_unchanged=True)["org"]
+
+    # Assert
+    assert str(new_file_to_index) in first_sync_files
+    assert second_sync_files == {}
+    assert "A Poodle doing Salsa" in third_sync_files[str(new_file_to_index)]
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_index_touched_files_indexes_edited_and_deleted_files(
+    org_config_with_only_new_file: LocalOrgConfig, default_user: KhojUser
+):
+    # Arrange
+    new_file_to_index = get_absolute_path(org_config_with_only_new_file.input_files[0])
+    with open(new_file_to_index, "w") as f:
+        f.write("* A Chihuahua doing Tango\n- Saw a super cute video of a chihuahua doing the Tango on Youtube\n")
+
+    # Act
+    index_touched_files({new_file_to_index})
+    entries_after_edit = Entry.objects.filter(user=default_user, file_path=new_file_to_index).count()
+    Path(new_file_to_index).unlink()
+    index_touched_files({new_file_to_index})
+    entries_after_deletion = Entry.objects.filter(user=default_user, file_path=new_file_to_index).count()
+
+    # Assert
+    assert entries_after_edit > 0
+    assert entries_after_deletion == 0
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_reconcile_finds_files_changed_since_indexed(
+    org_config_with_only_new_file: LocalOrgConfig, default_user: KhojUser
+):
+    # Arrange
+    new_file_to_index = get_absolute_path(org_config_with_only_new_file.input_files[0])
+    with open(new_file_to_index, "w") as f:
+        f.write("* A Chihuahua doing Tango\n- Saw a super cute video of a chihuahua doing the Tango on Youtube\n")
+    index_touched_files({new_file_to_index})
+    # Re-index unchanged file to record its size, modification time
+    index_touched_files({new_file_to_index})
+
+    # Act
+    files_to_reconcile_when_unchanged = get_files_to_reconcile(default_user)
+    with open(new_file_to_index, "a") as f:
+        f.write("* A Poodle doing Salsa\n")
+    files_to_reconcile_when_modified = get_files_to_reconcile(default_user)
+    Path(new_file_to_index).unlink()
+    files_to_reconcile_when_deleted = get_files_to_reconcile(default_user)
+
+    # Assert
+    assert new_file_to_index not in files_to_reconcile_when_unchanged
+    assert new_file_to_index in files_to_reconcile_when_modified
+    assert new_file_to_index in files_to_reconcile_when_deleted
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db(transaction=True)
+def test_content_watcher_debounces_touched_files(monkeypatch):
+    # Arrange
+    indexed_batches = []
+    monkeypatch.setattr(fs_watcher, "index_touched_files", lambda touched_files: indexed_batches.append(touched_files))
+    content_watcher = ContentWatcher(debounce_seconds=0.5)
+
+    # Act
+    content_watcher.touch({"/notes/dogs.org"})
+    content_watcher.touch({"/notes/cats.org", "/notes/dogs.org"})
+    time.sleep(2)
+    content_watcher.stop()
+
+    # Assert
+    assert indexed_batches == [{"/notes/dogs.org", "/notes/cats.org"}]
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db(transaction=True)
+def test_content_watcher_requeues_touched_files_when_index_lock_taken(monkeypatch):
+    # Arrange
+    indexed_batches = []
+    lock_attempts = []
+
+    def run_with_lock(func, operation, **kwargs):
+        # Another process takes the index lock on the first attempt
+        lock_attempts.append(operation)
+        if len(lock_attempts) > 1:
+            func(**kwargs)
+
+    monkeypatch.setattr(fs_watcher, "index_touched_files", lambda touched_files: indexed_batches.append(touched_files))
+    monkeypatch.setattr(fs_watcher.ProcessLockAdapters, "run_with_lock", run_with_lock)
+    content_watcher = ContentWatcher(debounce_seconds=0.2)
+
+    # Act
+    content_watcher.touch({"/notes/dogs.org"})
+    time.sleep(1)
+    content_watcher.stop()
+
+    # Assert
+    assert len(lock_attempts) == 2
+    assert indexed_batches == [{"/notes/dogs.org"}]
+
+
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.django_db
 @pytest.mark.anyio
@@ -444,6 +604,73 @@ def test_update_index_with_deleted_file(
     EntryAdapters.delete_all_entries(default_user)
 
 
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_indexed_data_stats_track_added_and_deleted_entries(content_config: ContentConfig, default_user: KhojUser):
+    # Arrange
+    org_config = LocalOrgConfig.objects.filter(user=default_user).first()
+    data = get_org_files(org_config)
+
+    # Act
+    text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+    stats_after_indexing = EntryAdapters.get_indexed_data_stats(default_user)
+    expected_count = Entry.objects.filter(user=default_user).count()
+    expected_size = EntryAdapters.get_size_in_bytes(Entry.objects.filter(user=default_user))
+
+    EntryAdapters.delete_all_entries(default_user)
+    stats_after_deletion = EntryAdapters.get_indexed_data_stats(default_user)
+
+    # Assert
+    assert expected_count > 0
+    assert stats_after_indexing.entry_count == expected_count
+    assert stats_after_indexing.size_in_bytes == expected_size
+    assert stats_after_deletion.entry_count == 0
+    assert stats_after_deletion.size_in_bytes == 0
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_delete_all_entries_cascades_to_entry_dates(content_config: ContentConfig, default_user: KhojUser):
+    # Arrange
+    org_config = LocalOrgConfig.objects.filter(user=default_user).first()
+    data = get_org_files(org_config)
+    text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+    indexed_entry_dates = EntryDates.objects.filter(entry__user=default_user).count()
+
+    # Act
+    deleted_count = EntryAdapters.delete_all_entries(default_user, file_type=Entry.EntryType.ORG)
+
+    # Assert
+    assert indexed_entry_dates > 0
+    assert deleted_count > 0
+    assert Entry.objects.filter(user=default_user).count() == 0
+    assert EntryDates.objects.filter(entry__user=default_user).count() == 0
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_swap_in_regenerate_replaces_entries_after_indexing(
+    content_config: ContentConfig, default_user: KhojUser, monkeypatch
+):
+    # Arrange
+    monkeypatch.setenv("KHOJ_SWAP_IN_REGENERATE", "true")
+    org_config = LocalOrgConfig.objects.filter(user=default_user).first()
+    data = get_org_files(org_config)
+    text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+    initial_entry_ids = set(Entry.objects.filter(user=default_user).values_list("id", flat=True))
+
+    # Act
+    added_entries, deleted_entries = text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+
+    # Assert
+    regenerated_entry_ids = set(Entry.objects.filter(user=default_user).values_list("id", flat=True))
+    assert len(initial_entry_ids) > 0
+    assert added_entries == deleted_entries == len(initial_entry_ids)
+    assert len(regenerated_entry_ids) == len(initial_entry_ids)
+    assert regenerated_entry_ids.isdisjoint(initial_entry_ids)
+    assert EntryAdapters.get_indexed_data_stats(default_user).entry_count == len(initial_entry_ids)
+
+
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.skipif(os.getenv("GITHUB_PAT_TOKEN") is None, reason="GITHUB_PAT_TOKEN not set")
 def test_text_search_setup_github(content_config: ContentConfig, default_user: KhojUser):
@@ -465,6 +692,170 @@ def test_text_search_setup_github(content_config: ContentConfig, default_user: K
     assert embeddings > 1
 
 
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_github_index_only_downloads_changed_files(
+    content_config: ContentConfig, default_user: KhojUser, fake_github_api: FakeGithubApi
+):
+    # Arrange
+    fake_github_api.files = {
+        "chihuahua.md": "# A Chihuahua doing Tango\nSaw a super cute video of a chihuahua doing the Tango on Youtube\n",
+        "poodle.md": "# A Poodle doing Salsa\nThe poodle had the moves\n",
+        "todo.org": "* TODO Walk the dog\nTake the dog on a long walk in the park\n",
+    }
+    github_config = GithubConfig.objects.create(pat_token="", user=default_user)
+    GithubRepoConfig.objects.create(owner="khoj-ai", name="dogs", branch="master", github_config=github_config)
+    GithubToEntries(github_config).process(files={}, user=default_user)
+    initial_blob_requests = fake_github_api.get_requests("blobs")
+    fake_github_api.requests.clear()
+
+    # Act
+    # Re-index unchanged repo
+    unchanged_sync_counts = GithubToEntries(github_config).process(files={}, user=default_user)
+    unchanged_sync_requests = list(fake_github_api.requests)
+    fake_github_api.requests.clear()
+
+    # Update one file, delete another and re-index repo
+    fake_github_api.files["poodle.md"] = "# A Poodle doing Salsa\nThe poodle danced all night long\n"
+    del fake_github_api.files["todo.org"]
+    GithubToEntries(github_config).process(files={}, user=default_user)
+    changed_sync_blob_requests = fake_github_api.get_requests("blobs")
+
+    # Assert
+    indexed_files = set(Entry.objects.filter(user=default_user, file_type="github").values_list("file_path", flat=True))
+    assert len(initial_blob_requests) == 3
+    assert unchanged_sync_counts == (0, 0)
+    assert unchanged_sync_requests == ["/repos/khoj-ai/dogs/commits/master"]
+    assert len(changed_sync_blob_requests) == 1
+    assert indexed_files == {
+        "https://github.com/khoj-ai/dogs/blob/master/chihuahua.md",
+        "https://github.com/khoj-ai/dogs/blob/master/poodle.md",
+    }
+    assert Entry.objects.filter(user=default_user, file_type="github", raw__contains="danced all night").exists()
+    assert not Entry.objects.filter(user=default_user, file_type="github", raw__contains="had the moves").exists()
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_github_index_retries_files_that_failed_to_index(
+    content_config: ContentConfig, default_user: KhojUser, fake_github_api: FakeGithubApi, monkeypatch
+):
+    # Arrange
+    fake_github_api.files = {
+        "chihuahua.md": "# A Chihuahua doing Tango\nSaw a super cute video of a chihuahua doing the Tango on Youtube\n",
+        "poodle.md": "# A Poodle doing Salsa\nThe poodle had the moves\n",
+    }
+    github_config = GithubConfig.objects.create(pat_token="", user=default_user)
+    repo_config = GithubRepoConfig.objects.create(
+        owner="khoj-ai", name="dogs", branch="master", github_config=github_config
+    )
+    add_entries = EntryAdapters.add_entries
+
+    def add_entries_failing_for_poodle(user, entries):
+        if any("poodle" in entry.file_path for entry in entries):
+            raise ValueError("Failed to add entries")
+        return add_entries(user, entries)
+
+    monkeypatch.setattr(EntryAdapters, "add_entries", add_entries_failing_for_poodle)
+    monkeypatch.setattr(GithubToEntries, "files_per_batch", 1)
+    GithubToEntries(github_config).process(files={}, user=default_user)
+    failed_sync_blob_shas = dict(GithubRepoConfig.objects.get(id=repo_config.id).indexed_blob_shas)
+    monkeypatch.setattr(EntryAdapters, "add_entries", add_entries)
+    fake_github_api.requests.clear()
+
+    # Act
+    GithubToEntries(github_config).process(files={}, user=default_user)
+
+    # Assert
+    indexed_files = set(Entry.objects.filter(user=default_user, file_type="github").values_list("file_path", flat=True))
+    assert list(failed_sync_blob_shas) == ["chihuahua.md"]
+    assert len(fake_github_api.get_requests("blobs")) == 1
+    assert indexed_files == {
+        "https://github.com/khoj-ai/dogs/blob/master/chihuahua.md",
+        "https://github.com/khoj-ai/dogs/blob/master/poodle.md",
+    }
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_github_index_keeps_files_missing_from_truncated_tree(
+    content_config: ContentConfig, default_user: KhojUser, fake_github_api: FakeGithubApi
+):
+    # Arrange
+    fake_github_api.files = {
+        "chihuahua.md": "# A Chihuahua doing Tango\nSaw a super cute video of a chihuahua doing the Tango on Youtube\n",
+        "poodle.md": "# A Poodle doing Salsa\nThe poodle had the moves\n",
+    }
+    github_config = GithubConfig.objects.create(pat_token="", user=default_user)
+    GithubRepoConfig.objects.create(owner="khoj-ai", name="dogs", branch="master", github_config=github_config)
+    GithubToEntries(github_config).process(files={}, user=default_user)
+
+    # Act
+    # Add a file and re-index repo with a tree truncated by Github
+    fake_github_api.files["beagle.md"] = "# A Beagle doing Waltz\nThe beagle waltzed gracefully\n"
+    fake_github_api.truncated_files = {"poodle.md"}
+    GithubToEntries(github_config).process(files={}, user=default_user)
+
+    # Assert
+    indexed_files = set(Entry.objects.filter(user=default_user, file_type="github").values_list("file_path", flat=True))
+    assert indexed_files == {
+        "https://github.com/khoj-ai/dogs/blob/master/chihuahua.md",
+        "https://github.com/khoj-ai/dogs/blob/master/poodle.md",
+        "https://github.com/khoj-ai/dogs/blob/master/beagle.md",
+    }
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_notion_index_only_fetches_edited_pages(
+    content_config: ContentConfig, default_user: KhojUser, fake_notion_api: FakeNotionApi
+):
+    # Arrange
+    make_block = FakeNotionApi.make_block
+    dog_blocks = [
+        make_block(
+            "block-1",
+            "Chihuahuas",
+            "bulleted_list_item",
+            children=[make_block("block-2", "love to dance the Tango"), make_block("block-3", "and the Salsa")],
+        )
+    ]
+    fake_notion_api.add_page("page-1", "Dogs", dog_blocks, last_edited_time="2025-01-01T10:00:00.000Z")
+    fake_notion_api.add_page(
+        "page-2", "Cats", [make_block("block-4", "Cats sleep all day")], last_edited_time="2025-01-01T10:00:00.000Z"
+    )
+    # Ensure rate limited requests are retried
+    fake_notion_api.rate_limited_requests = 2
+    notion_config = NotionConfig.objects.create(token="secret", user=default_user)
+    NotionToEntries(notion_config).process(files={}, user=default_user)
+    initial_sync_entries = Entry.objects.filter(user=default_user, file_type="notion").values_list("raw", flat=True)
+    initial_sync_entries = list(initial_sync_entries)
+    fake_notion_api.requests.clear()
+
+    # Act
+    # Re-index unchanged workspace
+    unchanged_sync_counts = NotionToEntries(notion_config).process(files={}, user=default_user)
+    unchanged_sync_requests = list(fake_notion_api.requests)
+    fake_notion_api.requests.clear()
+
+    # Edit one page, delete another and re-index workspace
+    fake_notion_api.add_page(
+        "page-2", "Cats", [make_block("block-5", "Cats hunt all night")], last_edited_time="2025-02-01T10:00:00.000Z"
+    )
+    del fake_notion_api.pages["page-1"]
+    NotionToEntries(notion_config).process(files={}, user=default_user)
+    edited_sync_requests = list(fake_notion_api.requests)
+
+    # Assert
+    assert any("love to dance the Tango" in entry and "and the Salsa" in entry for entry in initial_sync_entries)
+    assert unchanged_sync_counts == (0, 0)
+    assert unchanged_sync_requests == ["/v1/search"]
+    assert edited_sync_requests == ["/v1/search", "/v1/blocks/page-2/children"]
+    indexed_entries = list(Entry.objects.filter(user=default_user, file_type="notion").values_list("raw", flat=True))
+    assert len(indexed_entries) == 1
+    assert "Cats hunt all night" in indexed_entries[0]
+
+
 def verify_embeddings(expected_count, user):
     embeddings = Entry.objects.filter(user=user, file_type="org").count()
     assert embeddings == expected_count